@@ -1,12 +1,17 @@
-from flask import Flask, request
+import atexit
+from flask import Flask, request, jsonify
 import telegram
-from telegram.ext import Dispatcher, CommandHandler, MessageHandler, Filters
+from telegram.ext import Dispatcher, CommandHandler, MessageHandler, CallbackQueryHandler, Filters
 
-from config.settings import TOKEN, APP_URL
-from database.connection import init_db
+from config.settings import TOKEN, APP_URL, WEBHOOK_MODE, UPDATE_QUEUE_SIZE, UPDATE_WORKERS, UPDATE_MAX_PER_USER
+from database.connection import init_db, get_pool_stats, db_session
+from database.queries import get_catalog_cache_stats
+from database.availability_index import start_availability_index, get_availability_index_stats
 from handlers.commands import start, help_command, spec_list_command, service_list_command
 from handlers.messages import handle_message
+from handlers.booking import show_free_slots
 from handlers.manager import handle_manager_commands
+from handlers.booking_list import bookings_page_callback, CALLBACK_PATTERN as BOOKINGS_PAGE_PATTERN
 from handlers.admin_commands import (
     admin_command_add_service,
     admin_command_add_specialist,
@@ -19,6 +24,26 @@ from handlers.specialist_commands import (
     specialist_command_cancel_booking,
     specialist_command_add_service
 )
+from services.update_queue import UpdateQueue
+from conversation import get_conversation_stats, start_conversation_store, flush_conversation_store
+from services.gpt_client import gpt_client
+from services.intent import get_intent_stats
+from services.name_matcher import get_matcher_stats
+from services.gpt import load_resolution_cache, save_resolution_cache, get_resolution_cache_stats
+from handlers.schedule_management import (
+    add_freetime_command,
+    remove_freetime_command,
+    list_freetime_command,
+    set_schedule_command,
+    clear_schedule_command,
+    day_off_command,
+    extra_hours_command,
+    show_schedule_command
+)
+from services.schedule_materializer import start_schedule_materializer, get_schedule_materializer_stats
+from services.notifications import start_notification_dispatcher, flush_notifications, get_notification_stats
+from services.outbox_relay import start_outbox_relay, get_outbox_relay_stats
+from services.reminders import start_reminder_scheduler, get_reminder_stats
 from utils.logger import logger
 from telegram import BotCommand
 
@@ -31,6 +56,7 @@ def setup_commands(bot_instance):
         BotCommand("help", "Получить справку"),
         BotCommand("service_list", "Показать список услуг"),
         BotCommand("spec_list", "Показать список специалистов"),
+        BotCommand("free_slots", "Ближайшее свободное время"),
         BotCommand("add_service", "Добавить услугу"),
         BotCommand("add_specialist", "Добавить специалиста"),
         BotCommand("add_manager", "Добавить менеджера"),
@@ -43,6 +69,13 @@ def setup_commands(bot_instance):
         BotCommand("add_freetime", "Добавить свободное время"),
         BotCommand("remove_freetime", "Удалить свободное время"),
         BotCommand("list_freetime", "Просмотреть свободное время"),
+        BotCommand("set_schedule", "Задать недельное расписание"),
+        BotCommand("clear_schedule", "Удалить недельное расписание"),
+        BotCommand("day_off", "Выходной на дату"),
+        BotCommand("extra_hours", "Дополнительные часы на дату"),
+        BotCommand("show_schedule", "Показать расписание"),
+        BotCommand("bookings", "Активные записи (для менеджера)"),
+        BotCommand("stats", "Статистика записей (для менеджера)"),
     ]
     bot_instance.set_my_commands(commands)
 
@@ -52,27 +85,75 @@ dispatcher.add_handler(CommandHandler("start", start))
 dispatcher.add_handler(CommandHandler("help", help_command))
 dispatcher.add_handler(CommandHandler("register_manager", handle_manager_commands))
 dispatcher.add_handler(CommandHandler("stop_notifications", handle_manager_commands))
+dispatcher.add_handler(CommandHandler("bookings", handle_manager_commands))
+dispatcher.add_handler(CommandHandler("stats", handle_manager_commands))
 dispatcher.add_handler(CommandHandler("add_service", admin_command_add_service))
 dispatcher.add_handler(CommandHandler("add_specialist", admin_command_add_specialist))
 dispatcher.add_handler(CommandHandler("add_manager", admin_command_add_manager))
 dispatcher.add_handler(CommandHandler("service_list", service_list_command))
 dispatcher.add_handler(CommandHandler("spec_list", spec_list_command))
+dispatcher.add_handler(CommandHandler("free_slots", show_free_slots))
 dispatcher.add_handler(CommandHandler("spec_free_time", specialist_command_free_time))
 dispatcher.add_handler(CommandHandler("spec_appointments", specialist_command_appointments))
 dispatcher.add_handler(CommandHandler("spec_cancel_booking", specialist_command_cancel_booking))
 dispatcher.add_handler(CommandHandler("spec_add_service", specialist_command_add_service))
+dispatcher.add_handler(CommandHandler("add_freetime", add_freetime_command))
+dispatcher.add_handler(CommandHandler("remove_freetime", remove_freetime_command))
+dispatcher.add_handler(CommandHandler("list_freetime", list_freetime_command))
+dispatcher.add_handler(CommandHandler("set_schedule", set_schedule_command))
+dispatcher.add_handler(CommandHandler("clear_schedule", clear_schedule_command))
+dispatcher.add_handler(CommandHandler("day_off", day_off_command))
+dispatcher.add_handler(CommandHandler("extra_hours", extra_hours_command))
+dispatcher.add_handler(CommandHandler("show_schedule", show_schedule_command))
+dispatcher.add_handler(CallbackQueryHandler(bookings_page_callback, pattern=BOOKINGS_PAGE_PATTERN))
 dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
 
+def process_update(update: telegram.Update) -> None:
+    # Одна транзакция и одно соединение с БД на обновление; перед запросами
+    # к GPT она фиксируется, и соединение возвращается в пул
+    with db_session():
+        dispatcher.process_update(update)
+
+update_queue = UpdateQueue(
+    process_update,
+    maxsize=UPDATE_QUEUE_SIZE,
+    workers=UPDATE_WORKERS,
+    max_per_shard=UPDATE_MAX_PER_USER
+)
+
 @app.route(f"/{TOKEN}", methods=["POST"])
 def webhook():
     update = telegram.Update.de_json(request.get_json(force=True), bot)
-    dispatcher.process_update(update)
+    if WEBHOOK_MODE == "queue":
+        if not update_queue.submit(update):
+            # Telegram повторит доставку позже
+            return "Busy", 503
+        return "OK", 200
+    process_update(update)
     return "OK", 200
 
 @app.route("/", methods=["GET"])
 def index():
     return "Бот работает!", 200
 
+@app.route(f"/{TOKEN}/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "db_pool": get_pool_stats(),
+        "catalog_cache": get_catalog_cache_stats(),
+        "availability_index": get_availability_index_stats(),
+        "schedule_materializer": get_schedule_materializer_stats(),
+        "notifications": get_notification_stats(),
+        "outbox_relay": get_outbox_relay_stats(),
+        "reminders": get_reminder_stats(),
+        "update_queue": update_queue.stats(),
+        "gpt": gpt_client.stats(),
+        "intent": get_intent_stats(),
+        "gpt_resolution_cache": get_resolution_cache_stats(),
+        "specialist_matcher": get_matcher_stats(),
+        "conversations": get_conversation_stats()
+    }), 200
+
 def set_webhook():
     url = f"{APP_URL}/{TOKEN}"
     bot.set_webhook(url=url)
@@ -80,6 +161,18 @@ def set_webhook():
 
 if __name__ == "__main__":
     init_db()
+    start_availability_index()
+    start_schedule_materializer()
+    start_notification_dispatcher()
+    atexit.register(flush_notifications)
+    start_outbox_relay()
+    start_reminder_scheduler()
+    load_resolution_cache()
+    atexit.register(save_resolution_cache)
+    start_conversation_store()
+    atexit.register(flush_conversation_store)
+    if WEBHOOK_MODE == "queue":
+        update_queue.start()
     set_webhook()
     setup_commands(bot)
     app.run(host="0.0.0.0", port=5000)
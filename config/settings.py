@@ -8,6 +8,19 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 APP_URL = os.getenv("APP_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GPT_MODEL = os.getenv("GPT_MODEL", "gpt-3.5-turbo")
+# Ограничения запросов к OpenAI
+GPT_TIMEOUT = float(os.getenv("GPT_TIMEOUT", "20"))
+GPT_MAX_RETRIES = int(os.getenv("GPT_MAX_RETRIES", "2"))
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "8"))
+GPT_QUEUE_TIMEOUT = float(os.getenv("GPT_QUEUE_TIMEOUT", "10"))
+# Бюджет токенов промпта determine_intent и доля под сводку ранних реплик
+GPT_PROMPT_TOKEN_BUDGET = int(os.getenv("GPT_PROMPT_TOKEN_BUDGET", "1500"))
+GPT_SUMMARY_TOKEN_BUDGET = int(os.getenv("GPT_SUMMARY_TOKEN_BUDGET", "200"))
+# Кэш результатов resolve_specialist_name / resolve_free_time
+GPT_CACHE_SIZE = int(os.getenv("GPT_CACHE_SIZE", "5000"))
+GPT_CACHE_TTL = float(os.getenv("GPT_CACHE_TTL", "86400"))
+# Путь к файлу для сохранения кэша между перезапусками (пусто — не сохранять)
+GPT_CACHE_PATH = os.getenv("GPT_CACHE_PATH", "")
 
 _MANAGER_CHAT_ID = os.getenv("MANAGER_CHAT_ID")
 try:
@@ -17,6 +30,72 @@ except ValueError:
 
 ADMIN_ID = 561102768
 
+# Пул соединений с PostgreSQL
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))
+
+# Кэш каталога услуг и специалистов (секунды)
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+# История диалогов: "memory" — в памяти процесса, "postgres" — общая для всех реплик
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")
+# Отложенная запись истории в PostgreSQL: период (с) и размер пачки
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5"))
+CONVERSATION_FLUSH_BATCH = int(os.getenv("CONVERSATION_FLUSH_BATCH", "100"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "20"))
+CONVERSATION_MAX_CHARS = int(os.getenv("CONVERSATION_MAX_CHARS", "4000"))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", "21600"))
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Шаг сетки слотов по умолчанию, перерыв между записями (мин) и горизонт поиска свободного времени (дни)
+AVAILABILITY_STEP_MINUTES = int(os.getenv("AVAILABILITY_STEP_MINUTES", "30"))
+AVAILABILITY_BUFFER_MINUTES = int(os.getenv("AVAILABILITY_BUFFER_MINUTES", "0"))
+AVAILABILITY_DAYS = int(os.getenv("AVAILABILITY_DAYS", "7"))
+# Как часто (сек) сверять индекс свободного времени с БД; заодно подхватываются изменения других реплик
+AVAILABILITY_RECONCILE_INTERVAL = float(os.getenv("AVAILABILITY_RECONCILE_INTERVAL", "300"))
+
+# Недельные шаблоны расписания: на сколько дней вперёд разворачивать их в слоты и как часто (сек)
+SCHEDULE_HORIZON_DAYS = int(os.getenv("SCHEDULE_HORIZON_DAYS", "28"))
+SCHEDULE_MATERIALIZE_INTERVAL = float(os.getenv("SCHEDULE_MATERIALIZE_INTERVAL", "900"))
+
+# Сколько записей показывать на одной странице списков /bookings и /spec_appointments
+BOOKINGS_PAGE_SIZE = int(os.getenv("BOOKINGS_PAGE_SIZE", "10"))
+
+# Уведомления менеджерам: рабочие потоки, размер очереди и лимиты Telegram
+# (сообщений в секунду на бота и на один чат), повторы при 429/5xx
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+# Время жизни кэша списка менеджеров и их настроек уведомлений (сек)
+MANAGERS_CACHE_TTL = float(os.getenv("MANAGERS_CACHE_TTL", "60"))
+
+# Рассылка событий по записям из booking_events: размер пачки, как часто проверять
+# таблицу (сек), через сколько секунд выдать неподтверждённое событие снова
+# и сколько дней хранить обработанные события
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "30"))
+
+# Напоминания клиентам: за сколько часов до записи (через запятую), как часто (сек)
+# перечитывать предстоящие записи, насколько (мин) можно опоздать с напоминанием
+# после перезапуска и сколько дней хранить отметки об отправке
+REMINDER_OFFSETS_HOURS = [float(h) for h in os.getenv("REMINDER_OFFSETS_HOURS", "24,2").split(",") if h.strip()]
+REMINDER_RELOAD_INTERVAL = float(os.getenv("REMINDER_RELOAD_INTERVAL", "3600"))
+REMINDER_MISSED_GRACE_MINUTES = int(os.getenv("REMINDER_MISSED_GRACE_MINUTES", "15"))
+REMINDER_RETENTION_DAYS = int(os.getenv("REMINDER_RETENTION_DAYS", "30"))
+
+# Режим вебхука: "inline" — обработка прямо в запросе, "queue" — через очередь
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "queue")
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))
+# Сколько необработанных обновлений одного пользователя может ждать в очереди
+UPDATE_MAX_PER_USER = int(os.getenv("UPDATE_MAX_PER_USER", "20"))
+
 REQUIRED_ENV_VARS = {
     "TOKEN": TOKEN,
     "DATABASE_URL": DATABASE_URL,
@@ -1,9 +1,388 @@
-conversation_history = {}
+import abc
+import collections
+import itertools
+import threading
+import time
+import uuid
+from typing import Deque, Dict, List, Tuple
+import psycopg2
+import psycopg2.extras
+from config.settings import (
+    CONVERSATION_BACKEND,
+    CONVERSATION_MAX_TURNS,
+    CONVERSATION_MAX_CHARS,
+    CONVERSATION_IDLE_TTL,
+    CONVERSATION_MAX_BYTES,
+    CONVERSATION_FLUSH_INTERVAL,
+    CONVERSATION_FLUSH_BATCH
+)
+from database.connection import get_db_connection, get_standalone_connection, after_commit, release_db_session
+from utils.logger import logger
+
+# Сколько пачек может накопиться в буфере, пока БД недоступна
+PENDING_LIMIT_BATCHES = 100
+
+
+class ConversationStore(abc.ABC):
+    """Хранилище истории диалогов: в памяти процесса или общее в PostgreSQL."""
+
+    def start(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def append(self, user_id: int, role: str, content: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def history(self, user_id: int) -> List[Dict]:
+        ...
+
+    @abc.abstractmethod
+    def clear(self, user_id: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    def stats(self) -> Dict:
+        ...
+
+
+class _UserHistory:
+    __slots__ = ('messages', 'chars', 'bytes', 'last_seen')
+
+    def __init__(self, max_turns: int):
+        self.messages: Deque[Dict] = collections.deque(maxlen=max_turns)
+        self.chars = 0
+        self.bytes = 0
+        self.last_seen = time.monotonic()
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    История диалогов в памяти процесса.
+    - на пользователя хранится кольцевой буфер из max_turns сообщений
+      и не больше max_chars символов;
+    - пользователи, неактивные дольше idle_ttl секунд, вытесняются;
+    - при превышении общего объёма max_bytes вытесняются давно не писавшие (LRU).
+    """
+
+    def __init__(self, max_turns: int, max_chars: int, idle_ttl: float, max_bytes: int):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._users: "collections.OrderedDict[int, _UserHistory]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self._evicted_idle = 0
+        self._evicted_lru = 0
+
+    @staticmethod
+    def _size(message: Dict) -> int:
+        return len(message['content'].encode('utf-8'))
+
+    def _drop_oldest_message(self, history: _UserHistory) -> None:
+        dropped = history.messages.popleft()
+        history.chars -= len(dropped['content'])
+        size = self._size(dropped)
+        history.bytes -= size
+        self._total_bytes -= size
+
+    def _remove_user(self, user_id: int) -> None:
+        history = self._users.pop(user_id, None)
+        if history is not None:
+            self._total_bytes -= history.bytes
+
+    def _evict(self, now: float) -> None:
+        # Пользователи упорядочены по последней активности: самые старые в начале
+        while self._users:
+            user_id, history = next(iter(self._users.items()))
+            if now - history.last_seen > self.idle_ttl:
+                self._remove_user(user_id)
+                self._evicted_idle += 1
+            elif self._total_bytes > self.max_bytes and len(self._users) > 1:
+                self._remove_user(user_id)
+                self._evicted_lru += 1
+            else:
+                break
+
+    def append(self, user_id: int, role: str, content: str) -> None:
+        content = content[-self.max_chars:]
+        message = {"role": role, "content": content}
+        now = time.monotonic()
+        with self._lock:
+            history = self._users.get(user_id)
+            if history is None:
+                history = self._users[user_id] = _UserHistory(self.max_turns)
+            else:
+                self._users.move_to_end(user_id)
+            if len(history.messages) == history.messages.maxlen:
+                self._drop_oldest_message(history)
+            history.messages.append(message)
+            size = self._size(message)
+            history.chars += len(content)
+            history.bytes += size
+            self._total_bytes += size
+            while history.chars > self.max_chars and len(history.messages) > 1:
+                self._drop_oldest_message(history)
+            history.last_seen = now
+            self._evict(now)
+
+    def history(self, user_id: int) -> List[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            history = self._users.get(user_id)
+            if history is None:
+                return []
+            if now - history.last_seen > self.idle_ttl:
+                self._remove_user(user_id)
+                self._evicted_idle += 1
+                return []
+            return [dict(m) for m in history.messages]
+
+    def clear(self, user_id: int) -> None:
+        with self._lock:
+            self._remove_user(user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._evict(time.monotonic())
+            return {
+                'backend': 'memory',
+                'users': len(self._users),
+                'turns': sum(len(h.messages) for h in self._users.values()),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'evicted_idle': self._evicted_idle,
+                'evicted_lru': self._evicted_lru
+            }
+
+
+class PostgresConversationStore(ConversationStore):
+    """
+    Общая для всех процессов/реплик история в таблице conversation_messages
+    (только добавление). Запись отложенная: сообщения копятся в буфере и
+    пишутся пачкой фоновым потоком, поэтому сообщение не добавляет синхронного
+    обращения к БД. Чтение берёт последние max_turns сообщений из БД и
+    досыпает ещё не записанные сообщения из буфера, так что обработка
+    обновления всегда видит собственные записи. Очистка истории тоже отложенная:
+    после коммита обновления пользователь ставится в очередь на удаление, и
+    фоновый поток удаляет его сообщения в той же транзакции, что и пишет пачку.
+    """
+
+    def __init__(self, max_turns: int, max_chars: int, idle_ttl: float, flush_interval: float, flush_batch: int):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._pending: List[Tuple[str, int, str, str]] = []
+        # Пользователь -> номер запроса очистки, ещё не выполненного в БД
+        self._clears: Dict[int, int] = {}
+        self._clear_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._flushed = 0
+        self._batches = 0
+        self._flush_errors = 0
+        self._dropped = 0
+        self._flush_time_max = 0.0
+        self._last_prune = time.monotonic()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="conversation-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_prune > self.idle_ttl:
+                    self._prune()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи истории диалогов: {e}", exc_info=True)
+
+    def append(self, user_id: int, role: str, content: str) -> None:
+        content = content[-self.max_chars:]
+        with self._lock:
+            self._pending.append((str(uuid.uuid4()), user_id, role, content))
+            overflow = len(self._pending) - self.flush_batch * PENDING_LIMIT_BATCHES
+            if overflow > 0:
+                # БД недоступна слишком долго: не даём буферу расти бесконечно
+                del self._pending[:overflow]
+                self._dropped += overflow
+            should_wake = len(self._pending) >= self.flush_batch
+        if should_wake:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending[:]
+                clears = dict(self._clears)
+            if not batch and not clears:
+                return
+            started = time.monotonic()
+            conn = get_standalone_connection()
+            cur = conn.cursor()
+            try:
+                if clears:
+                    # Сначала очистка: сообщения из пачки пришли уже после неё
+                    cur.execute("DELETE FROM conversation_messages WHERE user_id = ANY(%s::bigint[])", (list(clears),))
+                if batch:
+                    psycopg2.extras.execute_values(cur, """
+                        INSERT INTO conversation_messages (uid, user_id, role, content)
+                        VALUES %s
+                        ON CONFLICT (uid) DO NOTHING
+                    """, batch)
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                with self._lock:
+                    self._flush_errors += 1
+                logger.error(f"Не удалось записать историю диалогов ({len(batch)} сообщений): {e}")
+                return
+            finally:
+                cur.close()
+                conn.close()
+            elapsed = time.monotonic() - started
+            written = {item[0] for item in batch}
+            with self._lock:
+                # Убираем из буфера только записанное: за время записи могли прийти новые сообщения
+                self._pending = [item for item in self._pending if item[0] not in written]
+                for user_id, clear_id in clears.items():
+                    # Повторная очистка, запрошенная во время записи, остаётся в очереди
+                    if self._clears.get(user_id) == clear_id:
+                        del self._clears[user_id]
+                self._flushed += len(batch)
+                self._batches += 1
+                self._flush_time_max = max(self._flush_time_max, elapsed)
+
+    def _prune(self) -> None:
+        self._last_prune = time.monotonic()
+        conn = get_standalone_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                DELETE FROM conversation_messages
+                WHERE created_at < NOW() - make_interval(secs => %s)
+            """, (self.idle_ttl,))
+            conn.commit()
+            if cur.rowcount:
+                logger.info(f"Удалено {cur.rowcount} устаревших сообщений истории диалогов")
+        finally:
+            cur.close()
+            conn.close()
+
+    def history(self, user_id: int) -> List[Dict]:
+        # Снимок буфера берём до запроса: всё, что из него успеет записаться,
+        # запрос уже увидит, а дубликаты отсекаются по uid
+        with self._lock:
+            pending = [item for item in self._pending if item[1] == user_id]
+            cleared = user_id in self._clears
+        if cleared:
+            # Очистка ещё не дошла до БД: там только удаляемые сообщения
+            return self._trim([{"role": item[2], "content": item[3]} for item in pending])
+        # История нужна для запроса к GPT, перед которым транзакция обновления всё равно
+        # фиксируется. Фиксируем её уже сейчас: в снимке, открытом до записи пачки,
+        # не было бы сообщений, которые успели уйти из буфера
+        release_db_session()
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT uid, role, content FROM (
+                    SELECT id, uid, role, content
+                    FROM conversation_messages
+                    WHERE user_id = %s AND created_at > NOW() - make_interval(secs => %s)
+                    ORDER BY id DESC
+                    LIMIT %s
+                ) last_messages
+                ORDER BY id
+            """, (user_id, self.idle_ttl, self.max_turns))
+            rows = cur.fetchall()
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+        stored = {str(r[0]) for r in rows}
+        messages = [{"role": r[1], "content": r[2]} for r in rows]
+        messages += [{"role": item[2], "content": item[3]} for item in pending if item[0] not in stored]
+        return self._trim(messages)
+
+    def _trim(self, messages: List[Dict]) -> List[Dict]:
+        messages = messages[-self.max_turns:]
+        chars = sum(len(m['content']) for m in messages)
+        while chars > self.max_chars and len(messages) > 1:
+            chars -= len(messages.pop(0)['content'])
+        return messages
+
+    def clear(self, user_id: int) -> None:
+        # Только после коммита обновления: при откате история остаётся
+        after_commit(lambda: self._queue_clear(user_id))
+
+    def _queue_clear(self, user_id: int) -> None:
+        with self._lock:
+            self._pending = [item for item in self._pending if item[1] != user_id]
+            # Пачку, записываемую прямо сейчас, удалит следующая запись
+            self._clears[user_id] = next(self._clear_ids)
+        self._wakeup.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'backend': 'postgres',
+                'pending': len(self._pending),
+                'pending_clears': len(self._clears),
+                'flushed': self._flushed,
+                'batches': self._batches,
+                'flush_errors': self._flush_errors,
+                'dropped': self._dropped,
+                'flush_max_ms': round(self._flush_time_max * 1000, 3)
+            }
+
+
+def create_conversation_store() -> ConversationStore:
+    if CONVERSATION_BACKEND == "postgres":
+        return PostgresConversationStore(
+            max_turns=CONVERSATION_MAX_TURNS,
+            max_chars=CONVERSATION_MAX_CHARS,
+            idle_ttl=CONVERSATION_IDLE_TTL,
+            flush_interval=CONVERSATION_FLUSH_INTERVAL,
+            flush_batch=CONVERSATION_FLUSH_BATCH
+        )
+    return InMemoryConversationStore(
+        max_turns=CONVERSATION_MAX_TURNS,
+        max_chars=CONVERSATION_MAX_CHARS,
+        idle_ttl=CONVERSATION_IDLE_TTL,
+        max_bytes=CONVERSATION_MAX_BYTES
+    )
+
+
+conversation_store = create_conversation_store()
 
 def append_message(user_id: int, role: str, message: str):
-    if user_id not in conversation_history:
-        conversation_history[user_id] = []
-    conversation_history[user_id].append({"role": role, "content": message})
+    conversation_store.append(user_id, role, message)
 
 def get_conversation_history(user_id: int):
-    return conversation_history.get(user_id, [])
+    return conversation_store.history(user_id)
+
+def clear_conversation(user_id: int):
+    conversation_store.clear(user_id)
+
+def get_conversation_stats() -> Dict:
+    return conversation_store.stats()
+
+def start_conversation_store() -> None:
+    conversation_store.start()
+
+def flush_conversation_store() -> None:
+    conversation_store.flush()
@@ -0,0 +1,352 @@
+import bisect
+import datetime
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import psycopg2
+from config.settings import AVAILABILITY_RECONCILE_INTERVAL, AVAILABILITY_BUFFER_MINUTES
+from database.connection import get_standalone_connection, after_commit
+from utils.logger import logger
+
+# Событие изменения расписания: (тип, аргументы)
+Event = Tuple[str, tuple]
+
+
+class _IndexState:
+    """
+    Исходные данные индекса: свободные слоты booking_times, активные записи
+    и длительности услуг. Всё, что показывается клиенту, выводится из них.
+    Между записью и услугой в слоте должно оставаться не меньше buffer.
+    """
+
+    def __init__(self, buffer: datetime.timedelta = datetime.timedelta(0)):
+        self.buffer = buffer
+        self.slots: Dict[Tuple[int, int, datetime.date], Set[datetime.datetime]] = {}
+        self.bookings: Dict[Tuple[int, datetime.date], Set[Tuple[datetime.datetime, int]]] = {}
+        self.durations: Dict[int, int] = {}
+        self.days: Dict[Tuple[int, int], Set[datetime.date]] = {}
+        self.services: Dict[int, Set[int]] = {}
+
+    def add_slot(self, spec_id: int, service_id: int, slot: datetime.datetime) -> None:
+        self.slots.setdefault((spec_id, service_id, slot.date()), set()).add(slot)
+        self.days.setdefault((spec_id, service_id), set()).add(slot.date())
+        self.services.setdefault(spec_id, set()).add(service_id)
+
+    def remove_slot(self, spec_id: int, service_id: int, slot: datetime.datetime) -> None:
+        key = (spec_id, service_id, slot.date())
+        day_slots = self.slots.get(key)
+        if day_slots is None:
+            return
+        day_slots.discard(slot)
+        if not day_slots:
+            del self.slots[key]
+            days = self.days.get((spec_id, service_id))
+            if days is not None:
+                days.discard(slot.date())
+
+    def add_booking(self, spec_id: int, service_id: int, start: datetime.datetime) -> None:
+        self.bookings.setdefault((spec_id, start.date()), set()).add((start, service_id))
+
+    def remove_booking(self, spec_id: int, service_id: int, start: datetime.datetime) -> None:
+        key = (spec_id, start.date())
+        day_bookings = self.bookings.get(key)
+        if day_bookings is None:
+            return
+        day_bookings.discard((start, service_id))
+        if not day_bookings:
+            del self.bookings[key]
+
+    def apply(self, event: Event) -> Tuple[Optional[int], List[datetime.date]]:
+        """
+        Применяет событие. Возвращает специалиста и дни, представления которых
+        нужно пересчитать (специалист None — пересчитать всё).
+        """
+        kind, args = event
+        if kind == "add_slot":
+            spec_id, service_id, slot = args
+            self.add_slot(spec_id, service_id, slot)
+            return spec_id, [slot.date()]
+        if kind == "remove_slot":
+            spec_id, service_id, slot = args
+            self.remove_slot(spec_id, service_id, slot)
+            return spec_id, [slot.date()]
+        if kind == "book":
+            spec_id, service_id, start = args
+            self.remove_slot(spec_id, service_id, start)
+            self.add_booking(spec_id, service_id, start)
+            return spec_id, _affected_days(start)
+        if kind == "cancel":
+            spec_id, service_id, start, slot_freed = args
+            self.remove_booking(spec_id, service_id, start)
+            if slot_freed:
+                self.add_slot(spec_id, service_id, start)
+            return spec_id, _affected_days(start)
+        if kind == "set_duration":
+            service_id, minutes = args
+            self.durations[service_id] = minutes
+            return None, []
+        raise ValueError(f"Неизвестное событие индекса свободного времени: {kind}")
+
+    def busy_intervals(self, spec_id: int, day: datetime.date) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Занятые интервалы специалиста вокруг дня (записи предыдущего, этого и следующего дня),
+        расширенные на buffer с обеих сторон.
+        """
+        intervals = []
+        for booking_day in (day - datetime.timedelta(days=1), day, day + datetime.timedelta(days=1)):
+            for start, service_id in self.bookings.get((spec_id, booking_day), ()):
+                end = start + datetime.timedelta(minutes=self.durations.get(service_id, 0))
+                intervals.append((start - self.buffer, end + self.buffer))
+        intervals.sort()
+        return intervals
+
+    def free_times(self, spec_id: int, service_id: int, day: datetime.date) -> List[datetime.datetime]:
+        """Свободные слоты дня, в которые услуга помещается, не задевая записи специалиста и перерывы вокруг них."""
+        duration = datetime.timedelta(minutes=self.durations.get(service_id, 0))
+        busy = self.busy_intervals(spec_id, day)
+        result = []
+        for slot in sorted(self.slots.get((spec_id, service_id, day), ())):
+            end = slot + duration
+            if any(b_start < end and b_end > slot for b_start, b_end in busy):
+                continue
+            result.append(slot)
+        return result
+
+    def signature(self) -> Tuple[Set, Set, Dict]:
+        """Исходные данные в сравнимом виде, для поиска расхождений."""
+        slots = {(key[0], key[1], slot) for key, values in self.slots.items() for slot in values}
+        bookings = {(key[0], start, service_id) for key, values in self.bookings.items() for start, service_id in values}
+        return slots, bookings, dict(self.durations)
+
+
+def _affected_days(start: datetime.datetime) -> List[datetime.date]:
+    """
+    Дни, слоты которых зависят от записи в start: её день, следующий (запись вечером
+    может заходить на него) и предыдущий (услуга в позднем слоте может задеть запись
+    сразу после полуночи).
+    """
+    day = start.date()
+    return [day - datetime.timedelta(days=1), day, day + datetime.timedelta(days=1)]
+
+
+class AvailabilityIndex:
+    """
+    Индекс свободного времени в памяти процесса по ключу (специалист, услуга, день).
+    - для каждого ключа хранится готовый отсортированный список слотов, в которые
+      услуга помещается целиком; чтение — обращение к словарю без запросов к БД;
+    - пути записи (create_booking, cancel_booking_by_id, add/remove_free_time_slot,
+      set_service_duration) после коммита передают событие, и пересчитываются
+      только затронутые дни одного специалиста;
+    - фоновая сверка раз в reconcile_interval секунд перечитывает данные из БД,
+      считает расхождения и подменяет состояние. Она же подхватывает изменения,
+      сделанные другими процессами/репликами.
+    Пока индекс не загружен, читатели обращаются к БД напрямую.
+    """
+
+    def __init__(self, reconcile_interval: float, buffer_minutes: int = 0):
+        self.reconcile_interval = reconcile_interval
+        self.buffer = datetime.timedelta(minutes=max(0, buffer_minutes))
+        self._lock = threading.Lock()
+        self._state = _IndexState(self.buffer)
+        self._views: Dict[Tuple[int, int, datetime.date], List[datetime.datetime]] = {}
+        self._journal: Optional[List[Event]] = None
+        self._ready = False
+        self._thread = None
+        self._events = 0
+        self._reads = 0
+        self._reconciliations = 0
+        self._reconcile_errors = 0
+        self._drift_repaired = 0
+        self._last_reconcile_ms = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        try:
+            self.reconcile()
+        except psycopg2.Error as e:
+            logger.error(f"Не удалось загрузить индекс свободного времени: {e}")
+        self._thread = threading.Thread(target=self._run, name="availability-reconciler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.reconcile_interval)
+            try:
+                self.reconcile()
+            except Exception as e:
+                with self._lock:
+                    self._reconcile_errors += 1
+                logger.error(f"Ошибка сверки индекса свободного времени: {e}", exc_info=True)
+
+    # --- Изменения ---
+
+    def record(self, kind: str, *args) -> None:
+        """Передаёт событие в индекс после коммита текущей единицы работы."""
+        after_commit(lambda: self._apply((kind, args)))
+
+    def _apply(self, event: Event) -> None:
+        with self._lock:
+            self._events += 1
+            if self._journal is not None:
+                # Идёт перезагрузка: событие повторим поверх нового состояния
+                self._journal.append(event)
+            if not self._ready:
+                return
+            spec_id, days = self._state.apply(event)
+            if spec_id is None:
+                self._rebuild_views()
+            else:
+                for day in days:
+                    self._refresh(spec_id, day)
+
+    def _refresh(self, spec_id: int, day: datetime.date) -> None:
+        for service_id in self._state.services.get(spec_id, ()):
+            key = (spec_id, service_id, day)
+            free = self._state.free_times(spec_id, service_id, day)
+            if free:
+                self._views[key] = free
+            else:
+                self._views.pop(key, None)
+
+    def _rebuild_views(self) -> None:
+        self._views = {}
+        for spec_id, service_id, day in self._state.slots:
+            free = self._state.free_times(spec_id, service_id, day)
+            if free:
+                self._views[(spec_id, service_id, day)] = free
+
+    # --- Сверка с БД ---
+
+    def _load(self) -> _IndexState:
+        today = datetime.date.today()
+        state = _IndexState(self.buffer)
+        conn = get_standalone_connection()
+        cur = conn.cursor()
+        try:
+            # Один снимок на все три запроса
+            conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            cur.execute("SELECT id, duration_minutes FROM services")
+            state.durations = {row[0]: row[1] or 0 for row in cur.fetchall()}
+            cur.execute("""
+                SELECT specialist_id, service_id, slot_time
+                FROM booking_times
+                WHERE is_booked = FALSE AND slot_time >= %s
+            """, (today,))
+            for spec_id, service_id, slot in cur.fetchall():
+                state.add_slot(spec_id, service_id, slot)
+            cur.execute("""
+                SELECT specialist_id, service_id, date_time
+                FROM bookings
+                WHERE date_time >= %s AND status IS DISTINCT FROM 'cancelled'
+            """, (today - datetime.timedelta(days=1),))
+            for spec_id, service_id, start in cur.fetchall():
+                state.add_booking(spec_id, service_id, start)
+            conn.commit()
+        finally:
+            cur.close()
+            try:
+                conn.set_session(isolation_level="DEFAULT", readonly=False)
+            except psycopg2.Error as e:
+                logger.warning(f"Не удалось сбросить параметры сессии: {e}")
+            conn.close()
+        return state
+
+    def reconcile(self) -> int:
+        """Перечитывает данные из БД и подменяет состояние. Возвращает число расхождений."""
+        started = time.monotonic()
+        with self._lock:
+            self._journal = []
+        try:
+            state = self._load()
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            for event in self._journal:
+                state.apply(event)
+            self._journal = None
+            drift = 0
+            if self._ready:
+                old_slots, old_bookings, old_durations = self._state.signature()
+                new_slots, new_bookings, new_durations = state.signature()
+                # Прошедшие дни выпадают из загрузки естественным образом, это не расхождение
+                today = datetime.date.today()
+                old_slots = {s for s in old_slots if s[2].date() >= today}
+                old_bookings = {b for b in old_bookings if b[1].date() >= today - datetime.timedelta(days=1)}
+                drift = len(old_slots ^ new_slots) + len(old_bookings ^ new_bookings) + \
+                    sum(1 for k in old_durations.keys() | new_durations.keys() if old_durations.get(k) != new_durations.get(k))
+            self._state = state
+            self._rebuild_views()
+            self._ready = True
+            self._reconciliations += 1
+            self._drift_repaired += drift
+            self._last_reconcile_ms = (time.monotonic() - started) * 1000
+        if drift:
+            logger.warning(f"Индекс свободного времени расходился с БД в {drift} записях, исправлено")
+        return drift
+
+    # --- Чтение ---
+
+    def free_times(self, spec_id: int, service_id: Optional[int], now: Optional[datetime.datetime] = None
+                   ) -> Optional[List[datetime.datetime]]:
+        """
+        Свободные слоты специалиста (по услуге или по всем услугам, если service_id не указан),
+        начиная с now. None — индекс ещё не загружен.
+        """
+        if not self._ready:
+            return None
+        now = now or datetime.datetime.now()
+        with self._lock:
+            self._reads += 1
+            service_ids = [service_id] if service_id else sorted(self._state.services.get(spec_id, ()))
+            result: List[datetime.datetime] = []
+            for serv_id in service_ids:
+                for day in sorted(self._state.days.get((spec_id, serv_id), ())):
+                    if day < now.date():
+                        continue
+                    day_slots = self._views.get((spec_id, serv_id, day), [])
+                    result.extend(day_slots[bisect.bisect_right(day_slots, now):] if day == now.date() else day_slots)
+        if not service_id:
+            result = sorted(set(result))
+        return result
+
+    def free_times_on(self, spec_id: int, service_id: int, day: datetime.date) -> Optional[List[datetime.datetime]]:
+        """Свободные слоты на конкретный день: одно обращение к словарю."""
+        if not self._ready:
+            return None
+        with self._lock:
+            self._reads += 1
+            return list(self._views.get((spec_id, service_id, day), ()))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'ready': self._ready,
+                'keys': len(self._views),
+                'slots': sum(len(v) for v in self._state.slots.values()),
+                'bookings': sum(len(v) for v in self._state.bookings.values()),
+                'events': self._events,
+                'reads': self._reads,
+                'reconciliations': self._reconciliations,
+                'reconcile_errors': self._reconcile_errors,
+                'drift_repaired': self._drift_repaired,
+                'last_reconcile_ms': round(self._last_reconcile_ms, 1)
+            }
+
+
+availability_index = AvailabilityIndex(
+    reconcile_interval=AVAILABILITY_RECONCILE_INTERVAL,
+    buffer_minutes=AVAILABILITY_BUFFER_MINUTES
+)
+
+def start_availability_index() -> None:
+    availability_index.start()
+
+def get_availability_index_stats() -> Dict:
+    return availability_index.stats()
@@ -1,16 +1,461 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
 import psycopg2
-from config.settings import DATABASE_URL
+import psycopg2.extensions
+from config.settings import (
+    DATABASE_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_HEALTHCHECK_INTERVAL
+)
+from database.migrations import run_migrations
 from utils.logger import logger
 
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений с PostgreSQL.
+    При выдаче соединения проверяет, что оно живое (и пингует его, если оно
+    простаивало дольше healthcheck_interval), битые соединения пересоздаются.
+    Если все соединения заняты, вызывающий поток ждёт не дольше timeout секунд.
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, healthcheck_interval: float):
+        self.dsn = dsn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._idle: List[Tuple[psycopg2.extensions.connection, float]] = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    def open(self) -> None:
+        """Заранее открывает min_size соединений."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        return psycopg2.connect(self.dsn)
+
+    def _is_healthy(self, conn: psycopg2.extensions.connection, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+            finally:
+                cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Соединение из пула не прошло проверку: {e}")
+            return False
+
+    def _discard(self, conn: psycopg2.extensions.connection) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn = None
+            idle_since = 0.0
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Не удалось получить соединение из пула за {self.timeout} с"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except psycopg2.Error:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                with self._cond:
+                    self._reconnects += 1
+                continue
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._checkouts += 1
+                self._checkout_time_total += elapsed
+                self._checkout_time_max = max(self._checkout_time_max, elapsed)
+            return conn
+
+    def putconn(self, conn: psycopg2.extensions.connection) -> None:
+        with self._cond:
+            self._in_use -= 1
+        if not conn.closed:
+            try:
+                # Незавершённая транзакция не должна попасть к следующему владельцу
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error as e:
+                logger.warning(f"Не удалось сбросить соединение перед возвратом в пул: {e}")
+        if conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def stats(self) -> Dict:
+        with self._cond:
+            avg = self._checkout_time_total / self._checkouts if self._checkouts else 0.0
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'max_size': self.max_size,
+                'checkouts': self._checkouts,
+                'checkout_avg_ms': round(avg * 1000, 3),
+                'checkout_max_ms': round(self._checkout_time_max * 1000, 3),
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects
+            }
+
+
+class PooledConnection:
+    """
+    Обёртка над соединением из пула: close() возвращает соединение в пул,
+    остальные атрибуты проксируются к настоящему соединению psycopg2.
+    """
+
+    def __init__(self, pool: ConnectionPool, conn: psycopg2.extensions.connection):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+
+class UnitOfWork:
+    """
+    Единица работы на одно обновление Telegram: все запросы внутри неё идут
+    через одно соединение и одну транзакцию (REPEATABLE READ, т.е. общий снимок
+    для чтений), которая фиксируется один раз в конце.
+    Соединение берётся из пула лениво, при первом обращении к БД.
+    Перед долгим внешним вызовом (GPT) транзакция фиксируется и соединение
+    возвращается в пул (release); следующий запрос откроет новую транзакцию.
+    """
+
+    def __init__(self, pool: "ConnectionPool"):
+        self._pool = pool
+        self.conn: Optional[psycopg2.extensions.connection] = None
+        self._after_commit: List[Callable[[], None]] = []
+        self._savepoint_ids = itertools.count(1)
+        # Номер транзакции внутри единицы работы: точки сохранения старой недействительны
+        self.generation = 0
+
+    def connection(self) -> psycopg2.extensions.connection:
+        if self.conn is None:
+            conn = self._pool.getconn()
+            try:
+                conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+            except psycopg2.Error:
+                self._pool.putconn(conn)
+                raise
+            self.conn = conn
+        return self.conn
+
+    def next_savepoint(self) -> str:
+        return f"uow_{next(self._savepoint_ids)}"
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        self._after_commit.append(callback)
+
+    def release(self) -> None:
+        """Фиксирует текущую транзакцию и отдаёт соединение в пул, не закрывая единицу работы."""
+        if self.conn is not None:
+            self.finish(True)
+
+    def finish(self, success: bool) -> None:
+        conn, self.conn = self.conn, None
+        self.generation += 1
+        callbacks, self._after_commit = self._after_commit, []
+        committed = False
+        if conn is not None:
+            try:
+                if success and not conn.closed and \
+                        conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                    conn.commit()
+                    committed = True
+                elif not conn.closed:
+                    conn.rollback()
+            finally:
+                try:
+                    if not conn.closed:
+                        conn.set_session(isolation_level="DEFAULT")
+                except psycopg2.Error as e:
+                    logger.warning(f"Не удалось сбросить параметры сессии: {e}")
+                self._pool.putconn(conn)
+        else:
+            committed = success
+        if committed:
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Ошибка в обработчике после коммита: {e}", exc_info=True)
+
+
+class SessionCursor:
+    """
+    Курсор внутри единицы работы. Первый запрос функции-запроса открывает
+    точку сохранения (в том же обращении к серверу), чтобы rollback() этой
+    функции откатывал только её собственные изменения.
+    """
+
+    def __init__(self, owner: "SessionConnection", cursor):
+        self._owner = owner
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, vars=None):
+        prefix = self._owner._begin_savepoint()
+        if prefix:
+            query = prefix + query
+        return self._cursor.execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        self._owner._ensure_savepoint(self._cursor)
+        return self._cursor.executemany(query, vars_list)
+
+
+class SessionConnection:
+    """
+    Соединение, выдаваемое функциям-запросам внутри единицы работы:
+    commit() откладывается до конца обновления, rollback() откатывает
+    изменения до точки сохранения, close() не возвращает соединение в пул.
+    Настоящее соединение берётся у единицы работы при каждом обращении,
+    поэтому после release() запросы идут уже через новое.
+    """
+
+    def __init__(self, session: UnitOfWork):
+        self._session = session
+        self._savepoint: Optional[str] = None
+        self._generation = session.generation
+        session.connection()
+
+    def _sync(self) -> None:
+        if self._session.generation != self._generation:
+            # Транзакция, в которой открыта точка сохранения, уже завершена
+            self._generation = self._session.generation
+            self._savepoint = None
+
+    @property
+    def _conn(self) -> psycopg2.extensions.connection:
+        self._sync()
+        return self._session.connection()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs) -> SessionCursor:
+        return SessionCursor(self, self._conn.cursor(*args, **kwargs))
+
+    def _begin_savepoint(self) -> Optional[str]:
+        self._sync()
+        if self._savepoint is not None:
+            return None
+        self._savepoint = self._session.next_savepoint()
+        return f"SAVEPOINT {self._savepoint};\n"
+
+    def _ensure_savepoint(self, cursor) -> None:
+        prefix = self._begin_savepoint()
+        if prefix:
+            cursor.execute(prefix)
+
+    def commit(self) -> None:
+        # Фиксация произойдёт в конце единицы работы
+        self._savepoint = None
+
+    def rollback(self) -> None:
+        conn = self._conn
+        if self._savepoint is None:
+            return
+        savepoint, self._savepoint = self._savepoint, None
+        cur = conn.cursor()
+        try:
+            cur.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+        finally:
+            cur.close()
+
+    def close(self) -> None:
+        self._sync()
+        conn = self._session.conn
+        if self._savepoint is not None and conn is not None and not conn.closed and \
+                conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            self.rollback()
+        self._savepoint = None
+
+
+_local = threading.local()
+
+pool = ConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL
+)
+
 def get_db_connection():
-    return psycopg2.connect(DATABASE_URL)
+    session = getattr(_local, "session", None)
+    if session is not None:
+        return SessionConnection(session)
+    return PooledConnection(pool, pool.getconn())
+
+def get_standalone_connection() -> PooledConnection:
+    """Соединение из пула вне текущей единицы работы (со своей транзакцией)."""
+    return PooledConnection(pool, pool.getconn())
+
+@contextmanager
+def db_session():
+    """
+    Открывает единицу работы для текущего потока. Все вызовы get_db_connection()
+    внутри неё используют одну транзакцию; вложенные вызовы переиспользуют
+    уже открытую единицу работы.
+    """
+    current = getattr(_local, "session", None)
+    if current is not None:
+        yield current
+        return
+    session = UnitOfWork(pool)
+    _local.session = session
+    success = False
+    try:
+        yield session
+        success = True
+    finally:
+        _local.session = None
+        session.finish(success)
+
+@contextmanager
+def outside_db_session():
+    """
+    Временно скрывает единицу работы текущего потока: get_db_connection() внутри
+    выдаёт отдельное соединение из пула с собственной короткой транзакцией,
+    которая видит только зафиксированные данные.
+    """
+    session = getattr(_local, "session", None)
+    _local.session = None
+    try:
+        yield
+    finally:
+        _local.session = session
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """
+    Выполняет callback после фиксации текущей единицы работы,
+    либо сразу, если единица работы не открыта.
+    """
+    session = getattr(_local, "session", None)
+    if session is not None:
+        session.after_commit(callback)
+    else:
+        callback()
+
+def release_db_session() -> None:
+    """
+    Фиксирует транзакцию текущей единицы работы и возвращает её соединение в пул
+    (с выполнением обработчиков после коммита). Вызывается перед долгими внешними
+    вызовами, чтобы соединение не простаивало в открытой транзакции и следующие
+    запросы видели свежий снимок. Без открытой единицы работы ничего не делает.
+    """
+    session = getattr(_local, "session", None)
+    if session is not None:
+        session.release()
+
+def get_pool_stats() -> Dict:
+    return pool.stats()
 
 def init_db():
-    conn = get_db_connection()
+    pool.open()
+    conn = get_standalone_connection()
     cur = conn.cursor()
     try:
         cur.execute("SELECT 1")
+        conn.commit()
         logger.info("Успешное подключение к базе данных")
+        run_migrations(conn)
     except psycopg2.Error as e:
         logger.error(f"Ошибка подключения к БД: {e}")
         raise
@@ -0,0 +1,438 @@
+import datetime
+import json
+from typing import Dict, List, Tuple
+import psycopg2
+from utils.logger import logger
+
+# Ключ advisory-блокировки: миграции применяет только один процесс одновременно
+MIGRATIONS_LOCK_ID = 7_320_020
+
+# Версионированные миграции схемы: (версия, название, операторы).
+# Уже применённые версии записаны в schema_migrations и повторно не выполняются;
+# новые изменения схемы добавляются только новой версией в конец списка.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "baseline", [
+        # Базовые таблицы бота. В существующих базах они уже есть,
+        # поэтому только создаём недостающее
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id BIGINT PRIMARY KEY,
+            name TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS services (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            price NUMERIC(10, 2),
+            duration_minutes INTEGER NOT NULL DEFAULT 60
+        )
+        """,
+        "ALTER TABLE services ADD COLUMN IF NOT EXISTS duration_minutes INTEGER NOT NULL DEFAULT 60",
+        """
+        CREATE TABLE IF NOT EXISTS specialists (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            work_start_time TIME,
+            work_end_time TIME
+        )
+        """,
+        "ALTER TABLE specialists ADD COLUMN IF NOT EXISTS work_start_time TIME",
+        "ALTER TABLE specialists ADD COLUMN IF NOT EXISTS work_end_time TIME",
+        """
+        CREATE TABLE IF NOT EXISTS specialist_services (
+            specialist_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            PRIMARY KEY (specialist_id, service_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS booking_times (
+            id SERIAL PRIMARY KEY,
+            specialist_id BIGINT NOT NULL,
+            service_id INTEGER NOT NULL,
+            slot_time TIMESTAMP NOT NULL,
+            is_booked BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bookings (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            service_id INTEGER NOT NULL,
+            specialist_id BIGINT NOT NULL,
+            date_time TIMESTAMP NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'active'",
+        """
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id BIGINT PRIMARY KEY,
+            step TEXT,
+            service_id INTEGER,
+            specialist_id BIGINT,
+            chosen_time TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS managers (
+            id SERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL UNIQUE,
+            username TEXT,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notification_settings (
+            manager_id INTEGER PRIMARY KEY REFERENCES managers (id) ON DELETE CASCADE,
+            notify_new_booking BOOLEAN NOT NULL DEFAULT TRUE,
+            notify_cancellation BOOLEAN NOT NULL DEFAULT TRUE,
+            notify_reschedule BOOLEAN NOT NULL DEFAULT TRUE
+        )
+        """,
+    ]),
+    (2, "conversation_messages", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            id BIGSERIAL PRIMARY KEY,
+            uid UUID NOT NULL UNIQUE,
+            user_id BIGINT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS conversation_messages_user_id_idx ON conversation_messages (user_id, id)",
+    ]),
+    (3, "schedule_templates", [
+        # Недельные шаблоны расписания: рабочие окна и перерывы по дням недели (0 — понедельник)
+        """
+        CREATE TABLE IF NOT EXISTS schedule_templates (
+            id SERIAL PRIMARY KEY,
+            specialist_id BIGINT NOT NULL,
+            service_id INTEGER NOT NULL,
+            weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            is_break BOOLEAN NOT NULL DEFAULT FALSE,
+            step_minutes INTEGER NOT NULL DEFAULT 30,
+            CHECK (end_time > start_time)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS schedule_templates_specialist_idx ON schedule_templates (specialist_id, service_id)",
+        # Исключения на даты: выходной (весь день или окно) или дополнительные часы;
+        # service_id NULL — для всех услуг специалиста
+        """
+        CREATE TABLE IF NOT EXISTS schedule_exceptions (
+            id SERIAL PRIMARY KEY,
+            specialist_id BIGINT NOT NULL,
+            service_id INTEGER,
+            exception_date DATE NOT NULL,
+            start_time TIME,
+            end_time TIME,
+            is_available BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS schedule_exceptions_date_idx ON schedule_exceptions (exception_date, specialist_id)",
+        # Что и по какому отпечатку уже развёрнуто в booking_times
+        """
+        CREATE TABLE IF NOT EXISTS schedule_materializations (
+            specialist_id BIGINT NOT NULL,
+            service_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            fingerprint TEXT NOT NULL,
+            slots TIMESTAMP[] NOT NULL,
+            materialized_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (specialist_id, service_id, day)
+        )
+        """,
+    ]),
+    (4, "bookings_active_slot_uidx", [
+        # Не больше одной активной записи к специалисту на одно время (в том числе
+        # на разные услуги). Уже существующие дубли отменяются, кроме самой ранней
+        # записи на это время; если индекс всё равно не создать, миграция падает
+        # и будет повторена при следующем запуске
+        """
+        DO $$
+        DECLARE
+            duplicates INTEGER;
+        BEGIN
+            UPDATE bookings b
+            SET status = 'cancelled'
+            WHERE b.status IS DISTINCT FROM 'cancelled'
+              AND EXISTS (
+                  SELECT 1 FROM bookings first
+                  WHERE first.specialist_id = b.specialist_id
+                    AND first.date_time = b.date_time
+                    AND first.status IS DISTINCT FROM 'cancelled'
+                    AND first.id < b.id
+              );
+            GET DIAGNOSTICS duplicates = ROW_COUNT;
+            IF duplicates > 0 THEN
+                RAISE WARNING 'Отменено дублирующих записей в bookings: %', duplicates;
+            END IF;
+        END
+        $$
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS bookings_active_slot_uidx
+            ON bookings (specialist_id, date_time)
+            WHERE status IS DISTINCT FROM 'cancelled'
+        """,
+    ]),
+    (5, "hot_path_indexes", [
+        # Свободные слоты специалиста по услуге (get_available_times, захват слота в create_booking)
+        """
+        CREATE INDEX IF NOT EXISTS booking_times_free_idx
+            ON booking_times (specialist_id, service_id, slot_time)
+            WHERE NOT is_booked
+        """,
+        "CREATE INDEX IF NOT EXISTS bookings_specialist_date_idx ON bookings (specialist_id, date_time)",
+        "CREATE INDEX IF NOT EXISTS bookings_user_date_idx ON bookings (user_id, date_time)",
+        # Общие выборки по времени: статистика за день, загрузка индекса свободного времени
+        "CREATE INDEX IF NOT EXISTS bookings_date_time_idx ON bookings (date_time)",
+        # ON CONFLICT (user_id) в set_user_state требует уникальности; создаём индекс,
+        # только если её ещё ничто не обеспечивает
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                WHERE i.indrelid = 'user_state'::regclass AND i.indisunique
+                    AND i.indnatts = 1 AND a.attname = 'user_id'
+            ) THEN
+                CREATE UNIQUE INDEX user_state_user_id_idx ON user_state (user_id);
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    (6, "booking_daily_stats", [
+        # Дневные сводки записей по специалисту и услуге (день — дата самой записи).
+        # Обновляются в тех же запросах, что создают и отменяют записи
+        """
+        CREATE TABLE IF NOT EXISTS booking_daily_stats (
+            day DATE NOT NULL,
+            specialist_id BIGINT NOT NULL,
+            service_id INTEGER NOT NULL,
+            created INTEGER NOT NULL DEFAULT 0,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, specialist_id, service_id)
+        )
+        """,
+        # Заполнение по существующим записям одним проходом
+        """
+        INSERT INTO booking_daily_stats (day, specialist_id, service_id, created, cancelled)
+        SELECT date_time::date, specialist_id, service_id,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE status = 'cancelled')
+        FROM bookings
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, specialist_id, service_id) DO NOTHING
+        """,
+    ]),
+    (7, "bookings_keyset_indexes", [
+        # Постраничные списки активных записей: курсор (date_time, id) по всем
+        # записям и по специалисту — следующая страница читается прямо с места курсора
+        """
+        CREATE INDEX IF NOT EXISTS bookings_active_keyset_idx
+            ON bookings (date_time, id)
+            WHERE status = 'active'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS bookings_specialist_keyset_idx
+            ON bookings (specialist_id, date_time, id)
+            WHERE status = 'active'
+        """,
+    ]),
+    (8, "booking_events_outbox", [
+        # События по записям пишутся в той же транзакции, что и сама запись,
+        # и рассылаются фоновым обработчиком (services/outbox_relay.py)
+        """
+        CREATE TABLE IF NOT EXISTS booking_events (
+            id BIGSERIAL PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            booking_id INTEGER NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            processed_at TIMESTAMP
+        )
+        """,
+        # Очередь необработанных событий и чистка обработанных
+        """
+        CREATE INDEX IF NOT EXISTS booking_events_pending_idx
+            ON booking_events (id)
+            WHERE processed_at IS NULL
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS booking_events_processed_idx
+            ON booking_events (processed_at)
+            WHERE processed_at IS NOT NULL
+        """,
+    ]),
+    (9, "booking_reminders", [
+        # Отметки об отправленных напоминаниях: строка вставляется до отправки,
+        # поэтому каждое напоминание уходит не больше одного раза на все реплики
+        """
+        CREATE TABLE IF NOT EXISTS booking_reminders (
+            booking_id INTEGER NOT NULL,
+            offset_minutes INTEGER NOT NULL,
+            sent_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (booking_id, offset_minutes)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS booking_reminders_sent_at_idx ON booking_reminders (sent_at)",
+    ]),
+]
+
+
+def run_migrations(conn) -> List[int]:
+    """
+    Применяет недостающие миграции по порядку, каждую в своей транзакции.
+    Возвращает номера применённых версий.
+    """
+    applied: List[int] = []
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        conn.commit()
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        try:
+            cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+            conn.commit()
+            for version, name, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                try:
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    conn.commit()
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    logger.error(f"Миграция {version} ({name}) не применена: {e}")
+                    raise
+                applied.append(version)
+                logger.info(f"Применена миграция {version}: {name}")
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            conn.commit()
+    finally:
+        cur.close()
+    return applied
+
+
+def _sample_params() -> Dict:
+    today = datetime.date.today()
+    return {
+        'specialist_id': 1,
+        'service_id': 1,
+        'user_id': 1,
+        'slot_time': datetime.datetime.combine(today, datetime.time(10, 0)),
+        'day_start': today,
+        'day_end': today + datetime.timedelta(days=1),
+    }
+
+
+# Запросы горячего пути и индексы, которыми они должны пользоваться
+HOT_QUERIES: List[Tuple[str, str, str]] = [
+    ("get_service_slot_data slots", """
+        SELECT slot_time FROM booking_times
+        WHERE specialist_id = %(specialist_id)s AND service_id = %(service_id)s AND is_booked = FALSE
+            AND slot_time >= %(day_start)s AND slot_time < %(day_end)s
+    """, "booking_times_free_idx"),
+    # Захват слота из create_booking как есть: EXPLAIN без ANALYZE его не выполняет
+    ("create_booking claim", """
+        UPDATE booking_times
+        SET is_booked = TRUE
+        WHERE specialist_id = %(specialist_id)s AND service_id = %(service_id)s
+            AND slot_time = %(slot_time)s AND is_booked = FALSE
+        RETURNING specialist_id, service_id, slot_time
+    """, "booking_times_free_idx"),
+    ("get_user_bookings", """
+        SELECT id FROM bookings
+        WHERE user_id = %(user_id)s AND date_time > NOW()
+    """, "bookings_user_date_idx"),
+    ("get_booking_stats by specialist", """
+        SELECT specialist_id, SUM(created - cancelled) FROM booking_daily_stats
+        WHERE day >= %(day_start)s AND day < %(day_end)s
+        GROUP BY specialist_id
+    """, "booking_daily_stats_pkey"),
+    ("get_bookings_page", """
+        SELECT id FROM bookings
+        WHERE status = 'active' AND date_time > NOW()
+            AND (date_time, id) > (%(slot_time)s, 0)
+        ORDER BY date_time, id
+        LIMIT 11
+    """, "bookings_active_keyset_idx"),
+    ("get_bookings_page by specialist", """
+        SELECT id FROM bookings
+        WHERE status = 'active' AND date_time > NOW() AND specialist_id = %(specialist_id)s
+            AND (date_time, id) > (%(slot_time)s, 0)
+        ORDER BY date_time, id
+        LIMIT 11
+    """, "bookings_specialist_keyset_idx"),
+    ("claim_booking_events", """
+        SELECT id FROM booking_events
+        WHERE processed_at IS NULL AND available_at <= NOW()
+        ORDER BY id
+        LIMIT 100
+    """, "booking_events_pending_idx"),
+    ("get_reminder_bookings", """
+        SELECT id FROM bookings
+        WHERE status = 'active' AND date_time > %(day_start)s AND date_time <= %(day_end)s
+    """, "bookings_active_keyset_idx"),
+    ("get_user_state", """
+        SELECT step FROM user_state WHERE user_id = %(user_id)s
+    """, None),
+]
+
+
+def _plan_indexes(plan: Dict) -> List[str]:
+    names = []
+    if plan.get("Index Name"):
+        names.append(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names += _plan_indexes(child)
+    return names
+
+
+def explain_hot_queries(conn) -> Dict[str, Dict]:
+    """
+    EXPLAIN для запросов горячего пути: проверяет, что условие допускает
+    использование индекса. Последовательное сканирование на время проверки
+    запрещено, иначе на маленьких таблицах планировщик выбирает его всегда.
+    Возвращает {запрос: {'indexes': [...], 'ok': bool}}.
+    """
+    params = _sample_params()
+    report: Dict[str, Dict] = {}
+    cur = conn.cursor()
+    try:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for name, query, expected in HOT_QUERIES:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            indexes = _plan_indexes(plan[0]["Plan"])
+            ok = bool(indexes) if expected is None else expected in indexes
+            report[name] = {'indexes': indexes, 'expected': expected, 'ok': ok}
+            if not ok:
+                logger.warning(f"Запрос {name} не использует индекс {expected or ''}: {indexes}")
+        conn.rollback()
+    finally:
+        cur.close()
+    return report
@@ -1,9 +1,80 @@
-from typing import List, Tuple, Optional, Dict
+from typing import Any, Callable, List, Tuple, Optional, Dict
 import datetime
+import io
+import json
 import psycopg2
-from database.connection import get_db_connection
+from config.settings import CATALOG_CACHE_TTL, BOOKINGS_PAGE_SIZE
+from database.connection import get_db_connection, after_commit, outside_db_session
+from database.availability_index import availability_index
+from utils.cache import TTLCache
+from conversation import clear_conversation
 from utils.logger import logger
 
+# Каталог (услуги, специалисты, длительности, рабочие часы и готовые тексты
+# списков) меняется только через команды администратора/специалиста,
+# поэтому кэшируем его и сбрасываем кэш на этих путях записи.
+catalog_cache = TTLCache(ttl=CATALOG_CACHE_TTL, name="catalog")
+
+# С какого числа слотов загружать их через COPY, а не одним INSERT с массивом
+SLOT_COPY_THRESHOLD = 500
+# Результаты create_booking
+BOOKING_CREATED = "created"
+BOOKING_SLOT_TAKEN = "slot_taken"
+BOOKING_FAILED = "failed"
+
+# Содержимое события в booking_events для строки записи b (имена на момент события)
+BOOKING_EVENT_PAYLOAD = """
+    jsonb_build_object(
+        'user_id', b.user_id,
+        'user_name', (SELECT u.name FROM users u WHERE u.telegram_id = b.user_id),
+        'service', (SELECT s.title FROM services s WHERE s.id = b.service_id),
+        'specialist', (SELECT sp.name FROM specialists sp WHERE sp.id = b.specialist_id),
+        'date_time', to_char(b.date_time, 'YYYY-MM-DD HH24:MI')
+    )
+"""
+
+# Ключ advisory-блокировки фонового разворачивания шаблонов расписания
+SCHEDULE_MATERIALIZER_LOCK_ID = 7_320_018
+
+# Подписчики на создание и отмену записей из других слоёв (напоминания);
+# вызываются после коммита: callback(вид, запись)
+_booking_listeners: List[Callable[[str, Dict], None]] = []
+
+def add_booking_listener(callback: Callable[[str, Dict], None]) -> None:
+    _booking_listeners.append(callback)
+
+def _emit_booking_change(kind: str, booking: Dict) -> None:
+    def run():
+        for callback in list(_booking_listeners):
+            try:
+                callback(kind, booking)
+            except Exception as e:
+                logger.error(f"Ошибка в подписчике на изменения записей: {e}", exc_info=True)
+    if _booking_listeners:
+        after_commit(run)
+
+def invalidate_catalog() -> None:
+    # Сбрасываем после коммита, чтобы другой поток не закэшировал старые данные
+    after_commit(catalog_cache.clear)
+
+def _catalog_get_or_load(key: tuple, loader: Callable[[], Any]) -> Any:
+    """
+    Читает каталог из кэша, при промахе загружает вне единицы работы обновления:
+    её снимок может быть старше последнего изменения каталога, а её транзакция —
+    содержать незафиксированные (и, возможно, откатываемые) изменения.
+    """
+    def load():
+        with outside_db_session():
+            return loader()
+    return catalog_cache.get_or_load(key, load)
+
+def get_catalog_text(name: str, render: Callable[[], str]) -> str:
+    """Возвращает закэшированный текст списка каталога, при промахе строит его через render()."""
+    return _catalog_get_or_load(("text", name), render)
+
+def get_catalog_cache_stats() -> Dict:
+    return catalog_cache.stats()
+
 def get_user_state(user_id: int) -> Optional[Dict]:
     conn = get_db_connection()
     cur = conn.cursor()
@@ -52,41 +123,41 @@ def get_user_bookings(user_id: int) -> List[Dict]:
         cur.close()
         conn.close()
 
-def get_services() -> List[Tuple[int, str]]:
-    conn = None
-    cur = None
+def _fetch_services() -> List[Tuple[int, str]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
         cur.execute("SELECT id, title FROM services ORDER BY id;")
         return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+def get_services() -> List[Tuple[int, str]]:
+    try:
+        return _catalog_get_or_load(("services",), _fetch_services)
     except Exception as e:
         logger.error(f"Ошибка при получении списка услуг: {e}")
         return []
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
 def find_service_by_name(user_text: str) -> Optional[Tuple[int, str]]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, title FROM services WHERE LOWER(title) = LOWER(%s)", (user_text,))
-        service = cur.fetchone()
-        if service:
-            return service
-        cur.execute("SELECT id, title FROM services WHERE LOWER(title) LIKE LOWER(%s)", (f"%{user_text}%",))
-        matches = cur.fetchall()
-        if matches:
-            return matches[0]
+    # Ищем по закэшированному каталогу: сначала точное совпадение, затем подстрока
+    needle = user_text.strip().lower()
+    if not needle:
         return None
-    finally:
-        cur.close()
-        conn.close()
+    services = get_services()
+    for service in services:
+        if service[1].lower() == needle:
+            return service
+    for service in services:
+        if needle in service[1].lower():
+            return service
+    return None
 
 def get_specialists(service_id: Optional[int] = None) -> List[Tuple[int, str]]:
+    return _catalog_get_or_load(("specialists", service_id or None), lambda: _fetch_specialists(service_id))
+
+def _fetch_specialists(service_id: Optional[int] = None) -> List[Tuple[int, str]]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -105,46 +176,78 @@ def get_specialists(service_id: Optional[int] = None) -> List[Tuple[int, str]]:
         cur.close()
         conn.close()
 
-def get_available_times(spec_id: int, serv_id: int) -> List[str]:
+def get_specialist_service_ids(specialist_id: int) -> List[int]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
-            SELECT slot_time
-            FROM booking_times
-            WHERE specialist_id = %s AND service_id = %s AND is_booked = FALSE
-            ORDER BY slot_time
-        """, (spec_id, serv_id))
-        rows = cur.fetchall()
-        return [r[0].strftime("%Y-%m-%d %H:%M") for r in rows]
+            SELECT service_id FROM specialist_services
+            WHERE specialist_id = %s
+            ORDER BY service_id
+        """, (specialist_id,))
+        return [row[0] for row in cur.fetchall()]
     finally:
         cur.close()
         conn.close()
 
-def create_booking(user_id: int, serv_id: int, spec_id: int, date_str: str) -> bool:
+def create_booking(user_id: int, serv_id: int, spec_id: int, date_str: str) -> str:
+    """
+    Атомарно занимает слот, создаёт запись, учитывает её в дневной сводке
+    и пишет событие в booking_events одним запросом.
+    Слот занимается, только если он ещё свободен (условный UPDATE ... RETURNING,
+    блокируется лишь строка слота), а уникальный индекс на активные записи
+    не даёт записать двоих на одно время, даже если слота в booking_times нет.
+    Возвращает BOOKING_CREATED, BOOKING_SLOT_TAKEN или BOOKING_FAILED.
+    """
     try:
         chosen_dt = datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M")
     except ValueError:
         logger.error(f"Неверный формат даты: {date_str}")
-        return False
+        return BOOKING_FAILED
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            UPDATE booking_times
-            SET is_booked = TRUE
-            WHERE specialist_id = %s AND service_id = %s AND slot_time = %s
-        """, (spec_id, serv_id, chosen_dt))
-        cur.execute("""
-            INSERT INTO bookings (user_id, service_id, specialist_id, date_time)
-            VALUES (%s, %s, %s, %s)
-        """, (user_id, serv_id, spec_id, chosen_dt))
+        cur.execute(f"""
+            WITH claimed AS (
+                UPDATE booking_times
+                SET is_booked = TRUE
+                WHERE specialist_id = %s AND service_id = %s AND slot_time = %s AND is_booked = FALSE
+                RETURNING specialist_id, service_id, slot_time
+            ), inserted AS (
+                INSERT INTO bookings (user_id, service_id, specialist_id, date_time)
+                SELECT %s, service_id, specialist_id, slot_time FROM claimed
+                ON CONFLICT DO NOTHING
+                RETURNING id, user_id, specialist_id, service_id, date_time
+            ), rollup AS (
+                INSERT INTO booking_daily_stats (day, specialist_id, service_id, created)
+                SELECT date_time::date, specialist_id, service_id, 1 FROM inserted
+                ON CONFLICT (day, specialist_id, service_id) DO UPDATE
+                SET created = booking_daily_stats.created + 1
+            ), event AS (
+                INSERT INTO booking_events (event_type, booking_id, payload)
+                SELECT 'new_booking', b.id, {BOOKING_EVENT_PAYLOAD} FROM inserted b
+            )
+            SELECT id FROM inserted
+        """, (spec_id, serv_id, chosen_dt, user_id))
+        row = cur.fetchone()
+        if row is None:
+            # Слот уже занят (или запись на это время уже есть): откатываем захват
+            conn.rollback()
+            availability_index.record("remove_slot", spec_id, serv_id, chosen_dt)
+            return BOOKING_SLOT_TAKEN
         conn.commit()
-        return True
+        availability_index.record("book", spec_id, serv_id, chosen_dt)
+        _emit_booking_change("book", {'id': row[0], 'user_id': user_id, 'date_time': chosen_dt})
+        return BOOKING_CREATED
+    except psycopg2.extensions.TransactionRollbackError as e:
+        # Конкурентная запись того же слота в REPEATABLE READ: слот забрал другой клиент
+        logger.info(f"Слот {chosen_dt} у специалиста {spec_id} заняли параллельно: {e}")
+        conn.rollback()
+        return BOOKING_SLOT_TAKEN
     except Exception as e:
         logger.error(f"Error in create_booking: {e}")
         conn.rollback()
-        return False
+        return BOOKING_FAILED
     finally:
         cur.close()
         conn.close()
@@ -162,6 +265,7 @@ def create_service(service_name: str, price: float) -> bool:
             VALUES (%s, %s)
         """, (service_name, price))
         conn.commit()
+        invalidate_catalog()
         return True
     except Exception as e:
         logger.error(f"Ошибка в create_service: {e}")
@@ -181,6 +285,7 @@ def create_specialist(specialist_name: str) -> bool:
             return False
         cur.execute("INSERT INTO specialists (name) VALUES (%s)", (specialist_name,))
         conn.commit()
+        invalidate_catalog()
         return True
     except Exception as e:
         logger.error(f"Ошибка в create_specialist: {e}")
@@ -234,6 +339,7 @@ def add_service_to_specialist(spec_id: int, serv_id: int) -> str:
             VALUES (%s, %s)
         """, (spec_id, serv_id))
         conn.commit()
+        invalidate_catalog()
         return f"Услуга (id={serv_id}) добавлена к специалисту (id={spec_id})!"
     except Exception as e:
         conn.rollback()
@@ -244,6 +350,9 @@ def add_service_to_specialist(spec_id: int, serv_id: int) -> str:
         conn.close()
 
 def get_service_duration(service_id: int) -> int:
+    return _catalog_get_or_load(("duration", service_id), lambda: _fetch_service_duration(service_id))
+
+def _fetch_service_duration(service_id: int) -> int:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -267,6 +376,8 @@ def set_service_duration(service_id: int, duration_minutes: int) -> bool:
             conn.rollback()
             return False
         conn.commit()
+        invalidate_catalog()
+        availability_index.record("set_duration", service_id, duration_minutes)
         return True
     except Exception as e:
         logger.error(f"Ошибка в set_service_duration: {e}")
@@ -277,6 +388,9 @@ def set_service_duration(service_id: int, duration_minutes: int) -> bool:
         conn.close()
 
 def get_specialist_work_hours(specialist_id: int) -> Tuple[Optional[datetime.time], Optional[datetime.time]]:
+    return _catalog_get_or_load(("work_hours", specialist_id), lambda: _fetch_specialist_work_hours(specialist_id))
+
+def _fetch_specialist_work_hours(specialist_id: int) -> Tuple[Optional[datetime.time], Optional[datetime.time]]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -289,52 +403,118 @@ def get_specialist_work_hours(specialist_id: int) -> Tuple[Optional[datetime.tim
         cur.close()
         conn.close()
 
-def get_bookings_for_specialist_on_date(specialist_id: int, date_obj: datetime.date) -> List[Dict]:
+def get_service_slot_data(service_id: int, start_dt: datetime.datetime, end_dt: datetime.datetime) -> Dict[int, Dict]:
+    """
+    Одним запросом загружает свободные слоты услуги за период у всех специалистов,
+    которые её оказывают, вместе с их записями (для проверки, помещается ли услуга в слот).
+    Возвращает {specialist_id: {'name', 'slots': [datetime], 'bookings': [(start_dt, duration_minutes)]}}.
+    """
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
-            SELECT b.date_time, s.duration_minutes
-            FROM bookings b
-            JOIN services s ON b.service_id = s.id
-            WHERE b.specialist_id = %s AND DATE(b.date_time) = %s
-            ORDER BY b.date_time
-        """, (specialist_id, date_obj))
-        rows = cur.fetchall()
-        bookings = []
-        for row in rows:
-            start_dt = row[0]
-            duration = row[1]
-            bookings.append({'start': start_dt, 'duration': duration})
-        return bookings
+            WITH providers AS (
+                SELECT sp.id, sp.name
+                FROM specialists sp
+                JOIN specialist_services ss ON ss.specialist_id = sp.id
+                WHERE ss.service_id = %(service_id)s
+            )
+            SELECT 'slot', p.id, p.name, bt.slot_time, NULL
+            FROM providers p
+            JOIN booking_times bt
+                ON bt.specialist_id = p.id AND bt.service_id = %(service_id)s
+                AND bt.is_booked = FALSE
+                AND bt.slot_time >= %(start)s AND bt.slot_time < %(end)s
+            UNION ALL
+            SELECT 'booking', p.id, p.name, b.date_time, s.duration_minutes
+            FROM providers p
+            JOIN bookings b
+                ON b.specialist_id = p.id
+                AND b.date_time >= %(busy_start)s AND b.date_time < %(busy_end)s
+                AND b.status IS DISTINCT FROM 'cancelled'
+            LEFT JOIN services s ON b.service_id = s.id
+            ORDER BY 2, 4
+        """, {
+            'service_id': service_id,
+            'start': start_dt,
+            'end': end_dt,
+            'busy_start': start_dt - datetime.timedelta(days=1),
+            # Услуга в последнем слоте периода может заходить на записи после его конца
+            'busy_end': end_dt + datetime.timedelta(days=1)
+        })
+        result: Dict[int, Dict] = {}
+        for kind, spec_id, name, moment, duration in cur.fetchall():
+            entry = result.setdefault(spec_id, {
+                'name': name,
+                'slots': [],
+                'bookings': []
+            })
+            if kind == 'slot':
+                entry['slots'].append(moment)
+            else:
+                entry['bookings'].append((moment, duration or 0))
+        return result
     finally:
         cur.close()
         conn.close()
 
-def get_bookings_for_specialist(specialist_id: int) -> List[Dict]:
+def get_bookings_page(specialist_id: Optional[int] = None,
+                      cursor: Optional[Tuple[datetime.datetime, int]] = None,
+                      backward: bool = False, limit: int = BOOKINGS_PAGE_SIZE) -> Dict:
+    """
+    Страница предстоящих активных записей (всех или одного специалиста) по курсору (date_time, id).
+    Вперёд — записи строго после курсора, назад — строго перед ним; читается
+    не больше limit + 1 строк, лишняя строка лишь показывает, есть ли ещё страница.
+    Возвращает {'bookings': [...], 'has_prev': bool, 'has_next': bool}.
+    """
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            SELECT b.id, b.date_time, s.title as service_name, u.name as user_name
+        conditions = ["b.status = 'active'", "b.date_time > NOW()"]
+        params: List = []
+        if specialist_id is not None:
+            conditions.append("b.specialist_id = %s")
+            params.append(specialist_id)
+        if cursor is not None:
+            conditions.append("(b.date_time, b.id) < (%s, %s)" if backward else "(b.date_time, b.id) > (%s, %s)")
+            params += [cursor[0], cursor[1]]
+        order = "DESC" if backward else "ASC"
+        cur.execute(f"""
+            SELECT b.id, b.date_time, b.user_id, u.name, s.title, sp.name
             FROM bookings b
             JOIN services s ON b.service_id = s.id
-            JOIN users u ON b.user_id = u.telegram_id
-            WHERE b.specialist_id = %s AND b.date_time > NOW()
-            ORDER BY b.date_time
-        """, (specialist_id,))
+            JOIN specialists sp ON b.specialist_id = sp.id
+            LEFT JOIN users u ON b.user_id = u.telegram_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY b.date_time {order}, b.id {order}
+            LIMIT %s
+        """, params + [limit + 1])
         rows = cur.fetchall()
-        return [{
-            "booking_id": r[0],
-            "date_time": r[1].strftime("%Y-%m-%d %H:%M"),
-            "service_name": r[2],
-            "user_name": r[3],
-        } for r in rows]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return {
+            'bookings': [{
+                'id': r[0],
+                'date_time': r[1],
+                'user_id': r[2],
+                'user_name': r[3],
+                'service_name': r[4],
+                'specialist_name': r[5]
+            } for r in rows],
+            # Курсор есть только после перехода, значит с той стороны записи были
+            'has_prev': more if backward else cursor is not None,
+            'has_next': cursor is not None if backward else more
+        }
     finally:
         cur.close()
         conn.close()
 
 def get_service_name(service_id: int) -> Optional[str]:
+    return _catalog_get_or_load(("service_name", service_id), lambda: _fetch_service_name(service_id))
+
+def _fetch_service_name(service_id: int) -> Optional[str]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -346,6 +526,9 @@ def get_service_name(service_id: int) -> Optional[str]:
         conn.close()
 
 def get_specialist_name(specialist_id: int) -> Optional[str]:
+    return _catalog_get_or_load(("specialist_name", specialist_id), lambda: _fetch_specialist_name(specialist_id))
+
+def _fetch_specialist_name(specialist_id: int) -> Optional[str]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -356,33 +539,29 @@ def get_specialist_name(specialist_id: int) -> Optional[str]:
         cur.close()
         conn.close()
 
-def find_available_specialist(service_id: int, exclude_specialist_id: int) -> Optional[Tuple[int, str]]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT s.id, s.name
-            FROM specialists s
-            JOIN specialist_services ss ON s.id = ss.specialist_id
-            JOIN booking_times bt ON s.id = bt.specialist_id
-            WHERE ss.service_id = %s AND s.id != %s AND bt.is_booked = FALSE
-            LIMIT 1
-        """, (service_id, exclude_specialist_id))
-        result = cur.fetchone()
-        return result if result else None
-    finally:
-        cur.close()
-        conn.close()
-
 def cancel_booking_by_id(booking_id: int) -> Tuple[bool, str]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        # Проверяем, существует ли запись
-        cur.execute("""
-            SELECT specialist_id, service_id, date_time
-            FROM bookings
-            WHERE id = %s
+        # Удаляем запись, учитываем отмену в дневной сводке и пишем событие одним запросом
+        cur.execute(f"""
+            WITH removed AS (
+                DELETE FROM bookings
+                WHERE id = %s
+                RETURNING id, user_id, specialist_id, service_id, date_time, status
+            ), rollup AS (
+                INSERT INTO booking_daily_stats (day, specialist_id, service_id, cancelled)
+                SELECT date_time::date, specialist_id, service_id, 1
+                FROM removed
+                WHERE status IS DISTINCT FROM 'cancelled'
+                ON CONFLICT (day, specialist_id, service_id) DO UPDATE
+                SET cancelled = booking_daily_stats.cancelled + 1
+            ), event AS (
+                INSERT INTO booking_events (event_type, booking_id, payload)
+                SELECT 'cancellation', b.id, {BOOKING_EVENT_PAYLOAD} FROM removed b
+                WHERE b.status IS DISTINCT FROM 'cancelled'
+            )
+            SELECT specialist_id, service_id, date_time FROM removed
         """, (booking_id,))
         row = cur.fetchone()
         if not row:
@@ -394,12 +573,10 @@ def cancel_booking_by_id(booking_id: int) -> Tuple[bool, str]:
             SET is_booked = FALSE
             WHERE specialist_id = %s AND service_id = %s AND slot_time = %s
         """, (specialist_id, service_id, date_time))
-        # Удаляем запись
-        cur.execute("""
-            DELETE FROM bookings
-            WHERE id = %s
-        """, (booking_id,))
+        slot_freed = cur.rowcount > 0
         conn.commit()
+        availability_index.record("cancel", specialist_id, service_id, date_time, slot_freed)
+        _emit_booking_change("cancel", {'id': booking_id, 'date_time': date_time})
         return (True, f"Запись с ID {booking_id} успешно отменена.")
     except Exception as e:
         conn.rollback()
@@ -433,74 +610,169 @@ def delete_user_state(user_id: int) -> None:
     try:
         cur.execute("DELETE FROM user_state WHERE user_id = %s", (user_id,))
         conn.commit()
+        clear_conversation(user_id)
     finally:
         cur.close()
         conn.close()
 
 
+def _parse_slot_times(slot_times: List[str]) -> Tuple[Dict[datetime.datetime, str], List[str]]:
+    """
+    Разбирает слоты "YYYY-MM-DD HH:MM": возвращает уникальные datetime (с исходной
+    строкой) и список отклонённых — неверный формат или прошедшее время.
+    """
+    now = datetime.datetime.now()
+    parsed: Dict[datetime.datetime, str] = {}
+    rejected: List[str] = []
+    for slot_time in slot_times:
+        try:
+            slot_dt = datetime.datetime.strptime(slot_time.strip(), "%Y-%m-%d %H:%M")
+        except ValueError:
+            logger.error(f"Неверный формат даты для свободного времени: {slot_time}")
+            rejected.append(slot_time)
+            continue
+        if slot_dt < now:
+            rejected.append(slot_time)
+            continue
+        parsed.setdefault(slot_dt, slot_dt.strftime("%Y-%m-%d %H:%M"))
+    return parsed, rejected
+
+def add_free_time_slots(specialist_id: int, service_id: int, slot_times: List[str]) -> Dict[str, List[str]]:
+    """
+    Добавляет свободные слоты специалиста одним запросом.
+    Уже существующие слоты пропускаются. Большие загрузки (от SLOT_COPY_THRESHOLD
+    слотов) идут через COPY во временную таблицу.
+    Возвращает {'added': [...], 'duplicates': [...], 'rejected': [...], 'failed': [...]},
+    где failed — слоты, которые не удалось записать из-за ошибки БД.
+    """
+    parsed, rejected = _parse_slot_times(slot_times)
+    report = {'added': [], 'duplicates': [], 'rejected': rejected, 'failed': []}
+    if not parsed:
+        return report
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if len(parsed) >= SLOT_COPY_THRESHOLD:
+            cur.execute("CREATE TEMP TABLE new_slots (slot_time TIMESTAMP) ON COMMIT DROP")
+            buffer = io.StringIO("".join(f"{slot_dt.isoformat(sep=' ')}\n" for slot_dt in parsed))
+            cur.copy_expert("COPY new_slots (slot_time) FROM STDIN", buffer)
+            source = "SELECT DISTINCT slot_time FROM new_slots"
+            params = (specialist_id, service_id, specialist_id, service_id)
+        else:
+            source = "SELECT DISTINCT unnest(%s::timestamp[]) AS slot_time"
+            params = (specialist_id, service_id, list(parsed), specialist_id, service_id)
+        cur.execute(f"""
+            INSERT INTO booking_times (specialist_id, service_id, slot_time, is_booked)
+            SELECT %s, %s, new.slot_time, FALSE
+            FROM ({source}) new
+            WHERE NOT EXISTS (
+                SELECT 1 FROM booking_times bt
+                WHERE bt.specialist_id = %s AND bt.service_id = %s AND bt.slot_time = new.slot_time
+            )
+            RETURNING slot_time
+        """, params)
+        inserted = {row[0] for row in cur.fetchall()}
+        if len(parsed) >= SLOT_COPY_THRESHOLD:
+            cur.execute("DROP TABLE new_slots")
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении свободного времени: {e}")
+        conn.rollback()
+        report['failed'] = list(parsed.values())
+        return report
+    finally:
+        cur.close()
+        conn.close()
+    for slot_dt, slot_time in sorted(parsed.items()):
+        if slot_dt in inserted:
+            report['added'].append(slot_time)
+            availability_index.record("add_slot", specialist_id, service_id, slot_dt)
+        else:
+            report['duplicates'].append(slot_time)
+    return report
+
 def add_free_time_slot(specialist_id: int, service_id: int, slot_time: str) -> bool:
     """
     Добавляет свободный временной слот для специалиста.
     slot_time должен быть в формате "YYYY-MM-DD HH:MM".
     Если такой слот уже существует, функция возвращает False.
     """
-    try:
-        slot_dt = datetime.datetime.strptime(slot_time, "%Y-%m-%d %H:%M")
-    except ValueError:
-        logger.error(f"Неверный формат даты для свободного времени: {slot_time}")
-        return False
+    return bool(add_free_time_slots(specialist_id, service_id, [slot_time])['added'])
+
+def remove_free_time_slots(specialist_id: int, service_id: int, slot_times: List[str]) -> Dict[str, List[str]]:
+    """
+    Удаляет свободные слоты специалиста одним запросом (занятые не трогает).
+    Возвращает {'removed': [...], 'not_found': [...], 'rejected': [...], 'failed': [...]}.
+    """
+    parsed, rejected = _parse_slot_times(slot_times)
+    report = {'removed': [], 'not_found': [], 'rejected': rejected, 'failed': []}
+    if not parsed:
+        return report
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        # Проверяем, существует ли уже такой слот
-        cur.execute("""
-            SELECT id FROM booking_times
-            WHERE specialist_id = %s AND service_id = %s AND slot_time = %s
-        """, (specialist_id, service_id, slot_dt))
-        if cur.fetchone():
-            logger.info("Такой слот уже существует")
-            return False
-        # Вставляем новый слот со статусом свободного (is_booked = FALSE)
         cur.execute("""
-            INSERT INTO booking_times (specialist_id, service_id, slot_time, is_booked)
-            VALUES (%s, %s, %s, FALSE)
-        """, (specialist_id, service_id, slot_dt))
+            DELETE FROM booking_times
+            WHERE specialist_id = %s AND service_id = %s AND slot_time = ANY(%s::timestamp[]) AND is_booked = FALSE
+            RETURNING slot_time
+        """, (specialist_id, service_id, list(parsed)))
+        deleted = {row[0] for row in cur.fetchall()}
         conn.commit()
-        return True
     except Exception as e:
-        logger.error(f"Ошибка при добавлении свободного времени: {e}")
+        logger.error(f"Ошибка при удалении свободного времени: {e}")
         conn.rollback()
-        return False
+        report['failed'] = list(parsed.values())
+        return report
     finally:
         cur.close()
         conn.close()
+    for slot_dt, slot_time in sorted(parsed.items()):
+        if slot_dt in deleted:
+            report['removed'].append(slot_time)
+            availability_index.record("remove_slot", specialist_id, service_id, slot_dt)
+        else:
+            report['not_found'].append(slot_time)
+    return report
 
-def remove_free_time_slot(specialist_id: int, service_id: int, slot_time: str) -> bool:
+def remove_free_time_ranges(specialist_id: int, service_id: Optional[int],
+                            ranges: List[Tuple[datetime.datetime, datetime.datetime]]) -> Optional[List[str]]:
     """
-    Удаляет свободный временной слот для специалиста.
-    slot_time должен быть в формате "YYYY-MM-DD HH:MM".
+    Удаляет все свободные слоты специалиста в интервалах [начало, конец) одним запросом
+    (по одной услуге или по всем, если service_id не указан). Возвращает удалённые слоты
+    или None при ошибке БД.
     """
-    try:
-        slot_dt = datetime.datetime.strptime(slot_time, "%Y-%m-%d %H:%M")
-    except ValueError:
-        logger.error(f"Неверный формат даты для удаления слота: {slot_time}")
-        return False
+    if not ranges:
+        return []
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
-            DELETE FROM booking_times
-            WHERE specialist_id = %s AND service_id = %s AND slot_time = %s AND is_booked = FALSE
-        """, (specialist_id, service_id, slot_dt))
+            DELETE FROM booking_times bt
+            USING unnest(%s::timestamp[], %s::timestamp[]) AS r(start_dt, end_dt)
+            WHERE bt.specialist_id = %s AND (%s::int IS NULL OR bt.service_id = %s)
+                AND bt.slot_time >= r.start_dt AND bt.slot_time < r.end_dt AND bt.is_booked = FALSE
+            RETURNING bt.service_id, bt.slot_time
+        """, ([start for start, _ in ranges], [end for _, end in ranges],
+              specialist_id, service_id, service_id))
+        deleted = sorted(set(cur.fetchall()), key=lambda row: row[1])
         conn.commit()
-        return cur.rowcount > 0
     except Exception as e:
         logger.error(f"Ошибка при удалении свободного времени: {e}")
         conn.rollback()
-        return False
+        return None
     finally:
         cur.close()
         conn.close()
+    for deleted_service_id, slot_dt in deleted:
+        availability_index.record("remove_slot", specialist_id, deleted_service_id, slot_dt)
+    return [slot_dt.strftime("%Y-%m-%d %H:%M") for _, slot_dt in deleted]
+
+def remove_free_time_slot(specialist_id: int, service_id: int, slot_time: str) -> bool:
+    """
+    Удаляет свободный временной слот для специалиста.
+    slot_time должен быть в формате "YYYY-MM-DD HH:MM".
+    """
+    return bool(remove_free_time_slots(specialist_id, service_id, [slot_time])['removed'])
 
 def get_free_time_slots(specialist_id: int, service_id: Optional[int] = None) -> List[str]:
     """
@@ -527,3 +799,349 @@ def get_free_time_slots(specialist_id: int, service_id: Optional[int] = None) ->
     finally:
         cur.close()
         conn.close()
+
+def set_schedule_template(specialist_id: int, service_id: int, weekdays: List[int],
+                          windows: List[Tuple[datetime.time, datetime.time]],
+                          breaks: List[Tuple[datetime.time, datetime.time]], step_minutes: int) -> bool:
+    """Заменяет недельный шаблон специалиста по услуге на указанные дни недели."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE FROM schedule_templates
+            WHERE specialist_id = %s AND service_id = %s AND weekday = ANY(%s::smallint[])
+        """, (specialist_id, service_id, weekdays))
+        rows = [(weekday, start, end, False) for weekday in weekdays for start, end in windows] + \
+               [(weekday, start, end, True) for weekday in weekdays for start, end in breaks]
+        cur.execute("""
+            INSERT INTO schedule_templates (specialist_id, service_id, weekday, start_time, end_time, is_break, step_minutes)
+            SELECT %s, %s, t.weekday, t.start_time, t.end_time, t.is_break, %s
+            FROM unnest(%s::smallint[], %s::time[], %s::time[], %s::boolean[]) AS t(weekday, start_time, end_time, is_break)
+        """, (specialist_id, service_id, step_minutes,
+              [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows]))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении шаблона расписания: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+def clear_schedule_template(specialist_id: int, service_id: int, weekdays: Optional[List[int]] = None) -> int:
+    """Удаляет шаблон специалиста по услуге (на указанные дни недели или целиком)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE FROM schedule_templates
+            WHERE specialist_id = %s AND service_id = %s AND (%s::smallint[] IS NULL OR weekday = ANY(%s::smallint[]))
+        """, (specialist_id, service_id, weekdays, weekdays))
+        conn.commit()
+        return cur.rowcount
+    finally:
+        cur.close()
+        conn.close()
+
+def add_schedule_exception(specialist_id: int, exception_date: datetime.date, is_available: bool,
+                           service_id: Optional[int] = None, start_time: Optional[datetime.time] = None,
+                           end_time: Optional[datetime.time] = None) -> bool:
+    """
+    Добавляет исключение на дату: выходной (весь день, если время не указано, или окно)
+    либо дополнительные рабочие часы (is_available=True).
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO schedule_exceptions (specialist_id, service_id, exception_date, start_time, end_time, is_available)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (specialist_id, service_id, exception_date, start_time, end_time, is_available))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении исключения расписания: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+def try_schedule_materializer_lock() -> bool:
+    """
+    Транзакционная advisory-блокировка разворачивания шаблонов: среди реплик
+    работает только одна. Снимается при коммите.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (SCHEDULE_MATERIALIZER_LOCK_ID,))
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+def get_schedule_templates(specialist_id: Optional[int] = None) -> List[Dict]:
+    """Строки недельных шаблонов (всех специалистов или одного)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT specialist_id, service_id, weekday, start_time, end_time, is_break, step_minutes
+            FROM schedule_templates
+            WHERE %s IS NULL OR specialist_id = %s
+            ORDER BY specialist_id, service_id, weekday, is_break, start_time
+        """, (specialist_id, specialist_id))
+        return [{
+            'specialist_id': r[0],
+            'service_id': r[1],
+            'weekday': r[2],
+            'start_time': r[3],
+            'end_time': r[4],
+            'is_break': r[5],
+            'step_minutes': r[6]
+        } for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+def get_schedule_exceptions(start_date: datetime.date, end_date: datetime.date,
+                            specialist_id: Optional[int] = None) -> List[Dict]:
+    """Исключения расписания на даты в интервале [start_date, end_date)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT specialist_id, service_id, exception_date, start_time, end_time, is_available
+            FROM schedule_exceptions
+            WHERE exception_date >= %s AND exception_date < %s AND (%s IS NULL OR specialist_id = %s)
+            ORDER BY exception_date, start_time NULLS FIRST
+        """, (start_date, end_date, specialist_id, specialist_id))
+        return [{
+            'specialist_id': r[0],
+            'service_id': r[1],
+            'date': r[2],
+            'start_time': r[3],
+            'end_time': r[4],
+            'is_available': r[5]
+        } for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+def get_schedule_materializations(start_date: datetime.date, end_date: datetime.date
+                                  ) -> Dict[Tuple[int, int, datetime.date], Tuple[str, List[datetime.datetime]]]:
+    """Отпечатки и слоты уже развёрнутых дней: {(специалист, услуга, день): (отпечаток, слоты)}."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT specialist_id, service_id, day, fingerprint, slots
+            FROM schedule_materializations
+            WHERE day >= %s AND day < %s
+        """, (start_date, end_date))
+        return {(r[0], r[1], r[2]): (r[3], list(r[4])) for r in cur.fetchall()}
+    finally:
+        cur.close()
+        conn.close()
+
+def save_schedule_materializations(rows: List[Tuple[int, int, datetime.date, str, List[datetime.datetime]]],
+                                   prune_before: datetime.date) -> None:
+    """Сохраняет отпечатки развёрнутых дней одним запросом и удаляет прошедшие."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if rows:
+            payload = json.dumps([{
+                'specialist_id': spec_id,
+                'service_id': service_id,
+                'day': day.isoformat(),
+                'fingerprint': fingerprint,
+                'slots': [slot.isoformat() for slot in slots]
+            } for spec_id, service_id, day, fingerprint, slots in rows])
+            cur.execute("""
+                INSERT INTO schedule_materializations (specialist_id, service_id, day, fingerprint, slots)
+                SELECT (r->>'specialist_id')::bigint, (r->>'service_id')::integer, (r->>'day')::date,
+                       r->>'fingerprint',
+                       ARRAY(SELECT jsonb_array_elements_text(r->'slots')::timestamp)
+                FROM jsonb_array_elements(%s::jsonb) r
+                ON CONFLICT (specialist_id, service_id, day) DO UPDATE
+                SET fingerprint = EXCLUDED.fingerprint,
+                    slots = EXCLUDED.slots,
+                    materialized_at = NOW()
+            """, (payload,))
+        cur.execute("DELETE FROM schedule_materializations WHERE day < %s", (prune_before,))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+def claim_booking_events(batch_size: int, lease_seconds: float) -> List[Dict]:
+    """
+    Забирает пачку необработанных событий на lease_seconds секунд. Строки,
+    которые уже забирает другая реплика, пропускаются (SKIP LOCKED); если
+    событие не отмечено обработанным до конца срока, оно будет выдано снова.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE booking_events
+            SET available_at = NOW() + %s * INTERVAL '1 second', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM booking_events
+                WHERE processed_at IS NULL AND available_at <= NOW()
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, event_type, booking_id, payload, attempts
+        """, (lease_seconds, batch_size))
+        rows = cur.fetchall()
+        conn.commit()
+        return [{
+            'id': r[0],
+            'event_type': r[1],
+            'booking_id': r[2],
+            'payload': r[3],
+            'attempts': r[4]
+        } for r in sorted(rows)]
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка при выборке событий по записям: {e}")
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+def mark_booking_events_processed(event_ids: List[int]) -> bool:
+    if not event_ids:
+        return True
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE booking_events
+            SET processed_at = NOW()
+            WHERE id = ANY(%s::bigint[]) AND processed_at IS NULL
+        """, (list(event_ids),))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка при отметке обработанных событий: {e}")
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+def prune_booking_events(retention_days: int) -> int:
+    """Удаляет события, обработанные больше retention_days дней назад."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE FROM booking_events
+            WHERE processed_at < NOW() - %s * INTERVAL '1 day'
+        """, (retention_days,))
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка при удалении старых событий: {e}")
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+def get_reminder_bookings(start_dt: datetime.datetime, end_dt: datetime.datetime) -> List[Dict]:
+    """
+    Активные записи со временем в (start_dt, end_dt] — один проход по индексу
+    на (date_time, id) — и смещения уже отправленных по ним напоминаний.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT b.id, b.user_id, b.date_time,
+                   ARRAY(SELECT r.offset_minutes FROM booking_reminders r WHERE r.booking_id = b.id)
+            FROM bookings b
+            WHERE b.status = 'active' AND b.date_time > %s AND b.date_time <= %s
+        """, (start_dt, end_dt))
+        return [{
+            'id': r[0],
+            'user_id': r[1],
+            'date_time': r[2],
+            'sent_offsets': set(r[3] or [])
+        } for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+def claim_reminders(reminders: List[Tuple[int, int]]) -> Optional[List[Dict]]:
+    """
+    Отмечает напоминания (id записи, смещение в минутах) отправленными и возвращает
+    данные для текста только по тем, что никто ещё не отправлял и чья запись
+    по-прежнему активна и впереди. Отметка фиксируется до отправки.
+    None — ошибка БД, ничего не отмечено.
+    """
+    if not reminders:
+        return []
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            WITH claimed AS (
+                INSERT INTO booking_reminders (booking_id, offset_minutes)
+                SELECT b.id, d.offset_minutes
+                FROM unnest(%s::int[], %s::int[]) AS d(booking_id, offset_minutes)
+                JOIN bookings b ON b.id = d.booking_id
+                WHERE b.status = 'active' AND b.date_time > NOW()
+                ON CONFLICT DO NOTHING
+                RETURNING booking_id, offset_minutes
+            )
+            SELECT c.booking_id, c.offset_minutes, b.user_id, b.date_time, s.title, sp.name
+            FROM claimed c
+            JOIN bookings b ON b.id = c.booking_id
+            LEFT JOIN services s ON s.id = b.service_id
+            LEFT JOIN specialists sp ON sp.id = b.specialist_id
+        """, ([r[0] for r in reminders], [r[1] for r in reminders]))
+        rows = cur.fetchall()
+        conn.commit()
+        return [{
+            'booking_id': r[0],
+            'offset_minutes': r[1],
+            'user_id': r[2],
+            'date_time': r[3],
+            'service_name': r[4],
+            'specialist_name': r[5]
+        } for r in rows]
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка при отметке напоминаний: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def prune_booking_reminders(retention_days: int) -> int:
+    """Удаляет отметки о напоминаниях старше retention_days дней."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE FROM booking_reminders
+            WHERE sent_at < NOW() - %s * INTERVAL '1 day'
+        """, (retention_days,))
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка при удалении старых отметок о напоминаниях: {e}")
+        return 0
+    finally:
+        cur.close()
+        conn.close()
@@ -2,6 +2,7 @@ from telegram import Update
 from telegram.ext import CallbackContext
 from utils.logger import logger
 from database.queries import create_service, create_specialist, create_manager_in_db, set_service_duration
+from services.notifications import invalidate_managers
 from config.settings import ADMIN_ID
 
 def admin_command_set_service_duration(update: Update, context: CallbackContext) -> None:
@@ -104,6 +105,7 @@ def admin_command_add_manager(update: Update, context: CallbackContext) -> None:
     
     created = create_manager_in_db(manager_chat_id, manager_username)
     if created:
+        invalidate_managers()
         update.message.reply_text(
             f"Менеджер (chat_id={manager_chat_id}, user={manager_username}) успешно добавлен."
         )
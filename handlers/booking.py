@@ -1,37 +1,54 @@
 import json
 from typing import Optional, Dict
 import telegram
-from config.settings import TOKEN, MANAGER_CHAT_ID
+from config.settings import TOKEN
 from database.queries import (
     get_services,
     find_service_by_name,
     get_specialists,
-    get_available_times,
     create_booking,
     get_service_name,
     get_specialist_name,
-    find_available_specialist,
     set_user_state,
-    delete_user_state
+    delete_user_state,
+    get_user_state,
+    get_catalog_text,
+    BOOKING_CREATED,
+    BOOKING_SLOT_TAKEN
 )
 from services.gpt import get_gpt_response, resolve_specialist_name
+from services.outbox_relay import request_outbox_relay
+from services.name_matcher import match_specialist
+from services.intent import classify_locally, record_intent_source, normalize_text, CONFIRM_WORDS
 from utils.logger import logger
 from utils.time_utils import parse_time_input
-from services.scheduler import get_available_start_times
+from services.scheduler import get_next_free_slots, find_earliest_slots, get_available_times
 from conversation import append_message
 
+# Сколько вариантов у других специалистов предлагать, если у выбранного всё занято
+ALTERNATIVE_SLOTS_LIMIT = 5
+
 def show_free_slots(update, context):
-    # Здесь нужно получить specialist_id, service_id, date_obj из состояния или параметров
-    slots = get_available_start_times(specialist_id, date_obj, service_id)
+    """Ближайшие свободные начала записи на неделю вперёд для выбранных услуги и специалиста."""
+    state = get_user_state(update.effective_user.id)
+    if not state or not state.get('service_id') or not state.get('specialist_id'):
+        update.message.reply_text("Сначала выберите услугу и специалиста.")
+        return
+    slots = get_next_free_slots(state['specialist_id'], state['service_id'])
     if not slots:
-        update.message.reply_text("К сожалению, нет свободных слотов в этот день.")
+        update.message.reply_text("К сожалению, на ближайшую неделю нет свободного времени.")
     else:
-        update.message.reply_text("Свободные интервалы:\n" + "\n".join(slots))
+        update.message.reply_text("Ближайшее свободное время:\n" + "\n".join(slots))
+
+def render_services_text() -> str:
+    return "\n".join([f"- {s[1]}" for s in get_services()])
+
+def get_services_text() -> str:
+    return get_catalog_text("services_bullets", render_services_text)
 
 def handle_list_services(update: telegram.Update, gpt_response_text: str):
-    services = get_services()
-    if services:
-        service_list = "\n".join([f"- {s[1]}" for s in services])
+    service_list = get_services_text()
+    if service_list:
         update.message.reply_text(f"{gpt_response_text}\n\nДоступные услуги:\n{service_list}")
     else:
         update.message.reply_text("К сожалению, сейчас нет доступных услуг.")
@@ -39,14 +56,12 @@ def handle_list_services(update: telegram.Update, gpt_response_text: str):
 def handle_select_service(update: telegram.Update, user_id: int, extracted_data: Dict, gpt_response_text: str):
     service_name = extracted_data.get('service')
     if not service_name:
-        services = get_services()
-        service_list = "\n".join([f"- {s[1]}" for s in services])
+        service_list = get_services_text()
         update.message.reply_text(f"{gpt_response_text}\n\nДоступные услуги:\n{service_list}")
         return
     service = find_service_by_name(service_name)
     if not service:
-        services = get_services()
-        service_list = "\n".join([f"- {s[1]}" for s in services])
+        service_list = get_services_text()
         update.message.reply_text(f"Услуга не найдена. Выберите из списка:\n\n{service_list}")
         return
     service_id, service_name = service
@@ -70,6 +85,9 @@ def handle_select_specialist(update: telegram.Update, user_id: int, state: Dict,
         return
     specialist = next((s for s in specialists if s[1].strip().lower() == specialist_input.strip().lower()), None)
     if not specialist:
+        specialist = match_specialist(specialist_input, specialists)
+    if not specialist:
+        # Локально однозначно определить не удалось — спрашиваем GPT
         resolved_name = resolve_specialist_name(specialist_input, specialists)
         specialist = next((s for s in specialists if s[1].strip().lower() == resolved_name.strip().lower()), None)
     if not specialist:
@@ -86,18 +104,22 @@ def handle_select_specialist(update: telegram.Update, user_id: int, state: Dict,
 
 def handle_select_time(update: telegram.Update, user_id: int, state: Dict, extracted_data: Dict, bot: telegram.Bot):
     if not state or not all(k in state for k in ['service_id', 'specialist_id']):
-        services = get_services()
-        if services:
-            services_text = "\n".join([f"- {s[1]}" for s in services])
+        services_text = get_services_text()
+        if services_text:
             update.message.reply_text("Сначала выберите услугу из списка:\n\n" + services_text)
         return
     available_times = get_available_times(state['specialist_id'], state['service_id'])
     if not available_times:
-        alternative_specialist = find_available_specialist(state['service_id'], state['specialist_id'])
-        if alternative_specialist:
+        alternatives = find_earliest_slots(state['service_id'], k=ALTERNATIVE_SLOTS_LIMIT,
+                                           exclude_specialist_id=state['specialist_id'])
+        if alternatives:
             set_user_state(user_id, "select_specialist", service_id=state['service_id'])
+            alternatives_text = "\n".join(
+                f"👩‍💼 {name} — {slot.strftime('%Y-%m-%d %H:%M')}" for _, name, slot in alternatives
+            )
             update.message.reply_text("К сожалению, у выбранного специалиста нет свободного времени.\n" +
-                f"Вы можете записаться к {alternative_specialist[1]}. Хотите посмотреть доступное время?")
+                f"Ближайшее время у других специалистов:\n\n{alternatives_text}\n\n" +
+                "Напишите имя специалиста, к которому хотите записаться.")
         else:
             update.message.reply_text("К сожалению, сейчас нет свободного времени для записи.\n" +
                 "Попробуйте выбрать другую услугу или свяжитесь с администратором.")
@@ -125,50 +147,58 @@ def handle_confirm_booking(update: telegram.Update, user_id: int, state: Dict, u
     if not state or not all(k in state for k in ['service_id', 'specialist_id', 'chosen_time']):
         update.message.reply_text("Недостаточно информации для создания записи.")
         return
-    if user_text.lower() in ['да', 'yes', 'подтверждаю']:
-        success = create_booking(user_id=user_id, serv_id=state['service_id'], spec_id=state['specialist_id'], date_str=state['chosen_time'])
-        if success:
-            service_name = get_service_name(state['service_id'])
-            specialist_name = get_specialist_name(state['specialist_id'])
+    if normalize_text(user_text) in CONFIRM_WORDS:
+        result = create_booking(user_id=user_id, serv_id=state['service_id'], spec_id=state['specialist_id'], date_str=state['chosen_time'])
+        if result == BOOKING_CREATED:
             update.message.reply_text(f"{gpt_response_text}")
-            if MANAGER_CHAT_ID:
-                bot.send_message(MANAGER_CHAT_ID,
-                    f"Новая запись!\n"
-                    f"Услуга: {service_name}\n"
-                    f"Специалист: {specialist_name}\n"
-                    f"Время: {state['chosen_time']}\n"
-                    f"Клиент ID: {user_id}"
-                )
+            # Событие о записи уже в booking_events; менеджерам его разошлёт фоновая рассылка
+            request_outbox_relay()
+        elif result == BOOKING_SLOT_TAKEN:
+            handle_slot_taken(update, user_id, state)
+            return
         else:
             update.message.reply_text("Произошла ошибка при создании записи. Пожалуйста, попробуйте позже.")
     else:
         update.message.reply_text(f"{gpt_response_text}")
     delete_user_state(user_id)
 
+def handle_slot_taken(update: telegram.Update, user_id: int, state: Dict):
+    """Слот заняли между выбором и подтверждением: предлагаем ближайшее свободное время."""
+    taken = (state['specialist_id'], state['chosen_time'])
+    alternatives = [
+        (spec_id, name, slot)
+        for spec_id, name, slot in find_earliest_slots(state['service_id'], k=ALTERNATIVE_SLOTS_LIMIT + 1)
+        if (spec_id, slot.strftime("%Y-%m-%d %H:%M")) != taken
+    ][:ALTERNATIVE_SLOTS_LIMIT]
+    if not alternatives:
+        delete_user_state(user_id)
+        update.message.reply_text("К сожалению, это время только что заняли, а другого свободного времени сейчас нет.")
+        return
+    set_user_state(user_id, "select_specialist", service_id=state['service_id'])
+    alternatives_text = "\n".join(
+        f"👩‍💼 {name} — {slot.strftime('%Y-%m-%d %H:%M')}" for _, name, slot in alternatives
+    )
+    update.message.reply_text("К сожалению, это время только что заняли.\n" +
+        f"Ближайшее свободное время:\n\n{alternatives_text}\n\n" +
+        "Напишите имя специалиста, к которому хотите записаться.")
+
 def handle_booking_with_gpt(update: telegram.Update, user_id: int, user_text: str, state: Optional[Dict] = None):
     # Добавляем сообщение пользователя в историю
     from conversation import append_message
     append_message(user_id, "user", user_text)
-    
-    # Если пользователь явно ввёл название услуги (например, "стрижка")
-    service_candidate = find_service_by_name(user_text)
-    if service_candidate:
-        if (not state) or (state.get('service_id') != service_candidate[0]):
-            set_user_state(user_id, "select_specialist", service_id=service_candidate[0])
-            specialists = get_specialists(service_candidate[0])
-            if specialists:
-                specialists_text = "\n".join([f"- {s[1]}" for s in specialists])
-                update.message.reply_text(f"Вы выбрали услугу '{service_candidate[1]}'. Теперь выберите специалиста:\n{specialists_text}")
-            else:
-                update.message.reply_text("К сожалению, нет доступных специалистов для выбранной услуги.")
-            return
 
     try:
-        result = get_gpt_response(user_id, user_text, state)
+        # Простые ответы (да/нет, час из списка, имя из списка, название услуги)
+        # разбираем локально и обращаемся к GPT только если не уверены
+        result = classify_locally(user_text, state)
+        if result is None:
+            result = get_gpt_response(user_id, user_text, state)
+        record_intent_source(result)
         action = result.get('action')
         extracted_data = result.get('extracted_data', {})
         gpt_response_text = result.get('response', '')
-        append_message(user_id, "assistant", gpt_response_text)
+        if gpt_response_text:
+            append_message(user_id, "assistant", gpt_response_text)
         if action == "LIST_SERVICES":
             handle_list_services(update, gpt_response_text)
         elif action == "SELECT_SERVICE":
@@ -0,0 +1,100 @@
+import datetime
+from typing import Optional, Tuple
+import telegram
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CallbackContext
+from database.queries import get_bookings_page, get_specialist_name
+from utils.logger import logger
+
+# Данные кнопок: "bk:<all|id специалиста>:<n|p>:<YYYYmmddHHMM>:<id записи>" (Telegram ограничивает их 64 байтами)
+CALLBACK_PREFIX = "bk"
+CALLBACK_PATTERN = r"^bk:"
+CURSOR_FORMAT = "%Y%m%d%H%M"
+
+
+def _callback_data(specialist_id: Optional[int], backward: bool, booking: dict) -> str:
+    scope = "all" if specialist_id is None else str(specialist_id)
+    return ":".join([
+        CALLBACK_PREFIX, scope, "p" if backward else "n",
+        booking['date_time'].strftime(CURSOR_FORMAT), str(booking['id'])
+    ])
+
+
+def _parse_callback_data(data: str) -> Optional[Tuple[Optional[int], bool, Tuple[datetime.datetime, int]]]:
+    try:
+        prefix, scope, direction, moment, booking_id = data.split(":")
+        if prefix != CALLBACK_PREFIX or direction not in ("n", "p"):
+            return None
+        specialist_id = None if scope == "all" else int(scope)
+        cursor = (datetime.datetime.strptime(moment, CURSOR_FORMAT), int(booking_id))
+        return specialist_id, direction == "p", cursor
+    except ValueError:
+        return None
+
+
+def render_bookings_page(specialist_id: Optional[int], page: dict) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст страницы записей и кнопки перехода к соседним страницам."""
+    lines = []
+    for b in page['bookings']:
+        client = f"ID {b['user_id']}" + (f" (Имя: {b['user_name']})" if b['user_name'] else "")
+        if specialist_id is None:
+            lines.append(
+                f"📅 {b['date_time'].strftime('%Y-%m-%d %H:%M')}\n"
+                f"👤 Клиент: {client}\n"
+                f"🎯 Услуга: {b['service_name']}\n"
+                f"👩‍💼 Специалист: {b['specialist_name']}"
+            )
+        else:
+            lines.append(
+                f"📅 ID брони: {b['id']}\n"
+                f"   Дата/время: {b['date_time'].strftime('%Y-%m-%d %H:%M')}\n"
+                f"   Услуга: {b['service_name']}\n"
+                f"   Клиент: {client}"
+            )
+    if specialist_id is None:
+        header = "Активные записи:"
+    else:
+        header = f"Активные записи для {get_specialist_name(specialist_id)} (id={specialist_id}):"
+    text = header + "\n\n" + "\n-------------------\n".join(lines)
+
+    buttons = []
+    if page['has_prev']:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=_callback_data(specialist_id, True, page['bookings'][0])))
+    if page['has_next']:
+        buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=_callback_data(specialist_id, False, page['bookings'][-1])))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def send_bookings_page(update: telegram.Update, specialist_id: Optional[int], empty_text: str) -> None:
+    """Отправляет первую страницу предстоящих записей (всех или одного специалиста)."""
+    page = get_bookings_page(specialist_id)
+    if not page['bookings']:
+        update.message.reply_text(empty_text)
+        return
+    text, markup = render_bookings_page(specialist_id, page)
+    update.message.reply_text(text, reply_markup=markup)
+
+
+def bookings_page_callback(update: telegram.Update, context: CallbackContext) -> None:
+    """Кнопки "Назад"/"Вперёд": читает только соседнюю страницу и заменяет ею сообщение."""
+    from handlers.manager import is_manager
+    query = update.callback_query
+    parsed = _parse_callback_data(query.data or "")
+    if parsed is None:
+        query.answer()
+        return
+    specialist_id, backward, cursor = parsed
+    if specialist_id is None and not is_manager(update.effective_chat.id):
+        query.answer("У вас нет доступа к командам менеджера.")
+        return
+    try:
+        page = get_bookings_page(specialist_id, cursor=cursor, backward=backward)
+        if not page['bookings']:
+            query.answer("Больше записей нет.")
+            return
+        text, markup = render_bookings_page(specialist_id, page)
+        query.answer()
+        query.edit_message_text(text, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Ошибка при переходе по страницам записей: {e}", exc_info=True)
+        query.answer("Не удалось загрузить страницу.")
@@ -1,6 +1,6 @@
 from telegram import Update
 from telegram.ext import CallbackContext
-from database.queries import get_services, get_specialists
+from database.queries import get_services, get_specialists, get_catalog_text
 
 def start(update: Update, context: CallbackContext) -> None:
     update.message.reply_text(
@@ -17,16 +17,22 @@ def help_command(update: Update, context: CallbackContext) -> None:
         "Для отмены записи напишите 'Отменить запись'."
     )
 
-def spec_list_command(update: Update, context: CallbackContext):
+def render_spec_list() -> str:
     specialists = get_specialists()
     text = "Список специалистов:\n"
     for sp_id, sp_name in specialists:
         text += f"- [{sp_id}] {sp_name}\n"
-    update.message.reply_text(text)
+    return text
 
-def service_list_command(update: Update, context: CallbackContext):
+def render_service_list() -> str:
     services = get_services()
     text = "Список услуг:\n"
     for serv_id, serv_title in services:
         text += f"- [{serv_id}] {serv_title}\n"
-    update.message.reply_text(text)
+    return text
+
+def spec_list_command(update: Update, context: CallbackContext):
+    update.message.reply_text(get_catalog_text("spec_list", render_spec_list))
+
+def service_list_command(update: Update, context: CallbackContext):
+    update.message.reply_text(get_catalog_text("service_list", render_service_list))
@@ -1,9 +1,11 @@
-from typing import Optional, Dict, List
+import datetime
+from typing import Optional, Dict
 import telegram
 from telegram.ext import CallbackContext
 from config.settings import MANAGER_CHAT_ID
 from database.connection import get_db_connection
-from database.queries import get_user_bookings
+from database.queries import get_user_bookings, get_specialist_work_hours
+from handlers.booking_list import send_bookings_page
 from utils.logger import logger
 
 def is_manager(chat_id: int) -> bool:
@@ -14,32 +16,25 @@ def handle_manager_commands(update: telegram.Update, context: CallbackContext) -
     if not is_manager(chat_id):
         update.message.reply_text("У вас нет доступа к командам менеджера.")
         return
-    command = update.message.text.lower()
+    command = update.message.text.split()[0].split('@')[0].lower()
     try:
         if command == '/bookings':
-            bookings = get_all_bookings()
-            if bookings:
-                message = "Активные записи:\n\n"
-                for booking in bookings:
-                    message += (
-                        f"📅 {booking['date_time']}\n"
-                        f"👤 Клиент: {booking['user_id']}\n"
-                        f"🎯 Услуга: {booking['service_name']}\n"
-                        f"👩‍💼 Специалист: {booking['specialist_name']}\n"
-                        "-------------------\n"
-                    )
-                update.message.reply_text(message)
-            else:
-                update.message.reply_text("Нет активных записей.")
+            send_bookings_page(update, None, "Нет активных записей.")
         elif command == '/stats':
             stats = get_booking_stats()
             message = (
                 f"📊 Статистика:\n\n"
                 f"Всего записей: {stats['total']}\n"
-                f"Активных записей: {stats['active']}\n"
+                f"Предстоящих записей: {stats['active']}\n"
                 f"Отмененных записей: {stats['cancelled']}\n"
-                f"Записей на сегодня: {stats['today']}"
+                f"Записей на сегодня: {stats['today']}\n"
+                f"Записей на этой неделе: {stats['week']} (отмен: {stats['week_cancelled']})"
             )
+            if stats['specialists']:
+                message += "\n\nСпециалисты на этой неделе:\n"
+                for spec in stats['specialists']:
+                    utilization = f", загрузка {spec['utilization']}%" if spec['utilization'] is not None else ""
+                    message += f"👩‍💼 {spec['name']}: {spec['bookings']} зап., {spec['booked_minutes']} мин{utilization}\n"
             update.message.reply_text(message)
         else:
             update.message.reply_text("Доступные команды:\n/bookings - показать все активные записи\n/stats - показать статистику")
@@ -47,48 +42,63 @@ def handle_manager_commands(update: telegram.Update, context: CallbackContext) -
         logger.error(f"Ошибка в обработке команды менеджера: {e}", exc_info=True)
         update.message.reply_text("Произошла ошибка при выполнении команды.")
 
-def get_all_bookings() -> List[Dict]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT b.id, b.user_id, b.date_time,
-                   s.title as service_name, sp.name as specialist_name
-            FROM bookings b
-            JOIN services s ON b.service_id = s.id
-            JOIN specialists sp ON b.specialist_id = sp.id
-            WHERE b.date_time > NOW() AND b.status = 'active'
-            ORDER BY b.date_time
-        """)
-        rows = cur.fetchall()
-        return [{
-            'id': r[0],
-            'user_id': r[1],
-            'date_time': r[2].strftime("%Y-%m-%d %H:%M"),
-            'service_name': r[3],
-            'specialist_name': r[4]
-        } for r in rows]
-    finally:
-        cur.close()
-        conn.close()
-
 def get_booking_stats() -> Dict:
+    """
+    Статистика по дневным сводкам booking_daily_stats: их размер зависит от числа
+    дней и пар специалист-услуга, а не от истории записей.
+    """
+    today = datetime.date.today()
+    week_start = today - datetime.timedelta(days=today.weekday())
+    week_end = week_start + datetime.timedelta(days=7)
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT COUNT(*) FROM bookings")
-        total = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM bookings WHERE status = 'active' AND date_time > NOW()")
-        active = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM bookings WHERE status = 'cancelled'")
-        cancelled = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM bookings WHERE status = 'active' AND date_time::date = CURRENT_DATE")
-        today = cur.fetchone()[0]
+        cur.execute("""
+            SELECT COALESCE(SUM(created), 0),
+                   COALESCE(SUM(cancelled), 0),
+                   COALESCE(SUM(created - cancelled) FILTER (WHERE day >= %s), 0),
+                   COALESCE(SUM(created - cancelled) FILTER (WHERE day = %s), 0),
+                   COALESCE(SUM(created - cancelled) FILTER (WHERE day >= %s AND day < %s), 0),
+                   COALESCE(SUM(cancelled) FILTER (WHERE day >= %s AND day < %s), 0)
+            FROM booking_daily_stats
+        """, (today, today, week_start, week_end, week_start, week_end))
+        total, cancelled, active, today_count, week, week_cancelled = cur.fetchone()
+        cur.execute("""
+            SELECT sp.id, sp.name,
+                   SUM(st.created - st.cancelled),
+                   SUM((st.created - st.cancelled) * COALESCE(s.duration_minutes, 0))
+            FROM booking_daily_stats st
+            JOIN specialists sp ON sp.id = st.specialist_id
+            LEFT JOIN services s ON s.id = st.service_id
+            WHERE st.day >= %s AND st.day < %s
+            GROUP BY sp.id, sp.name
+            HAVING SUM(st.created) > 0
+            ORDER BY 4 DESC, sp.name
+        """, (week_start, week_end))
+        specialists = []
+        for spec_id, name, bookings, booked_minutes in cur.fetchall():
+            # Загрузка: занятые минуты к рабочим минутам за неделю
+            work_start, work_end = get_specialist_work_hours(spec_id)
+            utilization = None
+            if work_start and work_end:
+                day_minutes = (datetime.datetime.combine(today, work_end) - datetime.datetime.combine(today, work_start)).total_seconds() / 60
+                if day_minutes > 0:
+                    utilization = round(100 * booked_minutes / (day_minutes * 7))
+            specialists.append({
+                'id': spec_id,
+                'name': name,
+                'bookings': bookings,
+                'booked_minutes': booked_minutes,
+                'utilization': utilization
+            })
         return {
             'total': total,
             'active': active,
             'cancelled': cancelled,
-            'today': today
+            'today': today_count,
+            'week': week,
+            'week_cancelled': week_cancelled,
+            'specialists': specialists
         }
     finally:
         cur.close()
@@ -1,14 +1,39 @@
-from typing import Optional
+import datetime
+import re
+from typing import List, Optional, Tuple
 import telegram
 from telegram.ext import CallbackContext
 from database.queries import (
-    add_free_time_slot,
-    remove_free_time_slot,
-    get_free_time_slots
+    add_free_time_slots,
+    remove_free_time_slots,
+    remove_free_time_ranges,
+    get_free_time_slots,
+    get_specialist_work_hours,
+    set_schedule_template,
+    clear_schedule_template,
+    add_schedule_exception,
+    get_schedule_templates,
+    get_schedule_exceptions
 )
+from config.settings import AVAILABILITY_STEP_MINUTES
 from services.gpt import resolve_free_time
+from services.schedule_materializer import request_materialization
+from utils.time_parser import parse_free_time, parse_free_time_ranges, parse_date, SHORT_WEEKDAYS
 from utils.logger import logger
 
+def resolve_slots(specialist_id: int, free_time_input: str) -> List[str]:
+    """
+    Переводит описание свободного времени в список слотов "YYYY-MM-DD HH:MM".
+    Сначала пробует локальный разбор (с рабочими часами специалиста для "весь день"),
+    GPT вызывается только для фраз, которые разобрать не удалось.
+    """
+    work_start, work_end = get_specialist_work_hours(specialist_id)
+    slots = parse_free_time(free_time_input, work_start, work_end)
+    if slots is not None:
+        return slots
+    logger.info(f"Локально не удалось разобрать '{free_time_input}', обращаемся к GPT")
+    return resolve_free_time(free_time_input)
+
 # Команда для добавления свободного времени через меню или свободный ввод.
 def add_freetime_command(update: telegram.Update, context: CallbackContext) -> None:
     """
@@ -29,20 +54,19 @@ def add_freetime_command(update: telegram.Update, context: CallbackContext) -> N
             update.message.reply_text("Первый аргумент должен быть числом — ID услуги.")
             return
         free_time_input = " ".join(args[1:])
-        # Если free_time_input содержит формат времени (например, "2025-03-27 15:00"), попробуем добавить один слот
-        # Иначе, интерпретируем с помощью GPT
-        if ":" in free_time_input and "-" in free_time_input:
-            slots = [free_time_input]
-        else:
-            slots = resolve_free_time(free_time_input)
-        successes = []
-        for slot in slots:
-            if add_free_time_slot(update.message.from_user.id, service_id, slot):
-                successes.append(slot)
-        if successes:
-            update.message.reply_text(f"Добавлены следующие свободные слоты: {', '.join(successes)}")
-        else:
+        slots = resolve_slots(user_id, free_time_input)
+        report = add_free_time_slots(user_id, service_id, slots)
+        if not report['added'] and not report['duplicates']:
             update.message.reply_text("Не удалось добавить свободное время. Проверьте ввод.")
+            return
+        lines = []
+        if report['added']:
+            lines.append(f"Добавлены следующие свободные слоты: {', '.join(report['added'])}")
+        if report['duplicates']:
+            lines.append(f"Уже были добавлены ранее: {', '.join(report['duplicates'])}")
+        if report['rejected']:
+            lines.append(f"Не приняты (неверный формат или прошедшее время): {', '.join(report['rejected'])}")
+        update.message.reply_text("\n".join(lines))
     else:
         update.message.reply_text("Используйте команду: /add_freetime <ID услуги> <описание свободного времени>.\nНапример: /add_freetime 2 завтра весь день свободен")
 
@@ -51,7 +75,8 @@ def remove_freetime_command(update: telegram.Update, context: CallbackContext) -
     """
     Обработка команды /remove_freetime.
     Пользователь указывает ID услуги и временной слот для удаления.
-    Ввод может быть неструктурированным, поэтому можно использовать GPT для интерпретации.
+    Диапазоны ("завтра весь день", "в пятницу с 10 до 14") удаляются одним запросом
+    по интервалам; прочий ввод разворачивается в слоты, при необходимости через GPT.
     """
     args = context.args
     if args:
@@ -60,20 +85,33 @@ def remove_freetime_command(update: telegram.Update, context: CallbackContext) -
         except ValueError:
             update.message.reply_text("Первый аргумент должен быть числом — ID услуги.")
             return
+        user_id = update.message.from_user.id
         free_time_input = " ".join(args[1:])
-        # Если формат точный, используем его, иначе интерпретируем через GPT
-        if ":" in free_time_input and "-" in free_time_input:
-            slots = [free_time_input]
-        else:
-            slots = resolve_free_time(free_time_input)
-        removed = []
-        for slot in slots:
-            if remove_free_time_slot(update.message.from_user.id, service_id, slot):
-                removed.append(slot)
-        if removed:
-            update.message.reply_text(f"Удалены следующие свободные слоты: {', '.join(removed)}")
-        else:
-            update.message.reply_text("Не найдено свободное время для удаления с указанными параметрами.")
+        work_start, work_end = get_specialist_work_hours(user_id)
+        ranges = parse_free_time_ranges(free_time_input, work_start, work_end)
+        if ranges is not None:
+            removed = remove_free_time_ranges(user_id, service_id, ranges)
+            if removed is None:
+                update.message.reply_text("Не удалось удалить свободное время из-за ошибки. Попробуйте позже.")
+            elif removed:
+                update.message.reply_text(f"Удалены следующие свободные слоты: {', '.join(removed)}")
+            else:
+                update.message.reply_text("Не найдено свободное время для удаления с указанными параметрами.")
+            return
+        slots = resolve_slots(user_id, free_time_input)
+        report = remove_free_time_slots(user_id, service_id, slots)
+        lines = []
+        if report['removed']:
+            lines.append(f"Удалены следующие свободные слоты: {', '.join(report['removed'])}")
+        if report['not_found']:
+            lines.append(f"Не найдены или уже заняты: {', '.join(report['not_found'])}")
+        if report['rejected']:
+            lines.append(f"Не приняты (неверный формат или прошедшее время): {', '.join(report['rejected'])}")
+        if report['failed']:
+            lines.append(f"Не удалось удалить из-за ошибки, попробуйте позже: {', '.join(report['failed'])}")
+        if not lines:
+            lines.append("Не найдено свободное время для удаления с указанными параметрами.")
+        update.message.reply_text("\n".join(lines))
     else:
         update.message.reply_text("Используйте команду: /remove_freetime <ID услуги> <описание времени для удаления>.\nНапример: /remove_freetime 2 освободи 27 числа в 15:00")
 
@@ -99,3 +137,163 @@ def list_freetime_command(update: telegram.Update, context: CallbackContext) ->
         update.message.reply_text("Ваши свободные слоты:\n" + "\n".join(slots))
     else:
         update.message.reply_text("Свободные слоты не найдены.")
+
+WINDOW_RE = re.compile(r"^(\d{1,2})(?::(\d{2}))?-(\d{1,2})(?::(\d{2}))?$")
+WEEKDAY_LABELS = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
+EVERY_DAY_WORDS = {'ежедневно', 'все', 'каждый'}
+
+def parse_window(text: str) -> Optional[Tuple[datetime.time, datetime.time]]:
+    """Окно "10:00-19:00" или "10-19"."""
+    match = WINDOW_RE.match(text)
+    if not match:
+        return None
+    try:
+        start = datetime.time(int(match.group(1)), int(match.group(2) or 0))
+        end = datetime.time(int(match.group(3)), int(match.group(4) or 0))
+    except ValueError:
+        return None
+    return (start, end) if end > start else None
+
+def parse_weekdays(text: str) -> Optional[List[int]]:
+    """Дни недели: "пн", "пн-пт", "пн,ср,пт", "ежедневно"."""
+    text = text.lower()
+    if text in EVERY_DAY_WORDS:
+        return list(range(7))
+    weekdays: List[int] = []
+    for part in text.split(','):
+        if '-' in part:
+            first, _, last = part.partition('-')
+            if first not in SHORT_WEEKDAYS or last not in SHORT_WEEKDAYS:
+                return None
+            start, end = SHORT_WEEKDAYS[first], SHORT_WEEKDAYS[last]
+            weekdays += [day % 7 for day in range(start, end + 1 if end >= start else end + 8)]
+        elif part in SHORT_WEEKDAYS:
+            weekdays.append(SHORT_WEEKDAYS[part])
+        else:
+            return None
+    return sorted(set(weekdays))
+
+def set_schedule_command(update: telegram.Update, context: CallbackContext) -> None:
+    """
+    Обработка команды /set_schedule — недельный шаблон по услуге.
+    Пример: /set_schedule 2 пн-пт 10:00-19:00 перерыв 13:00-14:00
+    Слоты на ближайшие недели создаются фоновым разворачиванием шаблонов.
+    """
+    usage = ("Используйте команду: /set_schedule <ID услуги> <дни> <ЧЧ:ММ-ЧЧ:ММ> [перерыв ЧЧ:ММ-ЧЧ:ММ]\n"
+             "Например: /set_schedule 2 пн-пт 10:00-19:00 перерыв 13:00-14:00")
+    args = context.args
+    if len(args) < 3:
+        update.message.reply_text(usage)
+        return
+    try:
+        service_id = int(args[0])
+    except ValueError:
+        update.message.reply_text("Первый аргумент должен быть числом — ID услуги.")
+        return
+    weekdays = parse_weekdays(args[1])
+    if not weekdays:
+        update.message.reply_text("Не удалось разобрать дни недели. Примеры: пн, пн-пт, пн,ср,пт, ежедневно.")
+        return
+    windows, breaks = [], []
+    target = windows
+    for arg in args[2:]:
+        if arg.lower() in ('перерыв', 'перерывы'):
+            target = breaks
+            continue
+        window = parse_window(arg)
+        if window is None:
+            update.message.reply_text(f"Не удалось разобрать интервал '{arg}'.\n{usage}")
+            return
+        target.append(window)
+    if not windows:
+        update.message.reply_text(usage)
+        return
+    user_id = update.message.from_user.id
+    if not set_schedule_template(user_id, service_id, weekdays, windows, breaks, AVAILABILITY_STEP_MINUTES):
+        update.message.reply_text("Не удалось сохранить расписание. Попробуйте позже.")
+        return
+    request_materialization()
+    days_text = ", ".join(WEEKDAY_LABELS[d] for d in weekdays)
+    update.message.reply_text(f"Расписание по услуге {service_id} на {days_text} сохранено. Слоты появятся в течение минуты.")
+
+def clear_schedule_command(update: telegram.Update, context: CallbackContext) -> None:
+    """Обработка команды /clear_schedule <ID услуги> [дни] — удаление недельного шаблона."""
+    args = context.args
+    if not args:
+        update.message.reply_text("Используйте команду: /clear_schedule <ID услуги> [дни].\nНапример: /clear_schedule 2 сб-вс")
+        return
+    try:
+        service_id = int(args[0])
+    except ValueError:
+        update.message.reply_text("Первый аргумент должен быть числом — ID услуги.")
+        return
+    weekdays = parse_weekdays(args[1]) if len(args) > 1 else None
+    if len(args) > 1 and not weekdays:
+        update.message.reply_text("Не удалось разобрать дни недели. Примеры: пн, пн-пт, пн,ср,пт, ежедневно.")
+        return
+    if clear_schedule_template(update.message.from_user.id, service_id, weekdays):
+        request_materialization()
+        update.message.reply_text("Расписание удалено. Свободные слоты по нему будут сняты.")
+    else:
+        update.message.reply_text("Расписание не найдено.")
+
+def add_exception(update: telegram.Update, args: List[str], service_id: Optional[int], is_available: bool) -> bool:
+    windows = [parse_window(arg) for arg in args if WINDOW_RE.match(arg)]
+    date = parse_date(" ".join(arg for arg in args if not WINDOW_RE.match(arg)))
+    if date is None or None in windows or len(windows) > 1 or (is_available and not windows):
+        return False
+    start, end = windows[0] if windows else (None, None)
+    user_id = update.message.from_user.id
+    if not add_schedule_exception(user_id, date, is_available, service_id, start, end):
+        return False
+    if not is_available:
+        # Слоты на выходное время (в том числе добавленные вручную) снимаем сразу, одним запросом
+        day_start = datetime.datetime.combine(date, start or datetime.time(0, 0))
+        day_end = datetime.datetime.combine(date, end) if end else \
+            datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time(0, 0))
+        remove_free_time_ranges(user_id, service_id, [(day_start, day_end)])
+    request_materialization()
+    return True
+
+def day_off_command(update: telegram.Update, context: CallbackContext) -> None:
+    """
+    Обработка команды /day_off <дата> [ЧЧ:ММ-ЧЧ:ММ] — выходной на дату по всем услугам
+    (весь день или указанное окно).
+    """
+    if add_exception(update, context.args, None, is_available=False):
+        update.message.reply_text("Исключение сохранено, свободные слоты на это время будут сняты.")
+    else:
+        update.message.reply_text("Используйте команду: /day_off <дата> [ЧЧ:ММ-ЧЧ:ММ].\nНапример: /day_off 2025-03-08 или /day_off завтра 12:00-15:00")
+
+def extra_hours_command(update: telegram.Update, context: CallbackContext) -> None:
+    """Обработка команды /extra_hours <ID услуги> <дата> <ЧЧ:ММ-ЧЧ:ММ> — дополнительные часы на дату."""
+    args = context.args
+    try:
+        service_id = int(args[0]) if args else None
+    except ValueError:
+        service_id = None
+    if service_id is not None and add_exception(update, args[1:], service_id, is_available=True):
+        update.message.reply_text("Дополнительные часы сохранены, слоты появятся в течение минуты.")
+    else:
+        update.message.reply_text("Используйте команду: /extra_hours <ID услуги> <дата> <ЧЧ:ММ-ЧЧ:ММ>.\nНапример: /extra_hours 2 суббота 10:00-14:00")
+
+def show_schedule_command(update: telegram.Update, context: CallbackContext) -> None:
+    """Обработка команды /show_schedule — недельные шаблоны и ближайшие исключения."""
+    user_id = update.message.from_user.id
+    templates = get_schedule_templates(user_id)
+    today = datetime.date.today()
+    exceptions = get_schedule_exceptions(today, today + datetime.timedelta(days=31), user_id)
+    if not templates and not exceptions:
+        update.message.reply_text("Расписание не задано. Используйте /set_schedule.")
+        return
+    lines = []
+    for row in templates:
+        kind = "перерыв " if row['is_break'] else ""
+        lines.append(f"Услуга {row['service_id']}, {WEEKDAY_LABELS[row['weekday']]}: {kind}"
+                     f"{row['start_time']:%H:%M}-{row['end_time']:%H:%M}")
+    for row in exceptions:
+        window = f"{row['start_time']:%H:%M}-{row['end_time']:%H:%M}" if row['start_time'] else "весь день"
+        kind = "дополнительно" if row['is_available'] else "выходной"
+        service = f"услуга {row['service_id']}" if row['service_id'] else "все услуги"
+        lines.append(f"{row['date']:%Y-%m-%d}: {kind} {window} ({service})")
+    update.message.reply_text("Ваше расписание:\n" + "\n".join(lines))
@@ -1,7 +1,10 @@
 from typing import Optional
 from telegram import Update
 from telegram.ext import CallbackContext
-from database.queries import get_bookings_for_specialist, cancel_booking_by_id, get_specialist_name, get_available_times, add_service_to_specialist
+from database.queries import cancel_booking_by_id, get_specialist_name, add_service_to_specialist
+from handlers.booking_list import send_bookings_page
+from services.outbox_relay import request_outbox_relay
+from services.scheduler import get_available_times
 from utils.logger import logger
 
 def specialist_command_free_time(update: Update, context: CallbackContext):
@@ -39,20 +42,7 @@ def specialist_command_appointments(update: Update, context: CallbackContext):
     if not spec_name:
         update.message.reply_text(f"Специалист с id={spec_id} не найден.")
         return
-    bookings = get_bookings_for_specialist(spec_id)
-    if not bookings:
-        update.message.reply_text(f"У {spec_name} (id={spec_id}) нет активных записей.")
-        return
-    lines = []
-    for b in bookings:
-        lines.append(
-            f"📅 ID брони: {b['id']}\n"
-            f"   Дата/время: {b['date_time']}\n"
-            f"   Услуга: {b['service_name']}\n"
-            f"   Клиент: ID {b['user_id']} (Имя: {b['user_name']})"
-        )
-    msg = "\n\n".join(lines)
-    update.message.reply_text(f"Активные записи для {spec_name} (id={spec_id}):\n\n{msg}")
+    send_bookings_page(update, spec_id, f"У {spec_name} (id={spec_id}) нет активных записей.")
 
 def specialist_command_cancel_booking(update: Update, context: CallbackContext):
     args = context.args
@@ -65,6 +55,8 @@ def specialist_command_cancel_booking(update: Update, context: CallbackContext):
         update.message.reply_text("Укажите корректный ID брони (число). Пример: /spec_cancel_booking 42")
         return
     ok, message = cancel_booking_by_id(booking_id)
+    if ok:
+        request_outbox_relay()
     update.message.reply_text(message)
 
 def specialist_command_add_service(update: Update, context: CallbackContext):
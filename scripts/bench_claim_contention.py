@@ -0,0 +1,161 @@
+"""
+Нагрузочная проверка захвата слотов в create_booking.
+
+Много параллельных клиентов одновременно подтверждают запись на несколько
+популярных слотов. Скрипт проверяет, что каждый слот достаётся ровно одному
+клиенту, и считает пропускную способность и задержки.
+
+Нужна настоящая БД (переменные окружения как у бота) и существующие
+специалист, услуга и пользователь. Слоты создаются на дату далеко в будущем
+и удаляются вместе с записями, их событиями и напоминаниями по окончании;
+события о тестовых записях сразу отмечаются обработанными, чтобы фоновая
+рассылка бота не отправила о них уведомления менеджерам.
+
+    python scripts/bench_claim_contention.py --specialist 1 --service 2 --user 123456 \\
+        --slots 3 --claimers 64 --rounds 5
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--specialist", type=int, required=True, help="ID специалиста")
+    parser.add_argument("--service", type=int, required=True, help="ID услуги")
+    parser.add_argument("--user", type=int, required=True, help="ID пользователя, от имени которого создаются записи")
+    parser.add_argument("--slots", type=int, default=3, help="Сколько слотов разыгрывать за раунд")
+    parser.add_argument("--claimers", type=int, default=64, help="Сколько параллельных клиентов")
+    parser.add_argument("--rounds", type=int, default=5, help="Сколько раундов")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    # Пулу нужно хватить соединений на всех клиентов сразу
+    os.environ.setdefault("DB_POOL_MAX_SIZE", str(args.claimers + 2))
+
+    from database.connection import init_db, db_session, get_db_connection, get_standalone_connection
+    from database.queries import create_booking, add_free_time_slots, BOOKING_CREATED, BOOKING_SLOT_TAKEN
+
+    init_db()
+    base = datetime.datetime(2099, 1, 1, 9, 0)
+    slots = [(base + datetime.timedelta(days=r, minutes=30 * i)).strftime("%Y-%m-%d %H:%M")
+             for r in range(args.rounds) for i in range(args.slots)]
+
+    def cleanup():
+        conn = get_standalone_connection()
+        cur = conn.cursor()
+        try:
+            # События и напоминания по тестовым записям — до удаления самих записей
+            cur.execute("""
+                DELETE FROM booking_events
+                WHERE booking_id IN (SELECT id FROM bookings WHERE specialist_id = %s AND date_time >= %s)
+            """, (args.specialist, base))
+            cur.execute("""
+                DELETE FROM booking_reminders
+                WHERE booking_id IN (SELECT id FROM bookings WHERE specialist_id = %s AND date_time >= %s)
+            """, (args.specialist, base))
+            cur.execute("DELETE FROM bookings WHERE specialist_id = %s AND date_time >= %s",
+                        (args.specialist, base))
+            cur.execute("DELETE FROM booking_times WHERE specialist_id = %s AND slot_time >= %s",
+                        (args.specialist, base))
+            cur.execute("DELETE FROM booking_daily_stats WHERE specialist_id = %s AND day >= %s",
+                        (args.specialist, base.date()))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    cleanup()
+    report = add_free_time_slots(args.specialist, args.service, slots)
+    if len(report['added']) != len(slots):
+        print(f"Не удалось создать слоты: {report}")
+        cleanup()
+        return 1
+
+    results = Counter()
+    winners = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def claimer(index: int, round_slots, barrier):
+        slot = round_slots[index % len(round_slots)]
+        barrier.wait()
+        started = time.perf_counter()
+        with db_session():
+            result = create_booking(args.user, args.service, args.specialist, slot)
+            if result == BOOKING_CREATED:
+                # В той же транзакции гасим событие о записи, иначе рассылка
+                # работающего бота отправит менеджерам уведомление о тестовой записи
+                conn = get_db_connection()
+                cur = conn.cursor()
+                try:
+                    cur.execute("""
+                        UPDATE booking_events e
+                        SET processed_at = NOW()
+                        FROM bookings b
+                        WHERE e.booking_id = b.id AND e.processed_at IS NULL
+                            AND b.specialist_id = %s AND b.date_time = %s
+                    """, (args.specialist, datetime.datetime.strptime(slot, "%Y-%m-%d %H:%M")))
+                finally:
+                    cur.close()
+                    conn.close()
+        elapsed = time.perf_counter() - started
+        with lock:
+            results[result] += 1
+            latencies.append(elapsed)
+            if result == BOOKING_CREATED:
+                winners[slot] += 1
+
+    total_started = time.perf_counter()
+    for r in range(args.rounds):
+        round_slots = slots[r * args.slots:(r + 1) * args.slots]
+        barrier = threading.Barrier(args.claimers)
+        threads = [threading.Thread(target=claimer, args=(i, round_slots, barrier)) for i in range(args.claimers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    total_elapsed = time.perf_counter() - total_started
+
+    conn = get_standalone_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT date_time, COUNT(*) FROM bookings
+            WHERE specialist_id = %s AND date_time >= %s
+            GROUP BY date_time
+        """, (args.specialist, base))
+        stored = {row[0].strftime("%Y-%m-%d %H:%M"): row[1] for row in cur.fetchall()}
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    cleanup()
+
+    attempts = args.claimers * args.rounds
+    latencies.sort()
+    print(f"Попыток: {attempts}, слотов: {len(slots)}, время: {total_elapsed:.2f} с, "
+          f"пропускная способность: {attempts / total_elapsed:.0f} попыток/с")
+    print(f"Результаты: {dict(results)}")
+    print(f"Задержка: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс, "
+          f"максимум {latencies[-1] * 1000:.1f} мс")
+
+    ok = all(winners[slot] == 1 and stored.get(slot) == 1 for slot in slots)
+    ok = ok and results[BOOKING_CREATED] == len(slots)
+    ok = ok and results[BOOKING_SLOT_TAKEN] == attempts - len(slots)
+    print("Каждый слот занят ровно один раз" if ok else f"ОШИБКА: победители {dict(winners)}, в БД {stored}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
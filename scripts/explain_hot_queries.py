@@ -0,0 +1,30 @@
+"""
+Проверка планов запросов горячего пути: каждый должен пользоваться индексом
+из миграций (database/migrations.py). Нужна настоящая БД с применёнными миграциями.
+
+    python scripts/explain_hot_queries.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main() -> int:
+    from database.connection import init_db, get_standalone_connection
+    from database.migrations import explain_hot_queries
+
+    init_db()
+    conn = get_standalone_connection()
+    try:
+        report = explain_hot_queries(conn)
+    finally:
+        conn.close()
+    for name, result in report.items():
+        status = "ok" if result['ok'] else "НЕТ ИНДЕКСА"
+        print(f"{status:12} {name}: {', '.join(result['indexes']) or 'последовательное сканирование'}")
+    return 0 if all(result['ok'] for result in report.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,41 @@
+import datetime
 import json
-import openai
 from typing import Dict, Optional, List, Tuple
-from config.settings import OPENAI_API_KEY, GPT_MODEL
+from config.settings import GPT_CACHE_SIZE, GPT_CACHE_TTL, GPT_CACHE_PATH
+from utils.cache import TTLCache
 from utils.logger import logger
 from database.queries import get_service_name, get_specialist_name
 from conversation import get_conversation_history
+from services.gpt_client import gpt_client
+from services.prompt_builder import build_history_context
+from services.intent import normalize_text
+from services.name_matcher import specialists_fingerprint
 
-openai.api_key = OPENAI_API_KEY
+# Результаты вспомогательных запросов к GPT повторяются (одни и те же имена
+# и фразы), поэтому запоминаем их: повтор не стоит ни токенов, ни задержки.
+resolution_cache = TTLCache(ttl=GPT_CACHE_TTL, name="gpt_resolution", max_size=GPT_CACHE_SIZE)
+
+WEEKDAY_NAMES = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"]
+
+def load_resolution_cache() -> None:
+    if not GPT_CACHE_PATH:
+        return
+    try:
+        loaded = resolution_cache.load(GPT_CACHE_PATH)
+        logger.info(f"Загружено {loaded} записей кэша GPT из {GPT_CACHE_PATH}")
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось загрузить кэш GPT: {e}")
+
+def save_resolution_cache() -> None:
+    if not GPT_CACHE_PATH:
+        return
+    try:
+        resolution_cache.save(GPT_CACHE_PATH)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить кэш GPT: {e}")
+
+def get_resolution_cache_stats() -> Dict:
+    return resolution_cache.stats()
 
 def get_booking_system_prompt() -> str:
     return """
@@ -34,7 +63,7 @@ def get_booking_system_prompt() -> str:
     }
     """
 
-def get_booking_context(state: Optional[Dict], user_id: int) -> str:
+def get_booking_state_context(state: Optional[Dict]) -> str:
     context = ""
     if state:
         context += f"Текущий этап бронирования: {state.get('step')}\n"
@@ -46,25 +75,37 @@ def get_booking_context(state: Optional[Dict], user_id: int) -> str:
             context += f"Выбранный специалист: {specialist_name}\n"
         if state.get('chosen_time'):
             context += f"Выбранное время: {state['chosen_time']}\n"
+    return context
+
+def get_booking_context(state: Optional[Dict], user_id: int, system_prompt: str = "", user_text: str = "") -> str:
+    """
+    Контекст для determine_intent: состояние записи плюс история беседы,
+    урезанная до бюджета токенов (ранние реплики сворачиваются в сводку).
+    """
+    context = get_booking_state_context(state)
     history = get_conversation_history(user_id)
     if history:
-        context += "История беседы:\n"
-        for msg in history:
-            context += f"{msg['role']}: {msg['content']}\n"
+        history_context, info = build_history_context(history, system_prompt + context + user_text)
+        context += history_context
+        logger.info(
+            f"Промпт для user {user_id}: фикс. {info['fixed_tokens']} ток., история {info['history_tokens']} ток. "
+            f"({info['turns_included']}/{info['turns_total']} реплик), сводка {info['summary_tokens']} ток. "
+            f"({info['turns_summarized']} реплик)"
+        )
     return context
 
 def determine_intent(user_id: int, user_text: str, state: Optional[Dict] = None) -> Dict:
     try:
         system_prompt = get_booking_system_prompt()
-        context = get_booking_context(state, user_id)
-        response = openai.ChatCompletion.create(
-            model=GPT_MODEL,
+        context = get_booking_context(state, user_id, system_prompt, user_text)
+        response = gpt_client.chat(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Контекст:\n{context}\nСообщение пользователя: {user_text}"}
             ],
             temperature=0.7,
-            max_tokens=200
+            max_tokens=200,
+            purpose="determine_intent"
         )
         gpt_response = response.choices[0].message.content
         logger.info(f"GPT response for user {user_id}: {gpt_response}")
@@ -88,24 +129,30 @@ def get_gpt_response(user_id: int, user_text: str, state: Optional[Dict] = None)
     return determine_intent(user_id, user_text, state)
 
 def resolve_specialist_name(input_text: str, specialists: List[Tuple[int, str]]) -> str:
+    cache_key = ("specialist", normalize_text(input_text), specialists_fingerprint(specialists))
+    cached = resolution_cache.get(cache_key)
+    if cached is not None:
+        return cached
     specialist_names = [s[1] for s in specialists]
     prompt = (
         f"У меня есть список специалистов: {', '.join(specialist_names)}. "
         f"Пользователь ввёл: '{input_text}'. "
         f"Какой специалист имеется в виду? Ответь только точным именем из списка."
     )
-    response = openai.ChatCompletion.create(
-         model=GPT_MODEL,
+    response = gpt_client.chat(
          messages=[
              {"role": "system", "content": "Ты помощник по бронированию услуг в салоне красоты."},
              {"role": "user", "content": prompt}
          ],
          temperature=0.3,
-         max_tokens=20
+         max_tokens=20,
+         purpose="resolve_specialist_name"
     )
     # Удаляем завершающие пробелы и возможную точку
     resolved_name = response.choices[0].message.content.strip().rstrip('.')
     logger.info(f"Resolved specialist name: {resolved_name} for input: {input_text}")
+    if resolved_name in specialist_names:
+        resolution_cache.set(cache_key, resolved_name)
     return resolved_name
 
 def resolve_free_time(input_text: str) -> List[str]:
@@ -113,22 +160,31 @@ def resolve_free_time(input_text: str) -> List[str]:
     Принимает ввод пользователя о свободном времени (например, "завтра весь день свободен",
     "освободи в 27 числа в 15" и т.д.) и возвращает список временных слотов в формате "YYYY-MM-DD HH:MM",
     разделенных запятыми.
+    Относительные даты зависят от текущего дня, поэтому он входит и в запрос, и в ключ кэша.
     """
+    today = datetime.date.today()
+    cache_key = ("free_time", normalize_text(input_text), today.isoformat())
+    cached = resolution_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
     prompt = (
+        f"Сегодня {today.isoformat()} ({WEEKDAY_NAMES[today.weekday()]}). "
         f"Пользователь сказал: '{input_text}'. "
         "Интерпретируй этот запрос и верни список временных слотов в формате 'YYYY-MM-DD HH:MM', разделенных запятыми. "
         "Если указано 'весь день', верни слоты с интервалом 30 минут с начала рабочего дня (например, с 09:00 до 18:00)."
     )
-    response = openai.ChatCompletion.create(
-         model=GPT_MODEL,
+    response = gpt_client.chat(
          messages=[
              {"role": "system", "content": "Ты помощник по управлению расписанием специалиста в салоне красоты."},
              {"role": "user", "content": prompt}
          ],
          temperature=0.3,
-         max_tokens=100
+         max_tokens=400,
+         purpose="resolve_free_time"
     )
     free_time_str = response.choices[0].message.content.strip()
     logger.info(f"Resolved free time slots: {free_time_str} for input: {input_text}")
     slots = [slot.strip() for slot in free_time_str.split(",") if slot.strip()]
+    if slots:
+        resolution_cache.set(cache_key, slots)
     return slots
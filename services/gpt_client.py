@@ -0,0 +1,216 @@
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+import openai
+from config.settings import (
+    OPENAI_API_KEY,
+    GPT_MODEL,
+    GPT_TIMEOUT,
+    GPT_MAX_RETRIES,
+    GPT_MAX_CONCURRENCY,
+    GPT_QUEUE_TIMEOUT
+)
+from database.connection import release_db_session
+from utils.logger import logger
+
+openai.api_key = OPENAI_API_KEY
+
+# Ошибки, после которых имеет смысл повторить запрос
+RETRYABLE_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
+# Границы корзин гистограмм расхода токенов
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096)
+# Как часто (в вызовах) писать гистограммы в лог
+HISTOGRAM_LOG_EVERY = 100
+
+
+class GPTOverloadedError(Exception):
+    pass
+
+
+def _bucket_label(tokens: int) -> str:
+    for bound in TOKEN_BUCKETS:
+        if tokens <= bound:
+            return f"<={bound}"
+    return f">{TOKEN_BUCKETS[-1]}"
+
+
+class GPTClient:
+    """
+    Единая обёртка над openai.ChatCompletion.create:
+    - общий дедлайн на вызов (включая повторы),
+    - повторы с экспоненциальной задержкой и джиттером на временных ошибках,
+    - глобальный лимит одновременных запросов; остальные ждут в очереди
+      не дольше queue_timeout секунд,
+    - учёт задержек и расхода токенов по назначению вызова.
+    Перед запросом транзакция текущего обновления фиксируется и её соединение
+    возвращается в пул: ожидание OpenAI не должно держать соединение с БД.
+    """
+
+    def __init__(self, model: str, timeout: float, max_retries: int, max_concurrency: int, queue_timeout: float,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._rejected = 0
+        self._stats: Dict[str, Dict] = {}
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, RETRYABLE_ERRORS):
+            return True
+        if isinstance(error, openai.error.APIError):
+            status = getattr(error, "http_status", None)
+            return status is None or status >= 500
+        return False
+
+    def _purpose_stats(self, purpose: str) -> Dict:
+        stats = self._stats.get(purpose)
+        if stats is None:
+            stats = self._stats[purpose] = {
+                'calls': 0,
+                'failures': 0,
+                'retries': 0,
+                'latency_total': 0.0,
+                'latency_max': 0.0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'prompt_histogram': {},
+                'completion_histogram': {}
+            }
+        return stats
+
+    def _acquire(self) -> None:
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            raise GPTOverloadedError(f"Нет свободного слота для запроса к GPT за {self.queue_timeout} с")
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    def chat(self, messages: List[Dict], temperature: float, max_tokens: int, purpose: str = "chat",
+             timeout: Optional[float] = None):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        started = time.monotonic()
+        retries = 0
+        release_db_session()
+        self._acquire()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise openai.error.Timeout(f"Истёк дедлайн запроса к GPT ({purpose})")
+                try:
+                    response = openai.ChatCompletion.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        request_timeout=remaining
+                    )
+                    break
+                except Exception as e:
+                    if retries >= self.max_retries or not self._is_retryable(e):
+                        raise
+                    delay = min(self.backoff_max, self.backoff_base * (2 ** retries)) * random.uniform(0.5, 1.5)
+                    if time.monotonic() + delay >= deadline:
+                        raise
+                    retries += 1
+                    logger.warning(f"Временная ошибка GPT ({purpose}): {e}. Повтор {retries} через {delay:.2f} с")
+                    time.sleep(delay)
+        except Exception:
+            self._record(purpose, started, retries, None, failed=True)
+            raise
+        finally:
+            self._release()
+        self._record(purpose, started, retries, response, failed=False)
+        return response
+
+    def _record(self, purpose: str, started: float, retries: int, response, failed: bool) -> None:
+        latency = time.monotonic() - started
+        usage = getattr(response, "usage", None) if response is not None else None
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            stats = self._purpose_stats(purpose)
+            stats['calls'] += 1
+            stats['retries'] += retries
+            stats['latency_total'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            if failed:
+                stats['failures'] += 1
+            else:
+                prompt_label = _bucket_label(prompt_tokens)
+                completion_label = _bucket_label(completion_tokens)
+                stats['prompt_histogram'][prompt_label] = stats['prompt_histogram'].get(prompt_label, 0) + 1
+                stats['completion_histogram'][completion_label] = stats['completion_histogram'].get(completion_label, 0) + 1
+            log_histograms = stats['calls'] % HISTOGRAM_LOG_EVERY == 0
+            histograms = (dict(stats['prompt_histogram']), dict(stats['completion_histogram']))
+        logger.info(
+            f"GPT {purpose}: {latency * 1000:.0f} мс, повторов {retries}, "
+            f"токены {prompt_tokens}+{completion_tokens}{', ошибка' if failed else ''}"
+        )
+        if log_histograms:
+            logger.info(f"GPT {purpose}: гистограмма токенов промпта {histograms[0]}, ответа {histograms[1]}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            per_purpose = {}
+            for purpose, stats in self._stats.items():
+                calls = stats['calls']
+                per_purpose[purpose] = {
+                    'calls': calls,
+                    'failures': stats['failures'],
+                    'retries': stats['retries'],
+                    'latency_avg_ms': round(stats['latency_total'] / calls * 1000, 1) if calls else 0.0,
+                    'latency_max_ms': round(stats['latency_max'] * 1000, 1),
+                    'prompt_tokens': stats['prompt_tokens'],
+                    'completion_tokens': stats['completion_tokens'],
+                    'prompt_histogram': dict(stats['prompt_histogram']),
+                    'completion_histogram': dict(stats['completion_histogram'])
+                }
+            return {
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'max_concurrency': self.max_concurrency,
+                'rejected': self._rejected,
+                'calls': per_purpose
+            }
+
+
+gpt_client = GPTClient(
+    model=GPT_MODEL,
+    timeout=GPT_TIMEOUT,
+    max_retries=GPT_MAX_RETRIES,
+    max_concurrency=GPT_MAX_CONCURRENCY,
+    queue_timeout=GPT_QUEUE_TIMEOUT
+)
@@ -0,0 +1,98 @@
+import re
+import threading
+from typing import Dict, Optional, Tuple, List
+from database.queries import find_service_by_name, get_specialists
+from services.name_matcher import match_specialist
+from services.scheduler import get_available_times
+from utils.time_utils import parse_time_input
+from utils.logger import logger
+
+CONFIRM_WORDS = {'да', 'yes', 'подтверждаю', 'ок', 'ok', 'верно', 'конечно', 'давай', 'да, подтверждаю'}
+REJECT_WORDS = {'нет', 'no', 'не надо', 'не нужно'}
+CANCEL_WORDS = {'отмена', 'cancel', 'стоп', 'stop', 'отменить', 'отменить запись'}
+LIST_SERVICES_WORDS = {'услуги', 'список услуг', 'какие услуги', 'какие есть услуги', 'прайс', 'записаться', 'запиши меня', 'хочу записаться'}
+
+_stats_lock = threading.Lock()
+_stats = {'local': 0, 'gpt': 0, 'actions': {}}
+
+
+def normalize_text(text: str) -> str:
+    cleaned = re.sub(r"[!?.…]+$", "", text.strip().lower())
+    return re.sub(r"\s+", " ", cleaned).replace("ё", "е")
+
+
+def _result(action: str, response: str, **extracted) -> Dict:
+    return {"action": action, "response": response, "extracted_data": extracted, "source": "local"}
+
+
+def _match_specialist(text: str, specialists: List[Tuple[int, str]]) -> Optional[Tuple[int, str]]:
+    exact = [s for s in specialists if normalize_text(s[1]) == text]
+    if len(exact) == 1:
+        return exact[0]
+    # Уменьшительные формы, падежи, фамилии, опечатки ("к Маше" -> "Мария Иванова")
+    return match_specialist(text, specialists)
+
+
+def classify_locally(user_text: str, state: Optional[Dict]) -> Optional[Dict]:
+    """
+    Детерминированно распознаёт тривиальные сообщения по текущему шагу записи
+    (подтверждение, отмена, выбор услуги/специалиста/времени из показанного списка).
+    Возвращает результат в том же формате, что и determine_intent, либо None,
+    если без GPT не обойтись.
+    """
+    text = normalize_text(user_text)
+    if not text:
+        return None
+    step = state.get('step') if state else None
+
+    if step == 'confirm':
+        if text in CONFIRM_WORDS:
+            return _result("CONFIRM_BOOKING", "Отлично! Ваша запись подтверждена. Ждём вас!")
+        if text in REJECT_WORDS or text in CANCEL_WORDS:
+            return _result("CONFIRM_BOOKING", "Хорошо, запись отменена. Если захотите выбрать другое время, просто напишите.")
+        return None
+
+    if text in CANCEL_WORDS:
+        return _result("CANCEL_BOOKING", "Процесс записи отменён.")
+
+    if step == 'select_time' and state.get('service_id') and state.get('specialist_id'):
+        available_times = get_available_times(state['specialist_id'], state['service_id'])
+        chosen_time = parse_time_input(user_text.strip(), available_times)
+        if chosen_time:
+            return _result("SELECT_TIME", "", time=chosen_time)
+
+    if step == 'select_specialist' and state.get('service_id'):
+        specialist = _match_specialist(text, get_specialists(state['service_id']))
+        if specialist:
+            return _result("SELECT_SPECIALIST", f"Отлично, вы выбрали специалиста {specialist[1]}!", specialist=specialist[1])
+
+    service = find_service_by_name(user_text)
+    if service and (not state or state.get('service_id') != service[0]):
+        return _result("SELECT_SERVICE", "", service=service[1])
+
+    if text in LIST_SERVICES_WORDS:
+        return _result("LIST_SERVICES", "С удовольствием помогу с записью! Выберите услугу:")
+
+    return None
+
+
+def record_intent_source(result: Dict) -> None:
+    source = result.get('source', 'gpt')
+    with _stats_lock:
+        _stats['local' if source == 'local' else 'gpt'] += 1
+        if source == 'local':
+            action = result.get('action')
+            _stats['actions'][action] = _stats['actions'].get(action, 0) + 1
+    if source == 'local':
+        logger.info(f"Намерение определено локально: {result.get('action')}")
+
+
+def get_intent_stats() -> Dict:
+    with _stats_lock:
+        total = _stats['local'] + _stats['gpt']
+        return {
+            'local': _stats['local'],
+            'gpt': _stats['gpt'],
+            'fast_path_hit_rate': round(_stats['local'] / total, 3) if total else 0.0,
+            'local_actions': dict(_stats['actions'])
+        }
@@ -0,0 +1,246 @@
+import hashlib
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+# Уменьшительные формы -> полные имена
+DIMINUTIVES: Dict[str, List[str]] = {
+    'маша': ['мария'], 'машенька': ['мария'], 'маня': ['мария'], 'муся': ['мария'],
+    'даша': ['дарья'], 'дашенька': ['дарья'],
+    'саша': ['александр', 'александра'], 'шура': ['александр', 'александра'], 'саня': ['александр', 'александра'],
+    'женя': ['евгений', 'евгения'],
+    'катя': ['екатерина'], 'катенька': ['екатерина'], 'катюша': ['екатерина'],
+    'настя': ['анастасия'], 'настенька': ['анастасия'],
+    'лена': ['елена'], 'леночка': ['елена'], 'аленка': ['алена'],
+    'оля': ['ольга'], 'оленька': ['ольга'],
+    'таня': ['татьяна'], 'танечка': ['татьяна'],
+    'наташа': ['наталья', 'наталия'], 'ната': ['наталья', 'наталия'],
+    'света': ['светлана'], 'светочка': ['светлана'],
+    'юля': ['юлия'], 'юленька': ['юлия'],
+    'ира': ['ирина'], 'ирочка': ['ирина'],
+    'аня': ['анна'], 'анечка': ['анна'], 'анюта': ['анна'],
+    'вика': ['виктория'],
+    'надя': ['надежда'],
+    'галя': ['галина'],
+    'валя': ['валентина', 'валентин'],
+    'люба': ['любовь'],
+    'ксюша': ['ксения'],
+    'поля': ['полина'],
+    'соня': ['софья', 'софия'],
+    'лиза': ['елизавета'],
+    'рита': ['маргарита'],
+    'кристи': ['кристина'],
+    'алина': ['алина'],
+    'дима': ['дмитрий'],
+    'миша': ['михаил'],
+    'коля': ['николай'],
+    'петя': ['петр'],
+    'ваня': ['иван'],
+    'вова': ['владимир'], 'володя': ['владимир'],
+    'сережа': ['сергей'],
+    'леша': ['алексей'], 'алеша': ['алексей'],
+    'костя': ['константин'],
+    'паша': ['павел'],
+    'гоша': ['георгий'], 'жора': ['георгий'],
+    'слава': ['вячеслав', 'ярослав', 'станислав'],
+    'толя': ['анатолий'],
+    'витя': ['виктор'],
+    'гена': ['геннадий'],
+    'рома': ['роман'],
+    'тема': ['артем'],
+    'андрюша': ['андрей'],
+    'стас': ['станислав'],
+}
+
+# Падежные окончания, от длинных к коротким
+CASE_ENDINGS = (
+    'ами', 'ями', 'ией', 'ьей', 'ого', 'его', 'ому', 'ему',
+    'ой', 'ей', 'ою', 'ею', 'ом', 'ем', 'ии', 'ию', 'ия', 'ья', 'ью', 'ье', 'ьи',
+    'ы', 'и', 'а', 'я', 'у', 'ю', 'е', 'о', 'ь', 'й',
+)
+# Служебные слова, которые пользователи добавляют к имени
+STOP_WORDS = {'к', 'у', 'ко', 'мастер', 'мастеру', 'мастера', 'хочу', 'запиши', 'меня', 'пожалуйста', 'можно', 'давай', 'на', 'с'}
+
+MIN_SCORE = 0.75
+MIN_MARGIN = 0.15
+
+
+def normalize_name(text: str) -> str:
+    text = text.lower().replace('ё', 'е').replace('_', ' ')
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def stem(word: str) -> str:
+    """Грубо отрезает падежное окончание: "Марии", "Марию" -> "мар"."""
+    for ending in CASE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dice(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def specialists_fingerprint(specialists: List[Tuple[int, str]]) -> str:
+    names = "\n".join(sorted(f"{s[0]}:{s[1]}" for s in specialists))
+    return hashlib.sha1(names.encode("utf-8")).hexdigest()
+
+
+class _Token:
+    __slots__ = ('word', 'stem', 'grams')
+
+    def __init__(self, word: str):
+        self.word = word
+        self.stem = stem(word)
+        self.grams = trigrams(self.stem)
+
+
+class SpecialistMatcher:
+    """
+    Локальный сопоставитель ввода пользователя с именами специалистов:
+    уменьшительные формы, падежи, инициалы/фамилии, опечатки (расстояние
+    Левенштейна) и похожесть по триграммам. Возвращает специалиста, только
+    если лучший кандидат уверенно отрывается от второго.
+    """
+
+    def __init__(self, specialists: List[Tuple[int, str]]):
+        self.specialists = list(specialists)
+        self._tokens: Dict[int, List[_Token]] = {}
+        # Индекс "основа слова -> id" для точных совпадений имени или фамилии
+        self._stem_index: Dict[str, Set[int]] = {}
+        # Индекс "первая буква -> id" для инициалов
+        self._initial_index: Dict[str, Set[int]] = {}
+        for spec_id, name in self.specialists:
+            tokens = [_Token(w) for w in normalize_name(name).split()]
+            self._tokens[spec_id] = tokens
+            for token in tokens:
+                self._stem_index.setdefault(token.stem, set()).add(spec_id)
+                self._initial_index.setdefault(token.word[0], set()).add(spec_id)
+
+    def _token_score(self, query: _Token, candidates: List[str], spec_tokens: List[_Token]) -> float:
+        best = 0.0
+        for token in spec_tokens:
+            for variant in candidates:
+                if variant == token.stem:
+                    return 1.0
+            if len(query.word) == 1:
+                if token.word[0] == query.word:
+                    best = max(best, 0.6)
+                continue
+            distance = levenshtein(query.stem, token.stem)
+            longest = max(len(query.stem), len(token.stem))
+            edit_similarity = 1 - distance / longest if longest else 0.0
+            best = max(best, edit_similarity * 0.9, dice(query.grams, token.grams))
+        return best
+
+    def rank(self, text: str) -> List[Tuple[float, Tuple[int, str]]]:
+        queries = self._queries(text)
+        if not queries:
+            return []
+        ranked = []
+        for spec in self.specialists:
+            spec_tokens = self._tokens[spec[0]]
+            scores = [self._token_score(token, variants, spec_tokens) for token, variants in queries]
+            ranked.append((sum(scores) / len(scores), spec))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return ranked
+
+    def _queries(self, text: str) -> List[Tuple[_Token, List[str]]]:
+        words = [w for w in normalize_name(text).split() if w not in STOP_WORDS]
+        queries = []
+        for word in words:
+            token = _Token(word)
+            variants = [token.stem] + [stem(full) for full in DIMINUTIVES.get(word, [])]
+            queries.append((token, variants))
+        return queries
+
+    def _indexed_candidates(self, queries: List[Tuple[_Token, List[str]]]) -> Set[int]:
+        """Специалисты, у которых каждое слово ввода совпало с основой или инициалом."""
+        result: Optional[Set[int]] = None
+        for token, variants in queries:
+            if len(token.word) == 1:
+                ids = self._initial_index.get(token.word, set())
+            else:
+                ids = set()
+                for variant in variants:
+                    ids |= self._stem_index.get(variant, set())
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return result or set()
+
+    def match(self, text: str) -> Optional[Tuple[int, str]]:
+        queries = self._queries(text)
+        if not queries:
+            return None
+        has_full_word = any(len(token.word) > 1 for token, _ in queries)
+        ids = self._indexed_candidates(queries)
+        if has_full_word and len(ids) == 1:
+            spec_id = next(iter(ids))
+            return next(s for s in self.specialists if s[0] == spec_id)
+        ranked = self.rank(text)
+        if not ranked:
+            return None
+        best_score, best = ranked[0]
+        second_score = ranked[1][0] if len(ranked) > 1 else 0.0
+        if best_score >= MIN_SCORE and best_score - second_score >= MIN_MARGIN:
+            return best
+        return None
+
+
+_matchers: Dict[str, SpecialistMatcher] = {}
+_matchers_lock = threading.Lock()
+_stats = {'local': 0, 'ambiguous': 0}
+
+
+def get_matcher(specialists: List[Tuple[int, str]]) -> SpecialistMatcher:
+    """Матчер пересобирается автоматически, когда меняется список специалистов."""
+    fingerprint = specialists_fingerprint(specialists)
+    with _matchers_lock:
+        matcher = _matchers.get(fingerprint)
+        if matcher is None:
+            if len(_matchers) >= 64:
+                _matchers.clear()
+            matcher = _matchers[fingerprint] = SpecialistMatcher(specialists)
+        return matcher
+
+
+def match_specialist(text: str, specialists: List[Tuple[int, str]]) -> Optional[Tuple[int, str]]:
+    if not specialists:
+        return None
+    result = get_matcher(specialists).match(text)
+    with _matchers_lock:
+        _stats['local' if result else 'ambiguous'] += 1
+    return result
+
+
+def get_matcher_stats() -> Dict:
+    with _matchers_lock:
+        total = _stats['local'] + _stats['ambiguous']
+        return {
+            'matched_locally': _stats['local'],
+            'ambiguous': _stats['ambiguous'],
+            'local_rate': round(_stats['local'] / total, 3) if total else 0.0,
+            'matchers': len(_matchers)
+        }
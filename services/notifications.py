@@ -1,30 +1,287 @@
-from typing import List, Tuple
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 import telegram
-from config.settings import TOKEN
-from database.connection import get_db_connection
+from config.settings import (
+    TOKEN,
+    NOTIFY_WORKERS,
+    NOTIFY_QUEUE_SIZE,
+    NOTIFY_GLOBAL_RATE,
+    NOTIFY_CHAT_RATE,
+    NOTIFY_MAX_RETRIES,
+    MANAGERS_CACHE_TTL
+)
+from database.connection import get_db_connection, after_commit
+from utils.cache import TTLCache
 from utils.logger import logger
 
 bot = telegram.Bot(token=TOKEN)
 
-def get_active_managers() -> List[Tuple]:
+managers_cache = TTLCache(ttl=MANAGERS_CACHE_TTL, name="managers")
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас. Без блокировок — их держит владелец."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 — токен есть)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """После 429 токены появятся не раньше чем через seconds."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class NotificationDispatcher:
+    """
+    Отправка уведомлений в фоне пулом из workers потоков.
+    - submit только кладёт сообщение в ограниченную очередь и сразу возвращается;
+    - перед отправкой берётся токен из общего ведра (лимит бота) и из ведра чата;
+      если токена нет, сообщение откладывается до его появления, поток не простаивает;
+    - на 429 (RetryAfter) сообщение повторяется через указанное Telegram время,
+      на сетевые ошибки и 5xx — с экспоненциальной задержкой, не больше max_retries раз;
+      остальные ошибки (неверный чат, бот заблокирован) не повторяются.
+    """
+
+    MAX_IDLE_BUCKETS = 10000
+
+    def __init__(self, workers: int, maxsize: int, global_rate: float, chat_rate: float, max_retries: int,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        self._workers_count = max(1, workers)
+        self.maxsize = maxsize
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chats: Dict[int, TokenBucket] = {}
+        # Куча (когда можно отправлять, порядковый номер, chat_id, текст, попытка, on_done)
+        self._heap: List[Tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._busy = 0
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._rejected = 0
+        self._throttled = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self._workers_count):
+            thread = threading.Thread(target=self._worker, name=f"notify-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Запущено {self._workers_count} потоков отправки уведомлений")
+
+    def submit(self, chat_id: int, text: str, on_done: Optional[Callable[[bool], None]] = None) -> bool:
+        """
+        Ставит сообщение в очередь. Возвращает False, если очередь переполнена.
+        on_done(доставлено) вызывается из рабочего потока, когда сообщение
+        отправлено или попытки закончились.
+        """
+        with self._cond:
+            if len(self._heap) >= self.maxsize:
+                self._rejected += 1
+                logger.warning(f"Очередь уведомлений переполнена, сообщение в чат {chat_id} отброшено")
+                return False
+            self._push(time.monotonic(), chat_id, text, 0, on_done)
+            return True
+
+    def _push(self, ready_at: float, chat_id: int, text: str, attempt: int,
+              on_done: Optional[Callable[[bool], None]]) -> None:
+        heapq.heappush(self._heap, (ready_at, next(self._seq), chat_id, text, attempt, on_done))
+        # Будим всех: среди ждущих может быть flush, а не рабочий поток
+        self._cond.notify_all()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_IDLE_BUCKETS:
+                # Полные вёдра ничего не ограничивают — их можно забыть
+                self._chats = {key: b for key, b in self._chats.items() if not b.is_full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1.0)
+        return bucket
+
+    def _next_job(self) -> Tuple:
+        """Ждёт сообщение, для которого есть токены в обоих вёдрах, и забирает их."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                ready_at = self._heap[0][0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                _, _, chat_id, text, attempt, on_done = heapq.heappop(self._heap)
+                bucket = self._chat_bucket(chat_id, now)
+                wait = max(self._global.delay(now), bucket.delay(now))
+                if wait > 0:
+                    self._throttled += 1
+                    self._push(now + wait, chat_id, text, attempt, on_done)
+                    continue
+                self._global.take()
+                bucket.take()
+                self._busy += 1
+                return chat_id, text, attempt, on_done, ready_at
+
+    def _worker(self) -> None:
+        while True:
+            chat_id, text, attempt, on_done, ready_at = self._next_job()
+            retry_in: Optional[float] = None
+            try:
+                bot.send_message(chat_id, text)
+            except telegram.error.RetryAfter as e:
+                retry_in = float(e.retry_after)
+                with self._cond:
+                    now = time.monotonic()
+                    self._chat_bucket(chat_id, now).pause(now, retry_in)
+            except telegram.error.BadRequest as e:
+                # BadRequest — подкласс NetworkError, но повтор тут не поможет
+                logger.error(f"Уведомление в чат {chat_id} не доставлено: {e}")
+                retry_in = -1
+            except telegram.error.NetworkError as e:
+                # TimedOut, обрывы соединения и 5xx (Bad Gateway и т.п.)
+                retry_in = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                logger.warning(f"Ошибка отправки уведомления в чат {chat_id} (попытка {attempt + 1}): {e}")
+            except telegram.error.TelegramError as e:
+                # Бот заблокирован, чат не найден и т.п.
+                logger.error(f"Уведомление в чат {chat_id} не доставлено: {e}")
+                retry_in = -1
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления в чат {chat_id}: {e}", exc_info=True)
+                retry_in = -1
+            delivered: Optional[bool] = None
+            with self._cond:
+                self._busy -= 1
+                if retry_in is None:
+                    delivered = True
+                    self._sent += 1
+                    latency = time.monotonic() - ready_at
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+                elif retry_in < 0 or attempt >= self.max_retries:
+                    delivered = False
+                    self._failed += 1
+                    if retry_in >= 0:
+                        logger.error(f"Уведомление в чат {chat_id} не доставлено после {attempt + 1} попыток")
+                else:
+                    self._retried += 1
+                    self._push(time.monotonic() + retry_in, chat_id, text, attempt + 1, on_done)
+                if not self._heap and not self._busy:
+                    self._cond.notify_all()
+            if delivered is not None and on_done is not None:
+                try:
+                    on_done(delivered)
+                except Exception as e:
+                    logger.error(f"Ошибка в обработчике завершения уведомления: {e}", exc_info=True)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Ждёт отправки очереди (при остановке процесса). Возвращает True, если очередь пуста."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._heap or self._busy) and self._threads:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self._heap
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'workers': self._workers_count,
+                'depth': len(self._heap),
+                'maxsize': self.maxsize,
+                'busy': self._busy,
+                'sent': self._sent,
+                'failed': self._failed,
+                'retried': self._retried,
+                'rejected': self._rejected,
+                'throttled': self._throttled,
+                'chat_buckets': len(self._chats),
+                'latency_avg_ms': round(self._latency_total / self._sent * 1000, 1) if self._sent else 0.0,
+                'latency_max_ms': round(self._latency_max * 1000, 1)
+            }
+
+
+notification_dispatcher = NotificationDispatcher(
+    workers=NOTIFY_WORKERS,
+    maxsize=NOTIFY_QUEUE_SIZE,
+    global_rate=NOTIFY_GLOBAL_RATE,
+    chat_rate=NOTIFY_CHAT_RATE,
+    max_retries=NOTIFY_MAX_RETRIES
+)
+
+def start_notification_dispatcher() -> None:
+    notification_dispatcher.start()
+
+def flush_notifications() -> None:
+    notification_dispatcher.flush()
+
+def get_notification_stats() -> Dict:
+    stats = notification_dispatcher.stats()
+    stats['managers_cache'] = managers_cache.stats()
+    return stats
+
+def send_notification(chat_id: int, message: str) -> None:
+    """Отправляет сообщение в фоне после коммита текущей транзакции."""
+    after_commit(lambda: notification_dispatcher.submit(chat_id, message))
+
+def invalidate_managers() -> None:
+    after_commit(managers_cache.clear)
+
+def _fetch_active_managers() -> List[Tuple]:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
-            SELECT m.chat_id, ns.notify_new_booking, 
+            SELECT m.chat_id, ns.notify_new_booking,
                    ns.notify_cancellation, ns.notify_reschedule
             FROM managers m
             JOIN notification_settings ns ON ns.manager_id = m.id
             WHERE m.is_active = true
         """)
-        return cur.fetchall()
+        return [tuple(row) for row in cur.fetchall()]
     finally:
         cur.close()
         conn.close()
 
-def notify_managers(message: str, notification_type: str = 'new_booking') -> None:
-    managers = get_active_managers()
-    for mgr in managers:
+def get_active_managers() -> List[Tuple]:
+    return managers_cache.get_or_load(("active",), _fetch_active_managers)
+
+def manager_chat_ids(notification_type: str) -> List[int]:
+    """Чаты активных менеджеров, включивших уведомления этого типа."""
+    chat_ids = []
+    for mgr in get_active_managers():
         chat_id, notify_new, notify_cancel, notify_reschedule = mgr
         should_notify = (
             (notification_type == 'new_booking' and notify_new) or
@@ -32,10 +289,12 @@ def notify_managers(message: str, notification_type: str = 'new_booking') -> Non
             (notification_type == 'reschedule' and notify_reschedule)
         )
         if should_notify:
-            try:
-                bot.send_message(chat_id, message)
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления менеджеру {chat_id}: {e}")
+            chat_ids.append(chat_id)
+    return chat_ids
+
+def notify_managers(message: str, notification_type: str = 'new_booking') -> None:
+    for chat_id in manager_chat_ids(notification_type):
+        send_notification(chat_id, message)
 
 def register_manager(chat_id: int, username: str = None) -> bool:
     conn = get_db_connection()
@@ -55,6 +314,7 @@ def register_manager(chat_id: int, username: str = None) -> bool:
             VALUES (%s)
         """, (manager_id,))
         conn.commit()
+        invalidate_managers()
         return True
     finally:
         cur.close()
@@ -0,0 +1,197 @@
+import threading
+import time
+from typing import Dict, List
+from config.settings import (
+    MANAGER_CHAT_ID,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_RETENTION_DAYS
+)
+from database.connection import after_commit
+from database.queries import claim_booking_events, mark_booking_events_processed, prune_booking_events
+from services.notifications import notification_dispatcher, manager_chat_ids
+from utils.logger import logger
+
+# Как часто (сек) удалять старые обработанные события
+PRUNE_INTERVAL = 3600
+
+EVENT_TITLES = {
+    'new_booking': "Новая запись!",
+    'cancellation': "Запись отменена!",
+    'reschedule': "Запись перенесена!"
+}
+
+
+def render_event(event: Dict) -> str:
+    payload = event['payload'] or {}
+    client = f"Клиент ID: {payload.get('user_id')}"
+    if payload.get('user_name'):
+        client += f" ({payload['user_name']})"
+    lines = [
+        EVENT_TITLES.get(event['event_type'], "Изменение записи"),
+        f"Услуга: {payload.get('service')}",
+        f"Специалист: {payload.get('specialist')}",
+        f"Время: {payload.get('date_time')}",
+        client
+    ]
+    if event['event_type'] != 'new_booking':
+        lines.append(f"ID брони: {event['booking_id']}")
+    return "\n".join(lines)
+
+
+def event_recipients(event_type: str) -> List[int]:
+    """Менеджеры по их настройкам уведомлений и чат менеджера из настроек (ему — все события)."""
+    recipients = manager_chat_ids(event_type)
+    if MANAGER_CHAT_ID and MANAGER_CHAT_ID not in recipients:
+        recipients.append(MANAGER_CHAT_ID)
+    return recipients
+
+
+class OutboxRelay:
+    """
+    Рассылает события из booking_events, записанные вместе с записями.
+    - пачка событий забирается на lease_seconds (FOR UPDATE SKIP LOCKED),
+      поэтому несколько реплик делят работу и не шлют одно событие дважды;
+    - сообщения отправляет общий NotificationDispatcher (лимиты, повторы);
+    - событие отмечается обработанным, только когда все его сообщения
+      отправлены или исчерпали попытки; если процесс упал раньше,
+      по истечении срока событие будет выдано снова (доставка «хотя бы раз»).
+    """
+
+    def __init__(self, batch_size: int, interval: float, lease_seconds: float, retention_days: int):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.retention_days = retention_days
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Событие -> сколько его сообщений ещё в очереди отправки
+        self._pending: Dict[int, Dict] = {}
+        self._done: List[int] = []
+        self._last_prune = 0.0
+        self._claimed = 0
+        self._processed = 0
+        self._failed_sends = 0
+        self._requeued = 0
+        self._errors = 0
+        self._last_run_ms = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+        self._thread.start()
+
+    def trigger(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.run_once() >= self.batch_size:
+                    # Пачка полная — скорее всего, есть ещё
+                    continue
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                logger.error(f"Ошибка рассылки событий по записям: {e}", exc_info=True)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def run_once(self) -> int:
+        """Отмечает завершённые события и раздаёт следующую пачку. Возвращает размер пачки."""
+        started = time.monotonic()
+        with self._lock:
+            done, self._done = self._done, []
+        if done and not mark_booking_events_processed(done):
+            with self._lock:
+                self._done += done
+        elif done:
+            with self._lock:
+                self._processed += len(done)
+
+        events = claim_booking_events(self.batch_size, self.lease_seconds)
+        for event in events:
+            with self._lock:
+                if event['id'] in self._pending:
+                    # Срок истёк, но сообщения ещё в очереди отправки
+                    continue
+                self._claimed += 1
+            self._deliver(event)
+
+        if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            pruned = prune_booking_events(self.retention_days)
+            if pruned:
+                logger.info(f"Удалено {pruned} обработанных событий по записям")
+        with self._lock:
+            self._last_run_ms = (time.monotonic() - started) * 1000
+        return len(events)
+
+    def _deliver(self, event: Dict) -> None:
+        recipients = event_recipients(event['event_type'])
+        if not recipients:
+            self._finish(event['id'])
+            return
+        text = render_event(event)
+        state = {'left': len(recipients)}
+        with self._lock:
+            self._pending[event['id']] = state
+        for chat_id in recipients:
+            on_done = lambda delivered, event_id=event['id']: self._on_sent(event_id, state, delivered)
+            if not notification_dispatcher.submit(chat_id, text, on_done=on_done):
+                # Очередь отправки переполнена: событие выдадут снова по истечении срока
+                with self._lock:
+                    self._pending.pop(event['id'], None)
+                    self._requeued += 1
+                return
+
+    def _on_sent(self, event_id: int, state: Dict, delivered: bool) -> None:
+        with self._lock:
+            if not delivered:
+                self._failed_sends += 1
+            if self._pending.get(event_id) is not state:
+                return
+            state['left'] -= 1
+            if state['left'] > 0:
+                return
+            del self._pending[event_id]
+        self._finish(event_id)
+
+    def _finish(self, event_id: int) -> None:
+        with self._lock:
+            self._done.append(event_id)
+        self._wakeup.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'claimed': self._claimed,
+                'processed': self._processed,
+                'in_flight': len(self._pending),
+                'awaiting_ack': len(self._done),
+                'failed_sends': self._failed_sends,
+                'requeued': self._requeued,
+                'errors': self._errors,
+                'last_run_ms': round(self._last_run_ms, 1)
+            }
+
+
+outbox_relay = OutboxRelay(
+    batch_size=OUTBOX_BATCH_SIZE,
+    interval=OUTBOX_POLL_INTERVAL,
+    lease_seconds=OUTBOX_LEASE_SECONDS,
+    retention_days=OUTBOX_RETENTION_DAYS
+)
+
+def start_outbox_relay() -> None:
+    outbox_relay.start()
+
+def request_outbox_relay() -> None:
+    """Будит рассылку после коммита транзакции, записавшей событие."""
+    after_commit(outbox_relay.trigger)
+
+def get_outbox_relay_stats() -> Dict:
+    return outbox_relay.stats()
@@ -0,0 +1,113 @@
+import hashlib
+import math
+from typing import Dict, List, Tuple
+from config.settings import GPT_PROMPT_TOKEN_BUDGET, GPT_SUMMARY_TOKEN_BUDGET
+from utils.cache import TTLCache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        _encoding = None
+
+# Сводки ранних реплик пересчитываются только когда меняется их набор
+summary_cache = TTLCache(ttl=6 * 3600, name="prompt_summary", max_size=5000)
+
+SUMMARY_SNIPPET_CHARS = 80
+# Служебные токены на каждое сообщение в формате chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Локальный подсчёт токенов: tiktoken, если установлен, иначе оценка
+    (латиница ~4 символа на токен, кириллица и прочее ~2.5).
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / 4 + other_chars / 2.5)
+
+
+def _format_turn(message: Dict) -> str:
+    return f"{message['role']}: {message['content']}\n"
+
+
+def summarize_turns(turns: List[Dict], budget: int) -> str:
+    """
+    Сворачивает ранние реплики в короткую сводку без обращения к модели:
+    берём начала сообщений, начиная с самых свежих, пока помещаемся в бюджет.
+    """
+    if not turns or budget <= 0:
+        return ""
+    key = hashlib.sha1("\x00".join(f"{m['role']}:{m['content']}" for m in turns).encode("utf-8")).hexdigest()
+    cached = summary_cache.get((key, budget))
+    if cached is not None:
+        return cached
+    lines: List[str] = []
+    used = 0
+    for message in reversed(turns):
+        snippet = " ".join(message['content'].split())
+        if len(snippet) > SUMMARY_SNIPPET_CHARS:
+            snippet = snippet[:SUMMARY_SNIPPET_CHARS].rstrip() + "…"
+        line = f"- {message['role']}: {snippet}\n"
+        cost = count_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    summary = "".join(reversed(lines))
+    summary_cache.set((key, budget), summary)
+    return summary
+
+
+def build_history_context(history: List[Dict], fixed_text: str,
+                          budget: int = GPT_PROMPT_TOKEN_BUDGET,
+                          summary_budget: int = GPT_SUMMARY_TOKEN_BUDGET) -> Tuple[str, Dict]:
+    """
+    Собирает часть промпта с историей: последние реплики целиком, сколько
+    помещается в бюджет после системного промпта и состояния записи
+    (fixed_text), а более ранние — свёрнутой сводкой.
+    Возвращает текст и сведения о раскладке бюджета для логов.
+    """
+    fixed_tokens = count_tokens(fixed_text) + 2 * MESSAGE_OVERHEAD_TOKENS
+    available = max(0, budget - fixed_tokens)
+    # Под сводку резервируем не больше четверти доступного бюджета,
+    # приоритет у последних реплик целиком
+    summary_reserve = min(summary_budget, available // 4)
+    recent: List[str] = []
+    used = 0
+    index = len(history)
+    while index > 0:
+        line = _format_turn(history[index - 1])
+        cost = count_tokens(line)
+        if used + cost > available - (summary_reserve if index > 1 else 0):
+            break
+        recent.append(line)
+        used += cost
+        index -= 1
+    older = history[:index]
+    summary = summarize_turns(older, min(summary_budget, max(0, available - used)))
+    context = ""
+    if summary:
+        context += f"Краткое содержание ранней беседы:\n{summary}"
+    if recent:
+        context += "История беседы:\n" + "".join(reversed(recent))
+    info = {
+        'fixed_tokens': fixed_tokens,
+        'history_tokens': used,
+        'summary_tokens': count_tokens(summary),
+        'turns_total': len(history),
+        'turns_included': len(recent),
+        'turns_summarized': len(older)
+    }
+    return context, info
@@ -0,0 +1,233 @@
+import datetime
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config.settings import (
+    REMINDER_OFFSETS_HOURS,
+    REMINDER_RELOAD_INTERVAL,
+    REMINDER_MISSED_GRACE_MINUTES,
+    REMINDER_RETENTION_DAYS
+)
+from database.queries import add_booking_listener, get_reminder_bookings, claim_reminders, prune_booking_reminders
+from services.notifications import notification_dispatcher
+from utils.logger import logger
+
+# Сколько напоминаний отмечать в БД одним запросом
+CLAIM_BATCH_SIZE = 100
+# Через сколько секунд повторить пачку, если отметить её в БД не удалось
+CLAIM_RETRY_DELAY = 30
+
+# (когда отправить, id записи, смещение в минутах, время записи)
+Reminder = Tuple[datetime.datetime, int, int, datetime.datetime]
+
+
+def format_offset(offset_minutes: int) -> str:
+    if offset_minutes % (24 * 60) == 0:
+        days = offset_minutes // (24 * 60)
+        return "завтра" if days == 1 else f"через {days} дн."
+    if offset_minutes % 60 == 0:
+        return f"через {offset_minutes // 60} ч"
+    return f"через {offset_minutes} мин"
+
+
+def render_reminder(reminder: Dict) -> str:
+    return (
+        f"Напоминаем о записи {format_offset(reminder['offset_minutes'])}!\n"
+        f"🎯 Услуга: {reminder['service_name']}\n"
+        f"👩‍💼 Специалист: {reminder['specialist_name']}\n"
+        f"📅 Время: {reminder['date_time'].strftime('%Y-%m-%d %H:%M')}"
+    )
+
+
+class ReminderScheduler:
+    """
+    Напоминания клиентам за offsets до записи.
+    - раз в reload_interval записи на ближайшие max(offsets) + reload_interval
+      читаются одним проходом по индексу и раскладываются в кучу по времени отправки;
+    - между перечитываниями куча обновляется по событиям создания/отмены записей
+      этого процесса; отменённые напоминания не удаляются из кучи, а пропускаются;
+    - поток спит до ближайшего напоминания, а не опрашивает bookings;
+    - перед отправкой напоминание отмечается в booking_reminders одним запросом
+      на пачку, поэтому при нескольких репликах оно уходит не больше одного раза;
+    - отправляет общий NotificationDispatcher с его лимитами.
+    Прочие реплики узнают об изменениях при следующем перечитывании; отменённую
+    запись отсеивает сама отметка перед отправкой.
+    """
+
+    def __init__(self, offsets_hours: List[float], reload_interval: float, missed_grace_minutes: int,
+                 retention_days: int):
+        self.offsets = sorted({int(hours * 60) for hours in offsets_hours if hours > 0}, reverse=True)
+        self.reload_interval = reload_interval
+        self.missed_grace = datetime.timedelta(minutes=missed_grace_minutes)
+        self.retention_days = retention_days
+        self.lookahead = datetime.timedelta(minutes=max(self.offsets, default=0), seconds=reload_interval)
+        self._cond = threading.Condition()
+        self._heap: List[Reminder] = []
+        # Запись -> её время; напоминание в куче действительно, пока время совпадает
+        self._bookings: Dict[int, datetime.datetime] = {}
+        self._window_end: Optional[datetime.datetime] = None
+        self._journal: Optional[List[Tuple[str, Dict]]] = None
+        self._thread = None
+        self._loaded = 0
+        self._reloads = 0
+        self._sent = 0
+        self._skipped = 0
+        self._rejected = 0
+        self._errors = 0
+        self._last_reload_ms = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None or not self.offsets:
+            return
+        add_booking_listener(self.on_booking_change)
+        self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+        self._thread.start()
+
+    def _schedule(self, booking_id: int, booking_time: datetime.datetime, sent_offsets, now: datetime.datetime,
+                  grace: datetime.timedelta) -> None:
+        """Кладёт в кучу напоминания записи; вызывается под блокировкой."""
+        self._bookings[booking_id] = booking_time
+        for offset in self.offsets:
+            if offset in sent_offsets:
+                continue
+            fire_at = booking_time - datetime.timedelta(minutes=offset)
+            if fire_at < now - grace:
+                # Время напоминания давно прошло (или запись сделана позже него)
+                continue
+            heapq.heappush(self._heap, (fire_at, booking_id, offset, booking_time))
+
+    def on_booking_change(self, kind: str, booking: Dict) -> None:
+        with self._cond:
+            if self._journal is not None:
+                self._journal.append((kind, booking))
+            self._apply(kind, booking, datetime.datetime.now())
+            self._cond.notify_all()
+
+    def _apply(self, kind: str, booking: Dict, now: datetime.datetime) -> None:
+        if kind == "cancel":
+            self._bookings.pop(booking['id'], None)
+        elif kind == "book" and self._window_end is not None and booking['date_time'] <= self._window_end:
+            # Напоминания, чьё время уже прошло к моменту записи, не отправляем
+            self._schedule(booking['id'], booking['date_time'], (), now, datetime.timedelta(0))
+
+    def reload(self) -> int:
+        """Перечитывает записи окна и заново строит кучу. Возвращает число загруженных записей."""
+        started = time.monotonic()
+        now = datetime.datetime.now()
+        window_end = now + self.lookahead
+        with self._cond:
+            self._journal = []
+        try:
+            bookings = get_reminder_bookings(now, window_end)
+        except Exception:
+            with self._cond:
+                self._journal = None
+            raise
+        with self._cond:
+            journal, self._journal = self._journal, None
+            self._heap = []
+            self._bookings = {}
+            self._window_end = window_end
+            for booking in bookings:
+                self._schedule(booking['id'], booking['date_time'], booking['sent_offsets'], now, self.missed_grace)
+            # Изменения, пришедшие во время чтения, поверх загруженного снимка
+            for kind, booking in journal:
+                self._apply(kind, booking, now)
+            self._loaded = len(bookings)
+            self._reloads += 1
+            self._last_reload_ms = (time.monotonic() - started) * 1000
+            self._cond.notify_all()
+        return len(bookings)
+
+    def _due(self, deadline: float) -> List[Reminder]:
+        """Ждёт до deadline (monotonic) или до наступления ближайших напоминаний и забирает их."""
+        with self._cond:
+            while True:
+                now = datetime.datetime.now()
+                due: List[Reminder] = []
+                while self._heap and self._heap[0][0] <= now and len(due) < CLAIM_BATCH_SIZE:
+                    reminder = heapq.heappop(self._heap)
+                    if self._bookings.get(reminder[1]) == reminder[3]:
+                        due.append(reminder)
+                    else:
+                        self._skipped += 1
+                if due:
+                    return due
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                if self._heap:
+                    remaining = min(remaining, max(0.0, (self._heap[0][0] - now).total_seconds()))
+                self._cond.wait(remaining)
+
+    def _send(self, due: List[Reminder]) -> None:
+        claimed = claim_reminders([(booking_id, offset) for _, booking_id, offset, _ in due])
+        if claimed is None:
+            # Ничего не отмечено — вернём пачку в кучу и попробуем позже
+            retry_at = datetime.datetime.now() + datetime.timedelta(seconds=CLAIM_RETRY_DELAY)
+            with self._cond:
+                for _, booking_id, offset, booking_time in due:
+                    heapq.heappush(self._heap, (retry_at, booking_id, offset, booking_time))
+            return
+        with self._cond:
+            self._skipped += len(due) - len(claimed)
+        for reminder in claimed:
+            if notification_dispatcher.submit(reminder['user_id'], render_reminder(reminder)):
+                with self._cond:
+                    self._sent += 1
+            else:
+                # Отметка уже сделана: повторно это напоминание не отправится
+                with self._cond:
+                    self._rejected += 1
+                logger.warning(f"Напоминание по записи {reminder['booking_id']} не отправлено: очередь переполнена")
+
+    def _run(self) -> None:
+        next_reload = 0.0
+        last_prune = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_reload:
+                    next_reload = time.monotonic() + self.reload_interval
+                    self.reload()
+                    if time.monotonic() - last_prune >= 24 * 3600:
+                        last_prune = time.monotonic()
+                        prune_booking_reminders(self.retention_days)
+                due = self._due(next_reload)
+                if due:
+                    self._send(due)
+            except Exception as e:
+                with self._cond:
+                    self._errors += 1
+                logger.error(f"Ошибка отправки напоминаний: {e}", exc_info=True)
+                time.sleep(5)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'offsets_minutes': self.offsets,
+                'scheduled': len(self._heap),
+                'bookings': len(self._bookings),
+                'loaded': self._loaded,
+                'reloads': self._reloads,
+                'sent': self._sent,
+                'skipped': self._skipped,
+                'rejected': self._rejected,
+                'errors': self._errors,
+                'next_at': self._heap[0][0].strftime("%Y-%m-%d %H:%M") if self._heap else None,
+                'last_reload_ms': round(self._last_reload_ms, 1)
+            }
+
+
+reminder_scheduler = ReminderScheduler(
+    offsets_hours=REMINDER_OFFSETS_HOURS,
+    reload_interval=REMINDER_RELOAD_INTERVAL,
+    missed_grace_minutes=REMINDER_MISSED_GRACE_MINUTES,
+    retention_days=REMINDER_RETENTION_DAYS
+)
+
+def start_reminder_scheduler() -> None:
+    reminder_scheduler.start()
+
+def get_reminder_stats() -> Dict:
+    return reminder_scheduler.stats()
@@ -0,0 +1,226 @@
+import datetime
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from config.settings import SCHEDULE_HORIZON_DAYS, SCHEDULE_MATERIALIZE_INTERVAL, AVAILABILITY_STEP_MINUTES
+from database.connection import db_session, after_commit
+from database.queries import (
+    get_service_duration,
+    get_schedule_templates,
+    get_schedule_exceptions,
+    get_schedule_materializations,
+    save_schedule_materializations,
+    add_free_time_slots,
+    remove_free_time_slots,
+    try_schedule_materializer_lock
+)
+from utils.logger import logger
+
+Window = Tuple[datetime.time, datetime.time]
+DayKey = Tuple[int, int, datetime.date]
+
+
+def expand_day(day: datetime.date, windows: List[Window], breaks: List[Window],
+               step_minutes: int, duration_minutes: int) -> List[datetime.datetime]:
+    """
+    Слоты дня по рабочим окнам: начало с шагом step_minutes, услуга целиком
+    помещается в окно и не задевает перерывы.
+    """
+    step = datetime.timedelta(minutes=step_minutes)
+    length = datetime.timedelta(minutes=duration_minutes or step_minutes)
+    busy = [(datetime.datetime.combine(day, start), datetime.datetime.combine(day, end)) for start, end in breaks]
+    slots: Set[datetime.datetime] = set()
+    for start, end in windows:
+        current = datetime.datetime.combine(day, start)
+        window_end = datetime.datetime.combine(day, end)
+        while current + length <= window_end:
+            if not any(b_start < current + length and b_end > current for b_start, b_end in busy):
+                slots.add(current)
+            current += step
+    return sorted(slots)
+
+
+def fingerprint(slots: List[datetime.datetime]) -> str:
+    return hashlib.sha1(",".join(slot.isoformat() for slot in slots).encode("utf-8")).hexdigest()
+
+
+def plan_slots(templates: List[Dict], exceptions: List[Dict], start_date: datetime.date, days: int
+               ) -> Dict[DayKey, List[datetime.datetime]]:
+    """Желаемые слоты по (специалист, услуга, день) с учётом перерывов и исключений на даты."""
+    by_pair: Dict[Tuple[int, int], Dict] = {}
+    for row in templates:
+        pair = by_pair.setdefault((row['specialist_id'], row['service_id']), {
+            'step': row['step_minutes'],
+            'windows': defaultdict(list),
+            'breaks': defaultdict(list)
+        })
+        target = pair['breaks'] if row['is_break'] else pair['windows']
+        target[row['weekday']].append((row['start_time'], row['end_time']))
+
+    by_day: Dict[Tuple[int, datetime.date], List[Dict]] = defaultdict(list)
+    for exception in exceptions:
+        by_day[(exception['specialist_id'], exception['date'])].append(exception)
+        # Дополнительные часы по услуге без шаблона тоже разворачиваем
+        if exception['is_available'] and exception['service_id'] is not None:
+            by_pair.setdefault((exception['specialist_id'], exception['service_id']), {
+                'step': AVAILABILITY_STEP_MINUTES,
+                'windows': defaultdict(list),
+                'breaks': defaultdict(list)
+            })
+
+    plans: Dict[DayKey, List[datetime.datetime]] = {}
+    for (spec_id, service_id), pair in by_pair.items():
+        duration = get_service_duration(service_id)
+        for offset in range(days):
+            day = start_date + datetime.timedelta(days=offset)
+            day_off = False
+            extra: List[Window] = []
+            breaks = list(pair['breaks'].get(day.weekday(), ()))
+            for exception in by_day.get((spec_id, day), ()):
+                if exception['service_id'] is not None and exception['service_id'] != service_id:
+                    continue
+                if exception['start_time'] is None or exception['end_time'] is None:
+                    day_off = day_off or not exception['is_available']
+                elif exception['is_available']:
+                    extra.append((exception['start_time'], exception['end_time']))
+                else:
+                    breaks.append((exception['start_time'], exception['end_time']))
+            # В выходной шаблон не действует, дополнительные часы — действуют
+            windows = ([] if day_off else list(pair['windows'].get(day.weekday(), ()))) + extra
+            slots = expand_day(day, windows, breaks, pair['step'], duration)
+            if slots:
+                plans[(spec_id, service_id, day)] = slots
+    return plans
+
+
+class ScheduleMaterializer:
+    """
+    Разворачивает недельные шаблоны расписания в booking_times на horizon_days вперёд.
+    - для каждого (специалист, услуга, день) считается отпечаток желаемых слотов;
+      дни с неизменным отпечатком пропускаются;
+    - по изменившимся дням добавляются новые слоты и удаляются ранее развёрнутые,
+      которых больше нет (вручную добавленные слоты не трогаются, занятые тоже);
+    - запись пачками: по одному INSERT и одному DELETE на пару специалист-услуга;
+    - запускается раз в interval секунд и сразу после изменения шаблона.
+    """
+
+    def __init__(self, horizon_days: int, interval: float):
+        self.horizon_days = horizon_days
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._runs = 0
+        self._skipped = 0
+        self._errors = 0
+        self._days_changed = 0
+        self._slots_added = 0
+        self._slots_removed = 0
+        self._last_run_ms = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="schedule-materializer", daemon=True)
+        self._thread.start()
+
+    def trigger(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                logger.error(f"Ошибка разворачивания шаблонов расписания: {e}", exc_info=True)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def run_once(self) -> Dict:
+        started = time.monotonic()
+        today = datetime.date.today()
+        end = today + datetime.timedelta(days=self.horizon_days)
+        report = {'days_changed': 0, 'slots_added': 0, 'slots_removed': 0}
+        with db_session():
+            if not try_schedule_materializer_lock():
+                # Другая реплика уже разворачивает шаблоны
+                with self._lock:
+                    self._skipped += 1
+                return report
+            plans = plan_slots(get_schedule_templates(), get_schedule_exceptions(today, end), today, self.horizon_days)
+            stored = get_schedule_materializations(today, end)
+
+            additions: Dict[Tuple[int, int], List[datetime.datetime]] = defaultdict(list)
+            removals: Dict[Tuple[int, int], List[datetime.datetime]] = defaultdict(list)
+            rows: Dict[Tuple[int, int], List] = defaultdict(list)
+            for key in set(plans) | set(stored):
+                desired = plans.get(key, [])
+                new_fingerprint = fingerprint(desired)
+                previous = stored.get(key)
+                if previous is not None and previous[0] == new_fingerprint:
+                    continue
+                if previous is None and not desired:
+                    continue
+                spec_id, service_id, day = key
+                previous_slots = set(previous[1]) if previous else set()
+                additions[(spec_id, service_id)] += [s for s in desired if s not in previous_slots]
+                removals[(spec_id, service_id)] += sorted(previous_slots.difference(desired))
+                rows[(spec_id, service_id)].append((spec_id, service_id, day, new_fingerprint, desired))
+
+            saved_rows = []
+            for pair, pair_rows in rows.items():
+                spec_id, service_id = pair
+                added = add_free_time_slots(spec_id, service_id, [s.strftime("%Y-%m-%d %H:%M") for s in additions[pair]])
+                if added['failed']:
+                    # Запись не удалась — отпечатки не сохраняем, повторим в следующий раз
+                    logger.error(f"Не удалось развернуть шаблон специалиста {spec_id} по услуге {service_id}")
+                    continue
+                removed = remove_free_time_slots(spec_id, service_id, [s.strftime("%Y-%m-%d %H:%M") for s in removals[pair]])
+                saved_rows += pair_rows
+                report['days_changed'] += len(pair_rows)
+                report['slots_added'] += len(added['added'])
+                report['slots_removed'] += len(removed['removed'])
+            save_schedule_materializations(saved_rows, prune_before=today)
+
+        elapsed = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._runs += 1
+            self._days_changed += report['days_changed']
+            self._slots_added += report['slots_added']
+            self._slots_removed += report['slots_removed']
+            self._last_run_ms = elapsed
+        if report['days_changed']:
+            logger.info(
+                f"Шаблоны расписания: изменено дней {report['days_changed']}, "
+                f"добавлено слотов {report['slots_added']}, удалено {report['slots_removed']} ({elapsed:.0f} мс)"
+            )
+        return report
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'runs': self._runs,
+                'skipped': self._skipped,
+                'errors': self._errors,
+                'days_changed': self._days_changed,
+                'slots_added': self._slots_added,
+                'slots_removed': self._slots_removed,
+                'last_run_ms': round(self._last_run_ms, 1)
+            }
+
+
+schedule_materializer = ScheduleMaterializer(horizon_days=SCHEDULE_HORIZON_DAYS, interval=SCHEDULE_MATERIALIZE_INTERVAL)
+
+def start_schedule_materializer() -> None:
+    schedule_materializer.start()
+
+def request_materialization() -> None:
+    """Разворачивает шаблоны заново после коммита текущего изменения."""
+    after_commit(schedule_materializer.trigger)
+
+def get_schedule_materializer_stats() -> Dict:
+    return schedule_materializer.stats()
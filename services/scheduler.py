@@ -1,33 +1,155 @@
-from datetime import datetime, timedelta
-from database.queries import get_service_duration, get_specialist_work_hours, get_bookings_for_specialist_on_date
+import heapq
+import itertools
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from config.settings import AVAILABILITY_DAYS, AVAILABILITY_BUFFER_MINUTES
+from database.availability_index import availability_index
+from database.queries import get_service_duration, get_service_slot_data, get_specialist_service_ids
 
-def get_available_start_times(specialist_id: int, date_obj: datetime.date, service_id: int) -> list[str]:
-    duration = get_service_duration(service_id)
-    start_time, end_time = get_specialist_work_hours(specialist_id)
-    if not start_time or not end_time or duration <= 0:
+Interval = Tuple[datetime, datetime]
+
+# На сколько дней вперёд get_available_times читает слоты из БД, пока индекс не загружен
+DB_FALLBACK_DAYS = 365
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Сортирует и сливает пересекающиеся/смежные занятые интервалы."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def get_availability(specialist_ids: List[int], service_id: int, start_date: date, days: int = AVAILABILITY_DAYS,
+                     now: Optional[datetime] = None) -> Dict[int, Dict[date, List[datetime]]]:
+    """
+    Свободные начала записи на услугу для нескольких специалистов на days дней вперёд:
+    только свободные слоты booking_times, в которые услуга помещается, — ровно те,
+    что потом может занять create_booking. Берутся из индекса свободного времени,
+    пока он не загружен — одним запросом из БД по тому же правилу.
+    Возвращает {specialist_id: {дата: [datetime, ...]}}; прошедшее время не предлагается.
+    """
+    if days <= 0:
+        return {}
+    now = now or datetime.now()
+    range_end = datetime.combine(start_date, datetime.min.time()) + timedelta(days=days)
+    range_start = max(datetime.combine(start_date, datetime.min.time()), now)
+    if range_start >= range_end:
+        return {}
+
+    per_spec: Dict[int, List[datetime]] = {}
+    missing: List[int] = []
+    for spec_id in specialist_ids:
+        indexed = availability_index.free_times(spec_id, service_id, range_start)
+        if indexed is None:
+            missing.append(spec_id)
+        else:
+            per_spec[spec_id] = [slot for slot in indexed if slot < range_end]
+    if missing:
+        per_spec.update(_db_free_times(missing, service_id, range_start, range_end))
+
+    availability: Dict[int, Dict[date, List[datetime]]] = {}
+    for spec_id, slots in per_spec.items():
+        per_day: Dict[date, List[datetime]] = {}
+        for slot in slots:
+            per_day.setdefault(slot.date(), []).append(slot)
+        availability[spec_id] = per_day
+    return availability
+
+
+def _db_free_times(specialist_ids: List[int], service_id: int, start: datetime, end: datetime
+                   ) -> Dict[int, List[datetime]]:
+    """Свободные начала записи из БД (одним запросом) по тому же правилу, что у индекса."""
+    duration = timedelta(minutes=get_service_duration(service_id))
+    data = get_service_slot_data(service_id, start, end)
+    result: Dict[int, List[datetime]] = {}
+    for spec_id in specialist_ids:
+        entry = data.get(spec_id)
+        if not entry:
+            result[spec_id] = []
+            continue
+        busy = merge_intervals(
+            (b_start, b_start + timedelta(minutes=b_duration or 0))
+            for b_start, b_duration in entry['bookings']
+        )
+        result[spec_id] = list(_fitting_slots(entry['slots'], busy, duration, start))
+    return result
+
+
+def get_available_times(spec_id: int, serv_id: Optional[int], now: Optional[datetime] = None) -> List[str]:
+    """
+    Свободные начала записи к специалисту по услуге (или по всем его услугам, если serv_id
+    не указан), "YYYY-MM-DD HH:MM". Берутся из индекса свободного времени; пока он
+    не загружен — из БД по тому же правилу, так что ответ от готовности индекса не зависит.
+    """
+    now = now or datetime.now()
+    slots = availability_index.free_times(spec_id, serv_id, now)
+    if slots is None:
+        service_ids = [serv_id] if serv_id else get_specialist_service_ids(spec_id)
+        found = set()
+        for service_id in service_ids:
+            found.update(_db_free_times([spec_id], service_id, now, now + timedelta(days=DB_FALLBACK_DAYS))[spec_id])
+        slots = sorted(found)
+    return [slot.strftime("%Y-%m-%d %H:%M") for slot in slots]
+
+
+def get_next_free_slots(specialist_id: int, service_id: int, days: int = AVAILABILITY_DAYS, limit: int = 10) -> List[str]:
+    """Ближайшие свободные начала записи к специалисту на неделю вперёд ("YYYY-MM-DD HH:MM")."""
+    per_day = get_availability([specialist_id], service_id, date.today(), days).get(specialist_id, {})
+    slots = [slot for day in sorted(per_day) for slot in per_day[day]]
+    return [slot.strftime("%Y-%m-%d %H:%M") for slot in slots[:limit]]
+
+
+def _fitting_slots(slots: List[datetime], busy: List[Interval], duration: timedelta,
+                   not_before: datetime, buffer: timedelta = timedelta(minutes=AVAILABILITY_BUFFER_MINUTES)
+                   ) -> Iterator[datetime]:
+    """
+    Лениво отдаёт слоты (отсортированные), в которые услуга помещается,
+    не задевая записи специалиста и перерыв buffer вокруг них, — то же правило,
+    что у индекса свободного времени.
+    """
+    i = 0
+    for slot in slots:
+        if slot < not_before:
+            continue
+        end = slot + duration
+        while i < len(busy) and busy[i][1] + buffer <= slot:
+            i += 1
+        if i < len(busy) and busy[i][0] - buffer < end:
+            continue
+        yield slot
+
+
+def find_earliest_slots(service_id: int, k: int = 5, days: int = AVAILABILITY_DAYS,
+                        exclude_specialist_id: Optional[int] = None,
+                        now: Optional[datetime] = None) -> List[Tuple[int, str, datetime]]:
+    """
+    K самых ранних пар (специалист, время), на которые можно записаться на услугу
+    в ближайшие days дней. Один запрос к БД, дальше слияние отсортированных
+    по специалистам потоков через кучу — просматривается ровно столько слотов,
+    сколько нужно для K ответов.
+    Возвращает [(specialist_id, имя, datetime), ...] по возрастанию времени.
+    """
+    duration_minutes = get_service_duration(service_id)
+    if duration_minutes <= 0 or k <= 0:
         return []
-    bookings = get_bookings_for_specialist_on_date(specialist_id, date_obj)
-    time_step = 30
-    available_slots = []
-    workday_start = datetime.combine(date_obj, start_time)
-    workday_end   = datetime.combine(date_obj, end_time)
-    current = workday_start
-    while True:
-        potential_end = current + timedelta(minutes=duration)
-        if potential_end > workday_end:
-            break
-        if not intersects_any_bookings(current, potential_end, bookings):
-            slot_str = current.strftime("%H:%M")
-            available_slots.append(slot_str)
-        current += timedelta(minutes=time_step)
-        if current >= workday_end:
-            break
-    return available_slots
-
-def intersects_any_bookings(start_dt: datetime, end_dt: datetime, bookings: list) -> bool:
-    for b in bookings:
-        b_start = b['start']
-        b_end = b_start + timedelta(minutes=b['duration'])
-        if not (end_dt <= b_start or start_dt >= b_end):
-            return True
-    return False
+    duration = timedelta(minutes=duration_minutes)
+    now = now or datetime.now()
+    data = get_service_slot_data(service_id, now, now + timedelta(days=days))
+
+    streams = []
+    for spec_id, entry in data.items():
+        if spec_id == exclude_specialist_id or not entry['slots']:
+            continue
+        busy = merge_intervals(
+            (b_start, b_start + timedelta(minutes=b_duration or 0))
+            for b_start, b_duration in entry['bookings']
+        )
+        fitting = _fitting_slots(entry['slots'], busy, duration, now)
+        streams.append(zip(fitting, itertools.repeat(spec_id), itertools.repeat(entry['name'])))
+    return [(spec_id, name, slot) for slot, spec_id, name in itertools.islice(heapq.merge(*streams), k)]
+
@@ -0,0 +1,138 @@
+import collections
+import threading
+import time
+from typing import Callable, Deque, Dict, Hashable, List, Set, Tuple
+import telegram
+from utils.logger import logger
+
+
+def shard_key(update: telegram.Update) -> Hashable:
+    """Обновления одного пользователя (или чата) попадают в один шард."""
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return ("update", update.update_id)
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь обновлений Telegram в памяти процесса.
+    Вебхук только кладёт обновление в очередь и сразу отвечает 200,
+    а обработку выполняют рабочие потоки.
+
+    Очередь разбита на шарды по пользователю: обновления одного пользователя
+    обрабатываются строго по порядку и никогда параллельно, а разные
+    пользователи обрабатываются одновременно. Шарды с работой обходятся
+    по кругу (одно обновление за раз), а размер очереди одного шарда
+    ограничен max_per_shard, поэтому активный пользователь не вытесняет остальных.
+    """
+
+    def __init__(self, process: Callable[[telegram.Update], None], maxsize: int, workers: int, max_per_shard: int):
+        self._process = process
+        self.maxsize = maxsize
+        self.max_per_shard = max_per_shard
+        self._workers_count = max(1, workers)
+        self._threads: List[threading.Thread] = []
+        self._cond = threading.Condition()
+        self._shards: Dict[Hashable, Deque[Tuple[float, telegram.Update]]] = {}
+        self._ready: Deque[Hashable] = collections.deque()
+        self._scheduled: Set[Hashable] = set()
+        self._depth = 0
+        self._busy = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._rejected_per_shard = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self._workers_count):
+            thread = threading.Thread(target=self._worker, name=f"update-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Запущено {self._workers_count} обработчиков очереди обновлений")
+
+    def submit(self, update: telegram.Update) -> bool:
+        """Кладёт обновление в очередь. Возвращает False, если очередь или шард переполнены."""
+        key = shard_key(update)
+        with self._cond:
+            shard = self._shards.get(key)
+            if self._depth >= self.maxsize:
+                self._rejected += 1
+                logger.warning(f"Очередь обновлений переполнена, обновление {update.update_id} отклонено")
+                return False
+            if shard is not None and len(shard) >= self.max_per_shard:
+                self._rejected += 1
+                self._rejected_per_shard += 1
+                logger.warning(f"Слишком много обновлений от {key}, обновление {update.update_id} отклонено")
+                return False
+            if shard is None:
+                shard = self._shards[key] = collections.deque()
+            shard.append((time.monotonic(), update))
+            self._depth += 1
+            if key not in self._scheduled:
+                self._scheduled.add(key)
+                self._ready.append(key)
+                self._cond.notify()
+            return True
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                enqueued_at, update = self._shards[key].popleft()
+                self._depth -= 1
+                self._busy += 1
+                waited = time.monotonic() - enqueued_at
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            failed = False
+            try:
+                self._process(update)
+            except Exception as e:
+                failed = True
+                logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._processed += 1
+                    if failed:
+                        self._failed += 1
+                    if self._shards[key]:
+                        # В конец очереди: сначала получат ход другие пользователи
+                        self._ready.append(key)
+                        self._cond.notify()
+                    else:
+                        del self._shards[key]
+                        self._scheduled.discard(key)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            avg = self._wait_total / self._processed if self._processed else 0.0
+            backlogs = sorted(
+                ((len(items), key) for key, items in self._shards.items()),
+                key=lambda item: item[0],
+                reverse=True
+            )
+            return {
+                'depth': self._depth,
+                'maxsize': self.maxsize,
+                'workers': self._workers_count,
+                'busy': self._busy,
+                'shards': len(self._shards),
+                'ready_shards': len(self._ready),
+                'max_shard_backlog': backlogs[0][0] if backlogs else 0,
+                'top_shards': [{'key': str(key), 'backlog': size} for size, key in backlogs[:5]],
+                'processed': self._processed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'rejected_per_shard_limit': self._rejected_per_shard,
+                'wait_avg_ms': round(avg * 1000, 3),
+                'wait_max_ms': round(self._wait_max * 1000, 3)
+            }
@@ -0,0 +1,128 @@
+import collections
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш в памяти с временем жизни записей
+    и счётчиками попаданий/промахов. Если задан max_size, при переполнении
+    вытесняются давно не использованные записи (LRU).
+    get_or_load не сохраняет значение, если во время загрузки кэш сбросили:
+    загрузчик мог прочитать данные до изменения, ради которого сбрасывали.
+    """
+
+    def __init__(self, ttl: float, name: str = "cache", max_size: Optional[int] = None):
+        self.ttl = ttl
+        self.name = name
+        self.max_size = max_size
+        self._data: "collections.OrderedDict[Hashable, tuple]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._evictions = 0
+        self._stale_loads = 0
+        # Растёт при каждом сбросе; по нему get_or_load узнаёт, что загрузка устарела
+        self._generation = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self._misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+                    self._evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                generation = self._generation
+            value = loader()
+            with self._lock:
+                if self._generation != generation:
+                    self._stale_loads += 1
+                    return value
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._invalidations += 1
+            self._generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._invalidations += 1
+            self._generation += 1
+
+    def save(self, path: str) -> None:
+        """
+        Сохраняет живые записи в JSON-файл. Ключи-кортежи и значения
+        должны состоять из JSON-совместимых типов.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = [
+                [list(key) if isinstance(key, tuple) else key, value, expires_at - now]
+                for key, (value, expires_at) in self._data.items()
+                if expires_at > now
+            ]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"saved_at": time.time(), "entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> int:
+        """Загружает записи, сохранённые save(). Возвращает число загруженных записей."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        elapsed = time.time() - payload.get("saved_at", 0)
+        loaded = 0
+        for key, value, remaining in payload.get("entries", []):
+            ttl = remaining - elapsed
+            if ttl <= 0:
+                continue
+            self.set(tuple(key) if isinstance(key, list) else key, value, ttl=ttl)
+            loaded += 1
+        return loaded
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0,
+                'invalidations': self._invalidations,
+                'evictions': self._evictions,
+                'stale_loads': self._stale_loads
+            }
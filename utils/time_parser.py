@@ -0,0 +1,340 @@
+import re
+import datetime
+from typing import List, Optional, Tuple
+
+DEFAULT_WORK_START = datetime.time(9, 0)
+DEFAULT_WORK_END = datetime.time(18, 0)
+
+MONTHS = (
+    ('январ', 1), ('феврал', 2), ('март', 3), ('апрел', 4), ('ма', 5), ('июн', 6),
+    ('июл', 7), ('август', 8), ('сентябр', 9), ('октябр', 10), ('ноябр', 11), ('декабр', 12),
+)
+WEEKDAYS = (
+    ('понедельник', 0), ('вторник', 1), ('сред', 2), ('четверг', 3),
+    ('пятниц', 4), ('суббот', 5), ('воскресень', 6),
+)
+SHORT_WEEKDAYS = {'пн': 0, 'вт': 1, 'ср': 2, 'чт': 3, 'пт': 4, 'сб': 5, 'вс': 6}
+RELATIVE_DAYS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+# Время суток после часа: "в 5 вечера", "в 3 часа дня"
+PERIODS = {
+    'утра': 'morning', 'утром': 'morning',
+    'дня': 'day', 'днем': 'day',
+    'вечера': 'evening', 'вечером': 'evening',
+    'ночи': 'night', 'ночью': 'night',
+}
+# Слова, которые можно пропустить; любое другое оставшееся слово (в том числе
+# "не", "кроме", название месяца без числа) — повод отдать фразу GPT
+FILLER_WORDS = {
+    'в', 'во', 'на', 'и', 'я', 'мы', 'буду', 'будет', 'будем', 'могу', 'можно', 'тоже', 'время',
+    'свободен', 'свободна', 'свободно', 'свободны', 'свободное', 'свободным', 'свободной',
+    'освободи', 'освободить', 'добавь', 'добавить', 'открой', 'открыть',
+}
+
+_TIME = r"(\d{1,2})(?:[:.](\d{2}))?(?:\s+час(?:а|ов)?)?(?:\s+(утра|утром|дня|днем|вечера|вечером|ночи|ночью))?"
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+DOT_DATE_RE = re.compile(r"\b(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?\b")
+MONTH_DATE_RE = re.compile(r"\b(\d{1,2})(?:-?го|-?е)?\s+(январ|феврал|март|апрел|ма[яй]|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*")
+DAY_OF_MONTH_RE = re.compile(r"\b(\d{1,2})(?:-?го|-?е)?\s+числа\b|\b(\d{1,2})-?го\b")
+RELATIVE_RE = re.compile(r"\b(послезавтра|завтра|сегодня)\b")
+WEEKDAY_RE = re.compile(r"\b(?:(следующ[а-я]*)\s+)?(понедельник|вторник|сред|четверг|пятниц|суббот|воскресень)[а-я]*\b|\b(пн|вт|ср|чт|пт|сб|вс)\b")
+WHOLE_DAY_RE = re.compile(r"\b(?:весь|целый|полный)\s+(?:рабочий\s+)?день\b")
+RANGE_RE = re.compile(rf"\b(?:с|от)\s+{_TIME}\s*(?:до|по|-|–)\s*{_TIME}\b|\b{_TIME}\s*(?:-|–)\s*{_TIME}\b")
+AFTER_RE = re.compile(rf"\b(?:после|с|от)\s+{_TIME}\b")
+BEFORE_RE = re.compile(rf"\bдо\s+{_TIME}\b")
+POINT_RE = re.compile(rf"\b{_TIME}\b")
+
+# Окно времени: (начало, конец) для диапазона, (время, None) для отдельного слота
+Window = Tuple[datetime.time, Optional[datetime.time]]
+
+
+def _shift_hour(h: int, period: str) -> Optional[int]:
+    """Час с учётом времени суток: 5 вечера -> 17, 3 дня -> 15, 12 ночи -> 0."""
+    kind = PERIODS[period]
+    if kind == 'morning':
+        return h if 0 <= h <= 11 else None
+    if kind == 'day':
+        if 1 <= h <= 6:
+            return h + 12
+        return h if 11 <= h <= 18 else None
+    if kind == 'evening':
+        if 4 <= h <= 11:
+            return h + 12
+        return h if 16 <= h <= 23 else None
+    if h == 12:
+        return 0
+    if 9 <= h <= 11:
+        return h + 12
+    return h if 0 <= h <= 5 or 21 <= h <= 23 else None
+
+
+def _to_time(hour: str, minute: Optional[str], period: Optional[str] = None) -> Optional[datetime.time]:
+    h = int(hour)
+    m = int(minute) if minute else 0
+    if period:
+        shifted = _shift_hour(h, period)
+        if shifted is None:
+            return None
+        h = shifted
+    if h == 24 and m == 0:
+        return datetime.time(23, 59)
+    if 0 <= h <= 23 and 0 <= m <= 59:
+        return datetime.time(h, m)
+    return None
+
+
+def _to_range(start_groups: Tuple, end_groups: Tuple
+              ) -> Tuple[Optional[datetime.time], Optional[datetime.time]]:
+    """
+    Границы диапазона. Если время суток указано только у конца и конец после
+    полудня, начало тоже считается после полудня, когда так оно остаётся раньше
+    конца: "с 2 до 6 вечера" — 14:00-18:00, а "с 10 до 2 дня" — 10:00-14:00.
+    """
+    end = _to_time(*end_groups)
+    start = _to_time(*start_groups)
+    if start_groups[2] is None and end_groups[2] is not None and start is not None and end is not None \
+            and end.hour >= 12 and start.hour < 12:
+        shifted = start.replace(hour=start.hour + 12)
+        if shifted < end:
+            start = shifted
+    return start, end
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[datetime.date]:
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _upcoming(today: datetime.date, month: int, day: int) -> Optional[datetime.date]:
+    """Ближайшая (не прошедшая) дата с таким днём и месяцем."""
+    candidate = _safe_date(today.year, month, day)
+    if candidate is None or candidate < today:
+        candidate = _safe_date(today.year + 1, month, day)
+    return candidate
+
+
+def _cut(text: str, match: "re.Match") -> str:
+    return text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+
+
+def _extract_dates(text: str, today: datetime.date) -> Tuple[Optional[List[datetime.date]], str, bool]:
+    """
+    Даты из текста и остаток текста. Третий элемент — назван ли сегодняшний
+    день недели ("в субботу" в субботу): такую дату можно перенести на неделю.
+    """
+    dates: List[datetime.date] = []
+    weekday_today = False
+
+    for match in list(ISO_DATE_RE.finditer(text)):
+        date = _safe_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        if date is None:
+            return None, text, False
+        dates.append(date)
+        text = _cut(text, match)
+
+    for match in list(DOT_DATE_RE.finditer(text)):
+        day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        if not (1 <= month <= 12):
+            # "15.30" — это время, а не дата
+            continue
+        if year:
+            date = _safe_date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+        else:
+            date = _upcoming(today, month, day)
+        if date is None:
+            return None, text, False
+        dates.append(date)
+        text = _cut(text, match)
+
+    for match in list(MONTH_DATE_RE.finditer(text)):
+        month = next(number for prefix, number in MONTHS if match.group(2).startswith(prefix))
+        date = _upcoming(today, month, int(match.group(1)))
+        if date is None:
+            return None, text, False
+        dates.append(date)
+        text = _cut(text, match)
+
+    for match in list(DAY_OF_MONTH_RE.finditer(text)):
+        day = int(match.group(1) or match.group(2))
+        date = _safe_date(today.year, today.month, day)
+        if date is None or date < today:
+            next_month = (today.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            date = _safe_date(next_month.year, next_month.month, day)
+        if date is None:
+            return None, text, False
+        dates.append(date)
+        text = _cut(text, match)
+
+    for match in list(RELATIVE_RE.finditer(text)):
+        dates.append(today + datetime.timedelta(days=RELATIVE_DAYS[match.group(1)]))
+        text = _cut(text, match)
+
+    for match in list(WEEKDAY_RE.finditer(text)):
+        if match.group(3):
+            weekday = SHORT_WEEKDAYS[match.group(3)]
+        else:
+            weekday = next(number for prefix, number in WEEKDAYS if match.group(2).startswith(prefix))
+        days_ahead = (weekday - today.weekday()) % 7
+        if days_ahead == 0 and match.group(1):
+            days_ahead = 7
+        elif days_ahead == 0:
+            weekday_today = True
+        dates.append(today + datetime.timedelta(days=days_ahead))
+        text = _cut(text, match)
+
+    return dates, text, weekday_today
+
+
+def _extract_windows(text: str, work_start: datetime.time, work_end: datetime.time
+                     ) -> Tuple[Optional[List[Window]], str]:
+    """Окна времени: (начало, конец) для диапазонов и (время, None) для отдельных слотов."""
+    windows: List[Window] = []
+
+    for match in list(WHOLE_DAY_RE.finditer(text)):
+        windows.append((work_start, work_end))
+        text = _cut(text, match)
+
+    for match in list(RANGE_RE.finditer(text)):
+        groups = match.groups()
+        if groups[0] is not None:
+            start, end = _to_range(groups[0:3], groups[3:6])
+        else:
+            start, end = _to_range(groups[6:9], groups[9:12])
+        if start is None or end is None or end <= start:
+            return None, text
+        windows.append((start, end))
+        text = _cut(text, match)
+
+    for match in list(BEFORE_RE.finditer(text)):
+        end = _to_time(match.group(1), match.group(2), match.group(3))
+        if end is None or end <= work_start:
+            return None, text
+        windows.append((work_start, end))
+        text = _cut(text, match)
+
+    for match in list(AFTER_RE.finditer(text)):
+        # "после 15" / "с 15" без "до" — до конца рабочего дня
+        start = _to_time(match.group(1), match.group(2), match.group(3))
+        if start is None or start >= work_end:
+            return None, text
+        windows.append((start, work_end))
+        text = _cut(text, match)
+
+    has_marker = bool(re.search(r"\b(?:в|на|во)\b", text)) or ":" in text
+    for match in list(POINT_RE.finditer(text)):
+        point = _to_time(match.group(1), match.group(2), match.group(3))
+        if point is None or not (has_marker or match.group(2) or match.group(3)):
+            return None, text
+        windows.append((point, None))
+        text = _cut(text, match)
+
+    return windows, text
+
+
+def _parse_days_and_windows(text: str, work_start: datetime.time, work_end: datetime.time,
+                            now: datetime.datetime) -> Optional[Tuple[List[datetime.date], List[Window]]]:
+    """Даты и окна времени фразы или None, если фраза не распознана полностью."""
+    today = now.date()
+    cleaned = re.sub(r"\s+", " ", text.lower().replace("ё", "е")).strip()
+    if not cleaned:
+        return None
+
+    dates, rest, weekday_today = _extract_dates(cleaned, today)
+    if dates is None:
+        return None
+    windows, rest = _extract_windows(rest, work_start, work_end)
+    if not windows:
+        return None
+    if re.search(r"\d", rest):
+        # Остались нераспознанные числа — не угадываем
+        return None
+    if any(word not in FILLER_WORDS for word in re.findall(r"[a-zа-я]+", rest)):
+        # Остались нераспознанные слова ("не", "кроме", "вечером" без часа) — не угадываем
+        return None
+
+    latest = max(w[1] or w[0] for w in windows)
+    today_passed = datetime.datetime.combine(today, latest) <= now
+    if not dates:
+        # Без даты: сегодня, а если всё время уже прошло — завтра
+        dates = [today + datetime.timedelta(days=1) if today_passed else today]
+    elif weekday_today and today_passed:
+        # "в субботу в 10", сказанное в субботу после 10, — следующая суббота
+        dates = [date + datetime.timedelta(days=7) if date == today else date for date in dates]
+    return sorted(set(dates)), windows
+
+
+def parse_free_time(text: str,
+                    work_start: Optional[datetime.time] = None,
+                    work_end: Optional[datetime.time] = None,
+                    now: Optional[datetime.datetime] = None,
+                    step_minutes: int = 30) -> Optional[List[str]]:
+    """
+    Разбирает русскоязычное описание свободного времени без обращения к GPT:
+    "завтра весь день", "в пятницу с 10 до 14", "27 числа в 15", "2025-03-27 15:00",
+    "завтра с 2 до 6 вечера". Диапазоны разворачиваются в слоты с шагом step_minutes,
+    "весь день" — по рабочим часам специалиста. Возвращает слоты "YYYY-MM-DD HH:MM"
+    или None, если фраза не распознана полностью: остались числа или слова не из
+    FILLER_WORDS, например отрицание (тогда стоит спросить GPT).
+    """
+    now = now or datetime.datetime.now()
+    parsed = _parse_days_and_windows(text, work_start or DEFAULT_WORK_START, work_end or DEFAULT_WORK_END, now)
+    if parsed is None:
+        return None
+    dates, windows = parsed
+
+    step = datetime.timedelta(minutes=step_minutes)
+    slots = set()
+    for date in dates:
+        for start, end in windows:
+            current = datetime.datetime.combine(date, start)
+            if end is None:
+                if current > now:
+                    slots.add(current)
+                continue
+            window_end = datetime.datetime.combine(date, end)
+            while current < window_end:
+                if current > now:
+                    slots.add(current)
+                current += step
+    if not slots:
+        return None
+    return [slot.strftime("%Y-%m-%d %H:%M") for slot in sorted(slots)]
+
+
+def parse_free_time_ranges(text: str,
+                           work_start: Optional[datetime.time] = None,
+                           work_end: Optional[datetime.time] = None,
+                           now: Optional[datetime.datetime] = None
+                           ) -> Optional[List[Tuple[datetime.datetime, datetime.datetime]]]:
+    """
+    Та же фраза как интервалы [начало, конец) без разворачивания в слоты:
+    "завтра весь день", "в пятницу с 10 до 14". None, если фраза не распознана
+    или в ней есть отдельные моменты времени ("в 15"), а не только диапазоны.
+    Прошедшая часть интервалов отбрасывается.
+    """
+    now = now or datetime.datetime.now()
+    parsed = _parse_days_and_windows(text, work_start or DEFAULT_WORK_START, work_end or DEFAULT_WORK_END, now)
+    if parsed is None:
+        return None
+    dates, windows = parsed
+    if any(end is None for _, end in windows):
+        return None
+    ranges = []
+    for date in dates:
+        for start, end in windows:
+            range_start = max(datetime.datetime.combine(date, start), now)
+            range_end = datetime.datetime.combine(date, end)
+            if range_start < range_end:
+                ranges.append((range_start, range_end))
+    return sorted(ranges) or None
+
+
+def parse_date(text: str, now: Optional[datetime.datetime] = None) -> Optional[datetime.date]:
+    """Одна дата без времени: "2025-03-27", "27.03", "27 марта", "завтра", "в пятницу"."""
+    now = now or datetime.datetime.now()
+    cleaned = re.sub(r"\s+", " ", text.lower().replace("ё", "е")).strip()
+    dates, rest, _ = _extract_dates(cleaned, now.date())
+    if not dates or len(dates) != 1 or re.search(r"\d", rest):
+        return None
+    return dates[0]